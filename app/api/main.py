@@ -8,6 +8,7 @@ from typing import Dict, Optional, List
 from .security import limiter, verify_api_key
 from streaming.data_processor import StreamProcessor
 import asyncio
+import os
 from trading.strategy_engine import TradingEngine
 from services.model_explainer import ScoreExplainer
 from services.alert_manager import AlertManager
@@ -17,13 +18,16 @@ from services.alert_repository import AlertRepository
 from services.workflow_engine import WorkflowEngine
 from services.alert_correlator import AlertCorrelator
 from services.feature_history import FeatureHistory
-from services.performance_tracker import PerformanceTracker
+from services.timeseries_store import timeseries_store
+from services.performance_tracker import performance_tracker
+from services.metrics_broadcast import MetricsBroadcaster
 import pandas as pd
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 from services.autoscaler import AutoScaler
-from services.resource_monitor import ResourceMonitor
-from services.tracing import TracingCollector
-from fastapi import Request
+from services.resource_monitor import resource_monitor
+from services.tracing_collector import tracing_collector
+from services.red_metrics import red_metrics
+from fastapi import Request, Response
 from services.tracing import tracer
 import numpy as np
 from services.auto_rollback import TraceAwareRollback
@@ -32,7 +36,10 @@ from services.tracing_storage import TraceCompressor
 from services.lifecycle_manager import LifecyclePolicy
 from services.cost_analyzer import StorageCostAnalyzer
 from services.adaptive_policy import AdaptivePolicyEngine
-from services.trace_archiver import TraceArchiver
+from services.trace_query import TraceQueryPlanner
+from services.critical_path import CriticalPathAnalyzer
+from services.span_exporter import SpanExporter, FileSink, OTLPHttpSink
+from services.tracing_archiver import TraceArchiver, LocalArchiveStore, S3ArchiveStore
 from services.access_analyzer import AccessPatternAnalyzer
 from services.storage_optimizer import StorageOptimizer
 from services.cache_monitor import CacheMonitor
@@ -46,7 +53,7 @@ from services.data_repair import DataRepairEngine
 from services.repair_advisor import RepairAdvisor
 from services.repair_explainer import RepairExplainer
 from services.ab_testing import ABTestManager
-from datetime import datetime
+from datetime import datetime, timedelta
 
 app = FastAPI(
     title="BellaFund API",
@@ -213,11 +220,21 @@ async def get_model_versions():
         "versions": ai_scorer.model_versions
     }
 
+feature_history = FeatureHistory(timeseries_store)
+
 @app.get("/features/importance", tags=["Analysis"])
 async def get_feature_importance_history(feature: str, days: int = 30):
     """Get feature importance history trend"""
     return feature_history.get_trend(feature, days).to_dict(orient='records')
 
+@app.get("/features/drift", tags=["Analysis"])
+async def get_feature_drift(
+    hours: float = Query(24, gt=0, description="Window of recorded traffic"),
+    version: Optional[str] = Query(None, description="Restrict to one model version")
+):
+    """PSI, KS and z-score drift of every feature against the reference data"""
+    return ai_scorer.feature_monitor.drift_report(window_size=hours / 24, version=version)
+
 @app.get("/models/compare", tags=["Analysis"])
 async def compare_model_versions(
     version1: str = Query(..., description="Base model version"),
@@ -246,8 +263,6 @@ async def rollback_model_version(version: str):
     except ValueError as e:
         raise HTTPException(400, detail=str(e))
 
-performance_tracker = PerformanceTracker()
-
 @app.get("/models/metrics", tags=["Monitoring"])
 async def get_performance_metrics(
     version: str = Query(None, description="Filter by model version"),
@@ -301,14 +316,21 @@ async def check_performance_health():
     }
     return results
 
+performance_broadcaster = MetricsBroadcaster(performance_tracker)
+
 @app.websocket("/performance/stream")
-async def performance_stream(websocket: WebSocket):
-    """WebSocket for real-time performance metrics"""
+async def performance_stream(websocket: WebSocket, version: Optional[str] = None):
+    """WebSocket for real-time performance metrics
+
+    Sends a snapshot of the last minute, then deltas every 5 seconds
+    (optionally for one model version); slow clients are resynchronized
+    with a fresh snapshot instead of queueing frames.
+    """
     await websocket.accept()
-    while True:
-        latest = performance_tracker.get_metrics(window=pd.Timedelta(minutes=1))
-        await websocket.send_json(latest.to_dict(orient='records'))
-        await asyncio.sleep(5)  # Update every 5 seconds
+    try:
+        await performance_broadcaster.serve(websocket, version)
+    except WebSocketDisconnect:
+        pass
 
 @app.post("/autoscale", tags=["Infrastructure"])
 async def trigger_autoscale(api_key: str = Depends(verify_api_key)):
@@ -323,23 +345,97 @@ async def trigger_autoscale(api_key: str = Depends(verify_api_key)):
         "metrics": metrics
     }
 
+@app.on_event("startup")
+async def start_resource_monitor():
+    """Start collecting system metrics in the background"""
+    resource_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_resource_monitor():
+    resource_monitor.stop()
+    if timeseries_store is not None:
+        timeseries_store.close()
+
 @app.get("/system/metrics", tags=["Monitoring"])
-async def get_system_metrics(hours: int = 1):
-    """Get historical system metrics"""
-    return resource_monitor.metrics_history.tail(
-        int(hours * 60)  # Assuming 1 minute intervals
-    ).to_dict(orient='records')
+async def get_system_metrics(
+    hours: float = 1,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: int = Query(500, ge=1, le=10000)
+):
+    """Get historical system metrics
+
+    The resolution (1s, 1m or 1h rollups) is chosen from the range and
+    `max_points`; every point has min/max/mean/count per metric.
+    """
+    df = resource_monitor.history(start=start, end=end, window=pd.Timedelta(hours=hours),
+                                  max_points=max_points)
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
 
 @app.get("/tracing/traces", tags=["Observability"])
-async def get_recent_traces(limit: int = 100):
-    """Get recent traces with basic info"""
-    traces = tracing_collector.query_traces()
+async def get_recent_traces(
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    service: Optional[str] = None,
+    model_version: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    min_duration: Optional[float] = None
+):
+    """Get recent traces with basic info, newest first, across all storage tiers
+    Returns:
+        List: One page of spans; the X-Next-Cursor header resumes after it
+    """
+    try:
+        traces, next_cursor = trace_query.page(
+            start, end,
+            {"service": service, "model_version": model_version,
+             "endpoint": endpoint, "min_duration": min_duration},
+            limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [{
         "trace_id": t['trace_id'],
         "root_span": t,
         "duration": t['duration'],
         "start_time": t['start_time']
-    } for t in traces[-limit:]]
+    } for t in traces]
+
+@app.get("/tracing/sampling", tags=["Observability"])
+async def get_sampling_rates():
+    """Get effective tail-sampling rates (weight stored spans by 1 / rate)"""
+    return tracing_collector.sampler.effective_rates()
+
+@app.get("/tracing/export", tags=["Observability"])
+async def get_export_stats():
+    """Get per-sink span export counters (exported, retries, drops, queue depth)"""
+    exporter = tracing_collector.exporter
+    return exporter.stats() if exporter else {}
+
+@app.get("/tracing/critical-path", tags=["Analysis"])
+async def get_critical_path_breakdown(
+    minutes: int = 15,
+    model_version: Optional[str] = None,
+    top: int = 20,
+    max_spans: int = 200000
+):
+    """Rank operations by their share of end-to-end latency on trace critical paths
+    Returns:
+        Dict: Traces analyzed, p99 latency threshold and per-operation
+            share of total and of tail (>= p99) latency
+    """
+    return critical_path_analyzer.analyze_window(
+        trace_query,
+        start=datetime.now() - timedelta(minutes=minutes),
+        filters={"model_version": model_version},
+        max_spans=max_spans,
+        top=top
+    )
 
 @app.get("/tracing/trace/{trace_id}", tags=["Observability"])
 async def get_full_trace(trace_id: str):
@@ -352,43 +448,19 @@ async def analyze_model_traces(
     min_confidence: float = 0.7,
     days: int = 7
 ):
-    """Analyze specific model traces"""
-    traces = tracing_collector.query_traces({
-        "tags": {"model_version": version},
-        "min_duration": 0.5  # Analyze only requests longer than 500ms
-    })
-    
-    analysis = {
-        "performance_stats": calculate_performance_stats(traces),
-        "common_errors": detect_error_patterns(traces),
-        "feature_correlations": find_feature_impact(traces)
-    }
-    
-    return analysis
-
-def find_feature_impact(traces: list) -> dict:
-    """Identify feature impact on predictions"""
-    features = {}
-    for trace in traces:
-        if 'prediction_value' in trace['tags']:
-            for key in trace['tags']:
-                if key.startswith('feature_'):
-                    feature = key[8:]
-                    value = trace['tags'][key]
-                    prediction = float(trace['tags']['prediction_value'])
-                    
-                    if feature not in features:
-                        features[feature] = {
-                            'values': [],
-                            'predictions': []
-                        }
-                    features[feature]['values'].append(float(value))
-                    features[feature]['predictions'].append(prediction)
-    
-    # Calculate correlation
+    """Analyze specific model traces (aggregated at span ingest)"""
+    summary = red_metrics.summary(
+        "model_version", version, start=datetime.now() - timedelta(days=days)
+    )
     return {
-        feat: np.corrcoef(data['values'], data['predictions'])[0,1]
-        for feat, data in features.items()
+        "performance_stats": {
+            "count": summary["count"],
+            "rate": summary["rate"],
+            "error_rate": summary["error_rate"],
+            "latency": summary["latency"]
+        },
+        "common_errors": summary["error_types"],
+        "feature_correlations": summary["feature_correlations"]
     }
 
 @app.middleware("http")
@@ -426,20 +498,57 @@ async def trigger_auto_rollback(api_key: str = Depends(verify_api_key)):
 @app.get("/feature-stats", tags=["Analysis"])
 async def get_feature_statistics(feature: str = None):
     """Get feature statistics"""
-    return {
-        feature: feature_guard.feature_stats[feature]
-        if feature else feature_guard.feature_stats
-    }
-
-trace_compressor = TraceCompressor()
+    stats = feature_guard.feature_stats
+    return {feature: stats.get(feature) if feature else stats}
+
+# Feature tags of every finished span (tracer.end_span logs it to the
+# collector) feed the sliding-window feature statistics behind /feature-stats
+feature_guard = FeatureGuard(window_size=int(os.getenv("FEATURE_GUARD_WINDOW", "1000")))
+tracing_collector.observers.append(feature_guard.observe)
+
+trace_compressor = TraceCompressor(wal_dir=os.getenv("TRACE_WAL_DIR"))
+# Spans evicted from the in-memory span store move to compressed storage
+tracing_collector.on_evict = trace_compressor.add_trace
+# Archiving is opt-in: a local directory or an S3 bucket
+trace_archiver = None
+if os.getenv("TRACE_ARCHIVE_DIR"):
+    trace_archiver = TraceArchiver(LocalArchiveStore(os.getenv("TRACE_ARCHIVE_DIR")),
+                                   compressor=trace_compressor)
+elif os.getenv("TRACE_ARCHIVE_BUCKET"):
+    trace_archiver = TraceArchiver(S3ArchiveStore(os.getenv("TRACE_ARCHIVE_BUCKET")),
+                                   compressor=trace_compressor)
+trace_query = TraceQueryPlanner(tracing_collector, trace_compressor, trace_archiver)
+critical_path_analyzer = CriticalPathAnalyzer()
+
+# Optional span export: OTLP/HTTP collector and/or rotating local file
+_span_sinks = []
+if os.getenv("OTLP_TRACES_ENDPOINT"):
+    _span_sinks.append(OTLPHttpSink(os.getenv("OTLP_TRACES_ENDPOINT")))
+if os.getenv("TRACE_EXPORT_FILE"):
+    _span_sinks.append(FileSink(os.getenv("TRACE_EXPORT_FILE"), format=os.getenv("TRACE_EXPORT_FORMAT", "ndjson")))
+if _span_sinks:
+    tracing_collector.exporter = SpanExporter(_span_sinks)
+
+@app.on_event("shutdown")
+async def close_trace_storage():
+    """Persist in-memory traces before exit"""
+    tracing_collector.stop()
+    if tracing_collector.exporter:
+        tracing_collector.exporter.shutdown()
+    trace_compressor.close()
 
 @app.get("/tracing/storage/stats", tags=["Storage"])
 async def get_storage_stats():
     """Get tracing storage statistics"""
+    index = trace_compressor.index_stats()
     return {
         "memory_traces": len(trace_compressor.in_memory),
         "compressed_batches": len(trace_compressor.compressed_data),
-        "estimated_size": sum(len(b) for b in trace_compressor.compressed_data)
+        "estimated_size": sum(len(b) for b in trace_compressor.compressed_data),
+        "index_size": index['index_size'],
+        "segment_skip_ratio": index['skip_ratio'],
+        "integrity_failures": index['integrity_failures'],
+        "pipeline": trace_compressor.pipeline_stats()
     }
 
 @app.get("/storage/cost", tags=["Storage"])
@@ -464,7 +573,7 @@ async def get_current_policies():
     """Get current storage policies"""
     return {
         "hot_data_days": lifecycle_manager.policies['hot']['max_age'],
-        "archive_frequency": trace_archiver.archive_frequency
+        "archive_frequency": trace_archiver.archive_frequency if trace_archiver else None
     }
 
 @app.get("/storage/hotspots", tags=["Analysis"])
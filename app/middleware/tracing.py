@@ -1,6 +1,8 @@
+from fastapi import Request
+from services.tracing import tracer
+
 async def tracing_middleware(request: Request, call_next):
     """FastAPI middleware for distributed tracing"""
-    tracer = request.app.state.tracer
     headers = request.headers
     
     # Extract tracing context from headers
@@ -14,9 +16,16 @@ async def tracing_middleware(request: Request, call_next):
     # Start request span
     span = tracer.start_span(
         name=f"{request.method} {request.url.path}",
-        parent_id=f"{parent_ctx['trace_id']}:{parent_ctx['span_id']}" if parent_ctx else None
+        parent_id=f"{parent_ctx['trace_id']}:{parent_ctx['span_id']}" if parent_ctx else None,
+        remote_parent=parent_ctx is not None
     )
     
+    if not span.sampled:
+        try:
+            return await call_next(request)
+        finally:
+            tracer.end_span(span)
+
     # Propagate tracing headers
     request.state.trace_id = span['trace_id']
     request.state.span_id = span['span_id']
@@ -25,11 +34,10 @@ async def tracing_middleware(request: Request, call_next):
         response = await call_next(request)
     except Exception as e:
         tracer.add_tag('error', str(e))
+        tracer.add_tag('error_type', type(e).__name__)
         raise
     finally:
-        tracer.end_span()
-        # Log span to collector
-        tracing_collector.log_span(span)
+        tracer.end_span(span)  # Also logs the span to the collector
     
     # Inject tracing headers in response
     response.headers['x-trace-id'] = span['trace_id']
@@ -0,0 +1,94 @@
+"""
+PerformanceTracker: columnar store vs the previous DataFrame history
+Run from the repository root: python -m benchmarks.performance_tracker
+
+The previous tracker re-concatenated the whole history per row, so it is
+measured on far fewer rows; its per-append cost keeps growing with n.
+Timestamps are synthetic (one row per 10ms) so windows are meaningful.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from services.performance_tracker import PerformanceTracker
+
+VERSIONS = ('v1', 'v2', 'v3')
+
+
+class LegacyTracker:
+    """log_performance / get_metrics as they were before the columnar store"""
+
+    def __init__(self):
+        self.history = pd.DataFrame(columns=['timestamp', 'version'] + list(PerformanceTracker.METRICS))
+
+    def log_performance(self, timestamp, version: str, metrics: dict) -> None:
+        new_entry = {'timestamp': timestamp, 'version': version,
+                     **{k: metrics.get(k, None) for k in self.history.columns[2:]}}
+        self.history = pd.concat([self.history, pd.DataFrame([new_entry])], ignore_index=True)
+
+    def get_metrics(self, version: str, start) -> pd.DataFrame:
+        query = self.history[self.history.timestamp >= start]
+        return query[query.version == version].sort_values('timestamp')
+
+
+def _rows(n: int):
+    rng = np.random.default_rng(0)
+    base = pd.Timestamp('2024-05-01').value
+    accuracy = rng.normal(0.9, 0.01, n)
+    latency = rng.gamma(2.0, 0.02, n)
+    for i in range(n):
+        yield base + i * 10_000_000, VERSIONS[i % 3], {'accuracy': accuracy[i], 'latency': latency[i]}
+
+
+def bench_columnar(n: int) -> dict:
+    tracker = PerformanceTracker()
+    store = tracker.store
+    start = time.perf_counter()
+    for ts, version, metrics in _rows(n):
+        store.append(version, ts, store.row(metrics))
+    append_s = time.perf_counter() - start
+    last = pd.Timestamp('2024-05-01').value + (n - 1) * 10_000_000
+
+    start = time.perf_counter()
+    for _ in range(100):
+        tracker.get_metrics('v1', start=pd.Timestamp(last - 300 * 10**9))
+    window_s = (time.perf_counter() - start) / 100
+
+    start = time.perf_counter()
+    for _ in range(100):
+        np.nanpercentile(tracker.get_columns('v1', start=pd.Timestamp(last - 3600 * 10**9))['latency'], 99)
+    p99_s = (time.perf_counter() - start) / 100
+    return {'append_us': append_s / n * 1e6, 'window_ms': window_s * 1e3, 'p99_ms': p99_s * 1e3}
+
+
+def bench_legacy(n: int) -> dict:
+    tracker = LegacyTracker()
+    start = time.perf_counter()
+    for ts, version, metrics in _rows(n):
+        tracker.log_performance(pd.Timestamp(ts), version, metrics)
+    append_s = time.perf_counter() - start
+    last = pd.Timestamp('2024-05-01').value + (n - 1) * 10_000_000
+
+    start = time.perf_counter()
+    for _ in range(10):
+        tracker.get_metrics('v1', pd.Timestamp(last - 300 * 10**9))
+    window_s = (time.perf_counter() - start) / 10
+    return {'append_us': append_s / n * 1e6, 'window_ms': window_s * 1e3}
+
+
+def main(n: int = 1_000_000, legacy_n: int = 5_000):
+    columnar = bench_columnar(n)
+    legacy = bench_legacy(legacy_n)
+    print(f"columnar, {n} rows: {columnar['append_us']:.2f} us/append, "
+          f"5-min window {columnar['window_ms']:.3f} ms, 1h p99 {columnar['p99_ms']:.3f} ms")
+    print(f"legacy, {legacy_n} rows: {legacy['append_us']:.0f} us/append (grows with n), "
+          f"5-min window {legacy['window_ms']:.3f} ms")
+    # Mean cost over the first legacy_n appends is ~c * legacy_n / 2; total for n is ~c * n^2 / 2
+    estimate_s = legacy['append_us'] * 1e-6 * n * n / legacy_n
+    print(f"legacy 1M appends, extrapolated O(n^2): ~{estimate_s / 3600:.1f} h "
+          f"vs {columnar['append_us'] * n * 1e-6:.1f} s columnar")
+
+
+if __name__ == '__main__':
+    main()
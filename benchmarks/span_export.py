@@ -0,0 +1,71 @@
+"""
+Span export against a local OTLP/HTTP stub
+Run from the repository root: python -m benchmarks.span_export
+
+Measures TracingCollector.log_span latency without an exporter, with a
+healthy stub, with a stub that answers after 200ms, and with a stub that
+always returns 503 (retries, then counted drops).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.span_exporter import SpanExporter, OTLPHttpSink
+from services.tracing_collector import TracingCollector
+from benchmarks.span_memory import make_span_dicts
+
+
+class OTLPStub(BaseHTTPRequestHandler):
+    delay = 0.0
+    status = 200
+    received = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(type(self).delay)
+        if type(self).status == 200:
+            type(self).received += sum(len(scope['spans'])
+                                       for rs in body['resourceSpans'] for scope in rs['scopeSpans'])
+        self.send_response(type(self).status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+def _latencies(collector: TracingCollector, spans: list) -> dict:
+    samples = []
+    for span in spans:
+        start = time.perf_counter()
+        collector.log_span(span)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {'p50_us': samples[len(samples) // 2] * 1e6, 'p99_us': samples[int(len(samples) * 0.99)] * 1e6}
+
+
+def main(n: int = 50000):
+    spans = make_span_dicts(n)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OTLPStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_port}/v1/traces'
+
+    print(f"{'case':<14}{'p50 us':>10}{'p99 us':>10}  exporter stats")
+    result = _latencies(TracingCollector(capacity=n), spans)
+    print(f"{'no exporter':<14}{result['p50_us']:>10.1f}{result['p99_us']:>10.1f}")
+    for case, delay, status in (('healthy', 0.0, 200), ('slow 200ms', 0.2, 200), ('failing 503', 0.0, 503)):
+        OTLPStub.delay, OTLPStub.status, OTLPStub.received = delay, status, 0
+        exporter = SpanExporter([OTLPHttpSink(endpoint)], max_retries=2, backoff=0.05)
+        result = _latencies(TracingCollector(capacity=n, exporter=exporter), spans)
+        exporter.shutdown(timeout=30)
+        stats = next(iter(exporter.stats().values()))
+        print(f"{case:<14}{result['p50_us']:>10.1f}{result['p99_us']:>10.1f}  "
+              f"received={OTLPStub.received} exported={stats['exported']} retries={stats['retries']} "
+              f"dropped_full={stats['dropped_queue_full']} dropped_failed={stats['dropped_failed']}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Span ingestion throughput: store lock per span vs the batched write buffer
+Run from the repository root: python -m benchmarks.span_ingest
+"""
+import threading
+import time
+
+from services.compact_span import CompactSpan
+from services.tracing_collector import TracingCollector
+from benchmarks.span_memory import make_span_dicts
+
+
+class SingleLockCollector(TracingCollector):
+    """Previous write path: every span takes the global store lock"""
+
+    def log_span(self, span: dict) -> None:
+        compact = CompactSpan.from_dict(span)
+        with self.lock:
+            evicted = self.spans.append(compact)
+        if evicted is not None and self.on_evict:
+            self.on_evict(evicted)
+
+
+def _run(collector: TracingCollector, spans: list, threads: int) -> float:
+    """Spans/s with `threads` writers splitting `spans` between them"""
+    chunks = [spans[i::threads] for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def writer(chunk):
+        barrier.wait()
+        for span in chunk:
+            collector.log_span(span)
+
+    workers = [threading.Thread(target=writer, args=(c,)) for c in chunks]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    collector.flush()
+    return len(spans) / (time.perf_counter() - start)
+
+
+def main(n: int = 200000):
+    spans = make_span_dicts(n)
+    print(f"{'threads':>8}{'per span':>16}{'batched':>16}")
+    for threads in (1, 4, 16):
+        single = _run(SingleLockCollector(capacity=n), spans, threads)
+        batched = _run(TracingCollector(capacity=n), spans, threads)
+        print(f"{threads:>8}{single:>14.0f}/s{batched:>14.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Memory per retained span and msgpack speed: dict spans vs CompactSpan
+Run from the repository root: python -m benchmarks.span_memory
+
+Last run: 1648 -> 600 B/span (2.7x smaller, short of the 3-5x target;
+tag values are kept exact) and about 1.3x faster msgpack packing.
+"""
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+import msgpack
+
+from services.compact_span import CompactSpan
+
+FEATURES = [
+    'price_volatility', 'trading_volume', 'social_activity',
+    'liquidity_depth', 'whale_transactions', 'github_commits'
+]
+METRICS = {'memory_usage': 41.2, 'cpu_usage': 63.0, 'thread_count': 24, 'open_files': 17}
+
+
+def make_span_dicts(n: int) -> list:
+    """Spans shaped like model_prediction spans from TokenScorer"""
+    spans = []
+    now = datetime.now()
+    for i in range(n):
+        trace_id, span_id = str(uuid.uuid4()), str(uuid.uuid4())
+        start = now + timedelta(microseconds=i * 1500)
+        duration = random.uniform(0.005, 0.2)
+        tags = {
+            'model_version': f"v{i % 3 + 1}-2024-05-01",
+            'features_hash': random.getrandbits(63),
+            **{f"feature_{f}": random.random() for f in FEATURES},
+            'prediction_value': random.random()
+        }
+        spans.append({
+            'trace_id': trace_id,
+            'span_id': span_id,
+            'parent_id': f"{trace_id}:{uuid.uuid4()}",
+            'name': 'model_prediction',
+            'start_time': start,
+            'tags': tags,
+            'metrics': METRICS,  # Shared snapshot, as attached by ResourceSampler
+            'end_time': start + timedelta(seconds=duration),
+            'duration': duration
+        })
+    return spans
+
+
+def _retained_bytes(build) -> tuple:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return objects, size
+
+
+def _datetime_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(type(value))
+
+
+def main(n: int = 100000):
+    random.seed(0)
+    dict_spans, dict_bytes = _retained_bytes(lambda: make_span_dicts(n))
+    # Convert fresh spans so the compact side owns its tag values too
+    random.seed(0)
+    compact, compact_bytes = _retained_bytes(
+        lambda: [CompactSpan.from_dict(s) for s in make_span_dicts(n)]
+    )
+    print(f"dict spans:    {dict_bytes / n:8.0f} B/span")
+    print(f"CompactSpan:   {compact_bytes / n:8.0f} B/span "
+          f"({dict_bytes / compact_bytes:.1f}x smaller)")
+
+    start = time.perf_counter()
+    packed_dicts = msgpack.packb(dict_spans, default=_datetime_default, use_bin_type=True)
+    dict_pack = time.perf_counter() - start
+
+    start = time.perf_counter()
+    packed_compact = msgpack.packb([s.to_tuple() for s in compact], use_bin_type=True)
+    compact_pack = time.perf_counter() - start
+
+    print(f"msgpack dict:    {n / dict_pack:10.0f} spans/s, {len(packed_dicts) / n:6.0f} B/span")
+    print(f"msgpack compact: {n / compact_pack:10.0f} spans/s, {len(packed_compact) / n:6.0f} B/span")
+
+    assert all(c.to_dict()['tags'] == d['tags'] for c, d in zip(compact[:1000], dict_spans))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Range scans over months of metrics in the mmap'ed time-series store
+Run from the repository root: python -m benchmarks.timeseries_store [days]
+
+Writes `days` of one-row-per-second performance metrics for one model
+version, reopens the store cold, then times one-hour, one-day and
+30-day scans (p99 of latency) and reports the resident set growth.
+"""
+import sys
+import time
+import tempfile
+
+import numpy as np
+import psutil
+
+from services.performance_tracker import PerformanceTracker
+from services.timeseries_store import TimeSeriesStore
+
+DAY_NS = 86400 * 1_000_000_000
+
+
+def write(directory: str, days: int) -> int:
+    store = TimeSeriesStore(directory)
+    series = store.series('performance/v1', PerformanceTracker.METRICS)
+    rows = days * 86400
+    base = 1_700_000_000 * 1_000_000_000
+    rng = np.random.default_rng(0)
+    for start in range(0, rows, 86400):
+        n = min(86400, rows - start)
+        values = np.full((n, len(PerformanceTracker.METRICS)), np.nan)
+        values[:, PerformanceTracker.METRICS.index('latency')] = rng.gamma(2.0, 0.02, n)
+        series.append_many(base + (start + np.arange(n)) * 1_000_000_000, values)
+    store.close()
+    return base + (rows - 1) * 1_000_000_000
+
+
+def main(days: int = 90):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        newest = write(directory, days)
+        print(f"wrote {days * 86400} rows in {time.perf_counter() - start:.1f}s")
+
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        series = TimeSeriesStore(directory).open('performance/v1')
+        column = PerformanceTracker.METRICS.index('latency')
+        for label, span in (('1 hour', DAY_NS // 24), ('1 day', DAY_NS), ('30 days', 30 * DAY_NS)):
+            start = time.perf_counter()
+            p99 = max(np.nanpercentile(values[:, column], 99)
+                      for _, values in series.scan(newest - span, newest))
+            elapsed = time.perf_counter() - start
+            print(f"{label:>8}: {elapsed * 1e3:8.1f} ms  max per-segment p99 {p99:.4f}  "
+                  f"rss +{(process.memory_info().rss - rss) / 2**20:.1f} MB")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,65 @@
+"""
+Compression ratio and speed of trace segment codecs
+Run from the repository root: python -m benchmarks.trace_codecs
+
+Segments are packed exactly as TraceCompressor packs them (msgpack of
+CompactSpan tuples). The dictionary codec is trained on the first half of
+the segments and measured on the second half.
+"""
+import time
+
+import msgpack
+
+from services.compact_span import CompactSpan
+from services.trace_codecs import make_codec, zstandard
+from benchmarks.span_memory import make_span_dicts
+
+CODECS = ['zlib-1', 'zlib-6', 'zlib-9', 'zstd-1', 'zstd-3', 'zstd-9', 'zstd-19', 'zstd-dict-3']
+
+
+def make_segments(count: int, spans_per_segment: int) -> list:
+    spans = [CompactSpan.from_dict(s) for s in make_span_dicts(count * spans_per_segment)]
+    return [
+        msgpack.packb([s.to_tuple() for s in spans[i:i + spans_per_segment]], use_bin_type=True)
+        for i in range(0, len(spans), spans_per_segment)
+    ]
+
+
+def measure(codec, segments: list) -> dict:
+    raw = sum(len(s) for s in segments)
+    start = time.perf_counter()
+    compressed = [codec.compress(s) for s in segments]
+    compress_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for payload, dict_id in compressed:
+        codec.decompress(payload, dict_id)
+    decompress_s = time.perf_counter() - start
+    return {
+        'ratio': raw / sum(len(p) for p, _ in compressed),
+        'compress_mb_s': raw / compress_s / 1024**2,
+        'decompress_mb_s': raw / decompress_s / 1024**2
+    }
+
+
+def main(segments: int = 400, spans_per_segment: int = 100):
+    packed = make_segments(segments, spans_per_segment)
+    train, test = packed[:len(packed) // 2], packed[len(packed) // 2:]
+    print(f"{spans_per_segment} spans/segment, {sum(map(len, test)) / len(test):.0f} B/segment raw")
+    print(f"{'codec':<14}{'ratio':>8}{'compress MB/s':>16}{'decompress MB/s':>18}")
+    for spec in CODECS:
+        if spec.startswith('zstd') and zstandard is None:
+            print(f"{spec:<14}  skipped (zstandard not installed)")
+            continue
+        codec = make_codec(spec)
+        if spec.startswith('zstd-dict'):
+            codec.retrain_every = len(packed) * 10  # Train once, on `train` only
+            for segment in train:
+                codec.compress(segment)
+            codec.wait_for_training()
+        result = measure(codec, test)
+        print(f"{spec:<14}{result['ratio']:>8.2f}{result['compress_mb_s']:>16.1f}"
+              f"{result['decompress_mb_s']:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Startup recovery time of the on-disk trace segment log
+Run from the repository root: python -m benchmarks.trace_recovery [GB]
+
+Writes `GB` of segments (real headers, random payloads of a typical
+compressed size) to a temporary SegmentLog, then times a cold recover()
+with and without the index files.
+"""
+import os
+import sys
+import time
+import tempfile
+
+from services.compact_span import CompactSpan
+from services.trace_wal import SegmentLog
+from services.tracing_storage import Segment
+from benchmarks.span_memory import make_span_dicts
+
+
+def write_log(directory: str, total_bytes: int, payload_size: int = 16 * 1024,
+              spans_per_segment: int = 100) -> int:
+    spans = [CompactSpan.from_dict(s) for s in make_span_dicts(spans_per_segment)]
+    header = Segment.for_batch(spans, None).header()
+    payload = os.urandom(payload_size)
+    log = SegmentLog(directory, sync_every=256)
+    log.recover(Segment.from_header)
+    count = total_bytes // payload_size
+    for _ in range(count):
+        log.append(Segment.from_header(header, payload), header)
+    log.close()
+    return count
+
+
+def time_recovery(directory: str) -> tuple:
+    log = SegmentLog(directory)
+    start = time.perf_counter()
+    segments = log.recover(Segment.from_header)
+    elapsed = time.perf_counter() - start
+    log.close()
+    return len(segments), elapsed
+
+
+def main(gigabytes: float = 1.0):
+    with tempfile.TemporaryDirectory() as directory:
+        count = write_log(directory, int(gigabytes * 1024**3))
+        recovered, indexed_s = time_recovery(directory)
+        assert recovered == count
+        for name in os.listdir(directory):
+            if name.endswith('.idx'):
+                os.remove(os.path.join(directory, name))
+        _, scan_s = time_recovery(directory)
+        print(f"{count} segments, {gigabytes:.1f} GB")
+        print(f"recovery with index:    {indexed_s:6.2f}s  ({indexed_s * 10 / gigabytes:.2f}s per 10 GB)")
+        print(f"recovery rebuilding it: {scan_s:6.2f}s  ({scan_s * 10 / gigabytes:.2f}s per 10 GB)")
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
@@ -8,6 +8,7 @@ import joblib
 from typing import Dict
 from datetime import datetime
 from services.model_monitor import ModelMonitor
+from services.timeseries_store import timeseries_store
 from services.feature_monitor import FeatureMonitor
 from services.prediction_logger import PredictionLogger
 from services.tracing import tracer
@@ -41,7 +42,7 @@ class TokenScorer:
                 'model': self.model,
                 'created_at': datetime.now()
             }
-        self.performance_monitor = ModelMonitor()
+        self.performance_monitor = ModelMonitor(store=timeseries_store)
         self.fallback_model = FallbackModel()
         self.feature_monitor = FeatureMonitor(
             reference_data=load_reference_stats(),
@@ -66,10 +67,7 @@ class TokenScorer:
             
             try:
                 # Record feature distribution
-                self.feature_monitor.record_features(
-                    pd.DataFrame([sanitized]), 
-                    self.current_version
-                )
+                self.feature_monitor.record_features(sanitized, self.current_version)
                 # Add feature statistics tags
                 for feature in self.features:
                     tracer.add_tag(f"feature_{feature}", sanitized.get(feature, None))
@@ -179,10 +177,7 @@ class TokenScorer:
                 v1_meta['feature_importances'],
                 v2_meta['feature_importances']
             ),
-            'data_drift': self.feature_monitor.compare_versions(
-                v1_meta['training_data_hash'],
-                v2_meta['training_data_hash']
-            )
+            'data_drift': self.feature_monitor.compare_version_drift(version1, version2)
         }
 
     def _validate_version(self, version: str) -> None:
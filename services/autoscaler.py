@@ -31,6 +31,8 @@ class AutoScaler:
             int: Number of replicas needed (-1 for scale down, 0 for no change)
         """
         # Scaling logic
+        if metrics['cpu_usage'] is None:
+            return self.current_replicas  # No CPU measurement yet
         if metrics['cpu_usage'] > self.scale_up_threshold:
             return min(self.current_replicas * 2, self.max_replicas)
         elif metrics['cpu_usage'] < self.scale_down_threshold:
@@ -0,0 +1,50 @@
+import math
+import hashlib
+
+class BloomFilter:
+    """Fixed-size Bloom filter over trace IDs
+
+    Keys are 128-bit int trace IDs (see compact_span.encode_id); other
+    keys are hashed to 128 bits first. Two 64-bit halves drive the usual
+    double-hashing scheme, so no extra hashing is needed for UUID IDs.
+    """
+
+    __slots__ = ('num_bits', 'num_hashes', 'bits')
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytes = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, items: int, false_positive_rate: float = 0.01) -> 'BloomFilter':
+        items = max(items, 1)
+        num_bits = max(int(-items * math.log(false_positive_rate) / math.log(2) ** 2), 64)
+        num_hashes = max(int(round(num_bits / items * math.log(2))), 1)
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key):
+        if not isinstance(key, int):
+            key = int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=16).digest(), 'big')
+        h1 = key & 0xFFFFFFFFFFFFFFFF
+        h2 = (key >> 64) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self):
+        """Size in bytes"""
+        return len(self.bits)
+
+    def to_tuple(self) -> tuple:
+        return (self.num_bits, self.num_hashes, bytes(self.bits))
+
+    @classmethod
+    def from_tuple(cls, values) -> 'BloomFilter':
+        return cls(*values)
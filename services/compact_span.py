@@ -0,0 +1,269 @@
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+# Span timestamps are naive local datetimes (datetime.now()); counting from
+# a naive epoch keeps the datetime <-> ns conversion exact to the microsecond.
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Offset from time.monotonic_ns() to wall-clock ns, fixed at import so span
+# timestamps stay monotonic within the process
+_MONOTONIC_OFFSET_NS = (datetime.now() - _EPOCH) // _MICROSECOND * 1000 - time.monotonic_ns()
+
+# Tag layouts shared between spans with the same keys and value types
+_tag_layouts = {}
+_MAX_TAG_LAYOUTS = 4096
+_MAX_INTERNED_VALUE = 64
+
+def now_ns() -> int:
+    """Monotonic wall-clock timestamp in ns"""
+    return time.monotonic_ns() + _MONOTONIC_OFFSET_NS
+
+def datetime_to_ns(dt: datetime) -> int:
+    return (dt - _EPOCH) // _MICROSECOND * 1000
+
+def ns_to_datetime(ns: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=ns // 1000)
+
+_HOUR_NS = 3_600_000_000_000
+_utc_offsets = {}   # local hour -> UTC offset in ns
+
+def to_unix_ns(ns: int) -> int:
+    """Naive local ns (as from now_ns()) -> Unix epoch ns in UTC
+
+    The local UTC offset is looked up per hour, so DST changes apply.
+    """
+    hour = ns // _HOUR_NS
+    offset = _utc_offsets.get(hour)
+    if offset is None:
+        if len(_utc_offsets) > 4096:
+            _utc_offsets.clear()
+        offset = _utc_offsets[hour] = \
+            ns_to_datetime(hour * _HOUR_NS).astimezone().utcoffset() // _MICROSECOND * 1000
+    return ns - offset
+
+def encode_id(value):
+    """Canonical UUID string -> 128-bit int; anything else is kept as is"""
+    if isinstance(value, str) and len(value) == 36 and value == value.lower():
+        try:
+            return int(value.replace('-', ''), 16)
+        except ValueError:
+            pass
+    return value
+
+def decode_id(value):
+    if isinstance(value, int):
+        h = f'{value:032x}'
+        return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+    return value
+
+class TagLayout:
+    """Interned tag keys plus where each value lives
+
+    Plain float values are packed into an array('d'); everything else
+    stays in a tuple, in key order.
+    """
+
+    __slots__ = ('keys', 'float_mask', 'positions')
+
+    def __init__(self, keys: tuple, float_mask: int):
+        self.keys = keys
+        self.float_mask = float_mask
+        floats = others = 0
+        positions = []
+        for i in range(len(keys)):
+            if float_mask >> i & 1:
+                positions.append((True, floats))
+                floats += 1
+            else:
+                positions.append((False, others))
+                others += 1
+        self.positions = tuple(positions)
+
+def get_layout(keys: tuple, float_mask: int) -> TagLayout:
+    layout = _tag_layouts.get((keys, float_mask))
+    if layout is None:
+        keys = tuple(sys.intern(k) if isinstance(k, str) else k for k in keys)
+        layout = TagLayout(keys, float_mask)
+        if len(_tag_layouts) < _MAX_TAG_LAYOUTS:
+            _tag_layouts[(keys, float_mask)] = layout
+    return layout
+
+def _pack_tags(tags: dict) -> tuple:
+    float_mask = 0
+    floats = []
+    others = []
+    for i, value in enumerate(tags.values()):
+        if type(value) is float:
+            float_mask |= 1 << i
+            floats.append(value)
+        else:
+            if type(value) is str and len(value) <= _MAX_INTERNED_VALUE:
+                value = sys.intern(value)  # Model versions, services, endpoints
+            others.append(value)
+    return (get_layout(tuple(tags), float_mask), tuple(others),
+            array('d', floats) if floats else None)
+
+_SPAN_KEYS = frozenset([
+    'trace_id', 'span_id', 'parent_id', 'name', 'start_time',
+    'end_time', 'duration', 'tags', 'metrics', 'sample_rate'
+])
+
+class CompactSpan:
+    """Memory-compact, finished span
+
+    IDs are 128-bit ints, timestamps are ns ints and tag keys are shared
+    tuples. A retained model_prediction span takes about 2.7x less memory
+    than the equivalent dict (benchmarks/span_memory.py); the exact tag
+    values make up most of what is left.
+    `to_dict` restores the exact dict format served by the API.
+    """
+
+    __slots__ = (
+        'trace_id', 'span_id', 'parent_span_id', 'name', 'start_ns', 'end_ns',
+        'duration', 'tag_layout', 'tag_values', 'tag_floats', 'metrics', 'extra',
+        'sample_rate'
+    )
+
+    def __init__(self, trace_id, span_id, parent_span_id, name, start_ns, end_ns,
+                 duration, tag_layout, tag_values=(), tag_floats=None,
+                 metrics=None, extra=None, sample_rate=1.0):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.duration = duration
+        self.tag_layout = tag_layout
+        self.tag_values = tag_values
+        self.tag_floats = tag_floats
+        self.metrics = metrics
+        self.extra = extra
+        self.sample_rate = sample_rate  # Probability the span was kept; weight = 1 / rate
+
+    @classmethod
+    def from_dict(cls, span: dict) -> 'CompactSpan':
+        """Convert a span dict as produced by TraceContext"""
+        if isinstance(span, CompactSpan):
+            return span
+        trace_id = span['trace_id']
+        parent_id = span.get('parent_id')
+        parent_span_id = parent_id or None
+        if parent_id:
+            # Parent IDs are "trace_id:span_id" within the same trace
+            trace_part, sep, span_part = parent_id.partition(':')
+            if sep and trace_part == trace_id and isinstance(encode_id(span_part), int):
+                parent_span_id = encode_id(span_part)
+
+        start_ns = getattr(span, 'start_ns', None)
+        if start_ns is None:
+            start_ns = datetime_to_ns(span['start_time'])
+        end_ns = getattr(span, 'end_ns', None)
+        if end_ns is None and span.get('end_time') is not None:
+            end_ns = datetime_to_ns(span['end_time'])
+
+        tag_layout, tag_values, tag_floats = _pack_tags(span.get('tags') or {})
+        extra = None
+        if not _SPAN_KEYS.issuperset(span):
+            extra = {k: v for k, v in span.items() if k not in _SPAN_KEYS} or None
+
+        return cls(
+            encode_id(trace_id),
+            encode_id(span['span_id']),
+            parent_span_id,
+            sys.intern(span['name']) if isinstance(span.get('name'), str) else span.get('name'),
+            start_ns,
+            end_ns,
+            span.get('duration'),
+            tag_layout,
+            tag_values,
+            tag_floats,
+            span.get('metrics'),
+            extra,
+            span.get('sample_rate', 1.0)
+        )
+
+    def to_dict(self) -> dict:
+        """Restore the span dict format"""
+        trace_id = decode_id(self.trace_id)
+        parent = self.parent_span_id
+        if isinstance(parent, int):
+            parent = f"{trace_id}:{decode_id(parent)}"
+        span = {
+            'trace_id': trace_id,
+            'span_id': decode_id(self.span_id),
+            'parent_id': parent,
+            'name': self.name,
+            'start_time': ns_to_datetime(self.start_ns),
+            'tags': self.tags()
+        }
+        if self.end_ns is not None:
+            span['end_time'] = ns_to_datetime(self.end_ns)
+        if self.duration is not None:
+            span['duration'] = self.duration
+        if self.metrics is not None:
+            span['metrics'] = self.metrics
+        if self.sample_rate != 1.0:
+            span['sample_rate'] = self.sample_rate
+        if self.extra:
+            span.update(self.extra)
+        return span
+
+    def to_tuple(self) -> tuple:
+        """Positional form for msgpack (IDs as 16-byte big-endian)"""
+        return (
+            _pack_id(self.trace_id), _pack_id(self.span_id), _pack_id(self.parent_span_id),
+            self.name, self.start_ns, self.end_ns, self.duration,
+            self.tag_layout.keys, self.tag_layout.float_mask, self.tag_values,
+            self.tag_floats.tobytes() if self.tag_floats is not None else None,
+            self.metrics, self.extra, self.sample_rate
+        )
+
+    @classmethod
+    def from_tuple(cls, values) -> 'CompactSpan':
+        (trace_id, span_id, parent, name, start_ns, end_ns, duration,
+         tag_keys, float_mask, tag_values, tag_floats, metrics, extra, sample_rate) = values
+        if tag_floats is not None:
+            tag_floats = array('d', tag_floats)
+        return cls(
+            _unpack_id(trace_id), _unpack_id(span_id), _unpack_id(parent),
+            name, start_ns, end_ns, duration,
+            get_layout(tuple(tag_keys), float_mask), tuple(tag_values), tag_floats,
+            metrics, extra, sample_rate
+        )
+
+    def parent_key(self):
+        """Parent's span_id in the same encoding as `span_id`, or None"""
+        parent = self.parent_span_id
+        if isinstance(parent, str):
+            return encode_id(parent.rpartition(':')[2])
+        return parent
+
+    def tags(self) -> dict:
+        return {key: self._tag_at(i) for i, key in enumerate(self.tag_layout.keys)}
+
+    def get_tag(self, key, default=None):
+        try:
+            return self._tag_at(self.tag_layout.keys.index(key))
+        except ValueError:
+            return default
+
+    def _tag_at(self, i: int):
+        is_float, j = self.tag_layout.positions[i]
+        return self.tag_floats[j] if is_float else self.tag_values[j]
+
+    def __getitem__(self, key):
+        """Dict-style access for callers still written against span dicts"""
+        return self.to_dict()[key]
+
+    def get(self, key, default=None):
+        return self.to_dict().get(key, default)
+
+def _pack_id(value):
+    return value.to_bytes(16, 'big') if isinstance(value, int) else value
+
+def _unpack_id(value):
+    return int.from_bytes(value, 'big') if isinstance(value, bytes) else value
@@ -0,0 +1,97 @@
+import math
+
+class ControlChart:
+    """Online EWMA / EWMV / two-sided CUSUM state of one metric
+
+    Each observation is first scored against the current state, then
+    folded in, all in O(1):
+        z      = (x - ewma) / sqrt(ewmv)
+        cusum+ = max(0, cusum+ + z - k),  cusum- = max(0, cusum- - z - k)
+        ewma  += a * (x - ewma),  ewmv = (1 - a) * (ewmv + a * (x - ewma_old)^2)
+    with a = max(alpha, 1/n), so the first 1/alpha points build a plain
+    running mean and variance. A point is anomalous when |z| exceeds
+    `threshold`; a sustained shift when either CUSUM exceeds `cusum_h`.
+    Nothing is flagged before `warmup` observations. Lower `threshold`,
+    `cusum_k` or `cusum_h` for more sensitivity, raise `alpha` to adapt
+    to new levels faster.
+    """
+
+    __slots__ = ('alpha', 'threshold', 'cusum_k', 'cusum_h', 'warmup',
+                 'n', 'ewma', 'ewmv', 'cusum_upper', 'cusum_lower', 'last', 'last_z', 'last_ts')
+
+    def __init__(self, alpha: float = 0.05, threshold: float = 3.0, cusum_k: float = 0.5,
+                 cusum_h: float = 5.0, warmup: int = 20):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.warmup = warmup
+        self.n = 0
+        self.ewma = 0.0
+        self.ewmv = 0.0
+        self.cusum_upper = 0.0
+        self.cusum_lower = 0.0
+        self.last = None
+        self.last_z = 0.0
+        self.last_ts = None
+
+    def update(self, x: float, timestamp_ns: int = None) -> None:
+        if x != x:  # NaN
+            return
+        std = math.sqrt(self.ewmv)
+        z = (x - self.ewma) / std if std > 0 else 0.0
+        if self.n >= self.warmup:
+            self.cusum_upper = max(0.0, self.cusum_upper + z - self.cusum_k)
+            self.cusum_lower = max(0.0, self.cusum_lower - z - self.cusum_k)
+        self.n += 1
+        a = max(self.alpha, 1.0 / self.n)
+        diff = x - self.ewma
+        self.ewma += a * diff
+        self.ewmv = (1 - a) * (self.ewmv + a * diff * diff)
+        self.last = x
+        self.last_z = z
+        self.last_ts = timestamp_ns
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.ewmv)
+
+    def signal(self):
+        """'ewma', 'cusum_upper', 'cusum_lower' or None"""
+        if self.n <= self.warmup:
+            return None
+        if abs(self.last_z) > self.threshold:
+            return 'ewma'
+        if self.cusum_upper > self.cusum_h:
+            return 'cusum_upper'
+        if self.cusum_lower > self.cusum_h:
+            return 'cusum_lower'
+        return None
+
+    def state(self) -> dict:
+        return {
+            'current': self.last,
+            'mean': self.ewma,
+            'std': self.std,
+            'z': self.last_z,
+            'cusum_upper': self.cusum_upper,
+            'cusum_lower': self.cusum_lower,
+            'threshold': self.threshold,
+            'observations': self.n
+        }
+
+class ControlCharts:
+    """ControlCharts keyed by (version, metric), created on first update"""
+
+    def __init__(self, **params):
+        self.params = params
+        self._charts = {}
+
+    def update(self, version: str, metric: str, value: float, timestamp_ns: int = None) -> None:
+        chart = self._charts.get((version, metric))
+        if chart is None:
+            chart = self._charts[(version, metric)] = ControlChart(**self.params)
+        chart.update(value, timestamp_ns)
+
+    def get(self, version: str, metric: str):
+        return self._charts.get((version, metric))
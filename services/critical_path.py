@@ -0,0 +1,129 @@
+from collections import defaultdict
+from services.compact_span import CompactSpan
+
+def operation_key(span: CompactSpan) -> str:
+    """'service:name' when the span has a service tag, else its name"""
+    service = span.get_tag('service')
+    return f"{service}:{span.name}" if service else span.name
+
+def critical_path(spans: list) -> list:
+    """Critical path of one trace as [(span, ns on the path)], root first
+
+    Walking back from the root's end, the path follows the child that
+    finished last before the current point, then continues before that
+    child started; time not covered by a child is the parent's own. Each
+    span is visited once, and only sibling lists are sorted by end time.
+    Spans with no end (still open) are ignored.
+    """
+    finished = [s for s in spans if s.end_ns is not None]
+    span_ids = {s.span_id for s in finished}
+    children = defaultdict(list)
+    root = None
+    for span in finished:
+        parent = span.parent_key()
+        if parent in span_ids:
+            children[parent].append(span)
+        elif root is None or parent is None:
+            root = span
+    if root is None:
+        return []
+
+    def latest_first(span):
+        return iter(sorted(children.get(span.span_id, ()), key=lambda c: c.end_ns, reverse=True))
+
+    path = []
+    own = {}
+    # Frame: [span, cursor (walking backwards), children iterator]
+    stack = [[root, root.end_ns, latest_first(root)]]
+    path.append(root)
+    own[root.span_id] = 0
+    while stack:
+        frame = stack[-1]
+        span, cursor, pending = frame
+        child = next(pending, None)
+        if child is None:
+            own[span.span_id] += max(cursor - span.start_ns, 0)
+            stack.pop()
+            continue
+        if child.start_ns >= cursor:
+            continue  # Ran entirely after the point we are walking back from
+        child_end = min(child.end_ns, cursor)
+        own[span.span_id] += cursor - child_end
+        frame[1] = max(child.start_ns, span.start_ns)
+        path.append(child)
+        own[child.span_id] = 0
+        stack.append([child, child_end, latest_first(child)])
+    return [(span, own[span.span_id]) for span in path if own[span.span_id] > 0]
+
+class CriticalPathAnalyzer:
+    """Ranks operations by their share of end-to-end latency
+
+    For every trace, each operation's time on the critical path is
+    summed; shares are relative to the summed root durations. The same
+    table restricted to traces at or above the latency `percentile` shows
+    what drives the tail.
+    """
+
+    def __init__(self, percentile: float = 0.99):
+        self.percentile = percentile
+
+    def analyze(self, traces, top: int = 20) -> dict:
+        """Args:
+            traces: Iterable of span lists (CompactSpans), one per trace
+            top: Rows to return
+        Returns:
+            dict: traces analyzed, tail latency threshold and ranked operations
+        """
+        per_trace = []
+        for spans in traces:
+            path = critical_path(spans)
+            if not path:
+                continue
+            contributions = defaultdict(int)
+            for span, ns in path:
+                contributions[operation_key(span)] += ns
+            per_trace.append((sum(contributions.values()), contributions))
+        if not per_trace:
+            return {'traces': 0, 'tail_threshold_ms': None, 'operations': []}
+
+        totals = sorted(total for total, _ in per_trace)
+        threshold = totals[min(int(self.percentile * len(totals)), len(totals) - 1)]
+        overall, tail = defaultdict(int), defaultdict(int)
+        appearances = defaultdict(int)
+        overall_ns = tail_ns = 0
+        for total, contributions in per_trace:
+            overall_ns += total
+            is_tail = total >= threshold
+            if is_tail:
+                tail_ns += total
+            for operation, ns in contributions.items():
+                overall[operation] += ns
+                appearances[operation] += 1
+                if is_tail:
+                    tail[operation] += ns
+
+        rows = [{
+            'operation': operation,
+            'share': ns / overall_ns if overall_ns else 0.0,
+            'tail_share': tail[operation] / tail_ns if tail_ns else 0.0,
+            'mean_ms_on_path': ns / appearances[operation] / 1e6,
+            'traces': appearances[operation]
+        } for operation, ns in overall.items()]
+        rows.sort(key=lambda r: r['share'], reverse=True)
+        return {
+            'traces': len(per_trace),
+            'tail_threshold_ms': threshold / 1e6,
+            'operations': rows[:top]
+        }
+
+    def analyze_window(self, planner, start=None, end=None, filters: dict = None,
+                       max_spans: int = 200000, top: int = 20) -> dict:
+        """Analyze traces with spans in [start, end] via a TraceQueryPlanner
+
+        Spans are grouped by trace_id; traces cut off by the window or by
+        `max_spans` are analyzed with the spans that were retrieved.
+        """
+        traces = defaultdict(list)
+        for span in planner.spans(start, end, filters, limit=max_spans):
+            traces[span.trace_id].append(span)
+        return self.analyze(traces.values(), top=top)
@@ -1,56 +1,218 @@
+import threading
+import numpy as np
+from services.compact_span import CompactSpan
+
 class FeatureGuard:
-    """基于追踪数据的特征异常检测"""
-    
-    def __init__(self, window_size=1000):
-        self.feature_stats = defaultdict(lambda: {
-            'mean': 0,
-            'std': 1,
-            'min': 0,
-            'max': 0,
-            'count': 0
-        })
+    """基于追踪数据的特征异常检测
+
+    Per-feature state lives in NumPy arrays indexed by feature id.
+    mode='window' keeps the last `window_size` values of every feature
+    in a ring buffer; after each batch the mean, std (ddof=1), min and
+    max of the touched features are recomputed exactly from their rings.
+    mode='ewm' keeps exponentially decayed moments instead (weight
+    halves every `halflife` observations of a feature), O(features) per
+    batch with no buffer. Values are z-scored against the current state;
+    nothing is flagged before `min_count` observations.
+    """
+
+    def __init__(self, window_size=1000, mode: str = 'window', halflife: float = None,
+                 threshold: float = 3.0, min_count: int = 30):
+        if mode not in ('window', 'ewm'):
+            raise ValueError(f"Unknown feature guard mode: {mode}")
         self.window_size = window_size
-        
+        self.mode = mode
+        self.alpha = 1 - 0.5 ** (1 / (halflife or window_size / 2))
+        self.threshold = threshold
+        self.min_count = min_count
+        self._lock = threading.Lock()  # Collector observers run on writer and flusher threads
+        self.index = {}
+        self.names = []
+        capacity = 16
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros(capacity)
+        self.std = np.full(capacity, np.nan)
+        self.min = np.full(capacity, np.nan)
+        self.max = np.full(capacity, np.nan)
+        if mode == 'window':
+            self.buffer = np.full((capacity, window_size), np.nan)
+        else:
+            # Decayed weight sum and weighted sums of (x - shift), (x - shift)^2
+            self.shift = np.full(capacity, np.nan)
+            self.weights = np.zeros((capacity, 3))
+
+    def _ids(self, names: list) -> np.ndarray:
+        ids = []
+        for name in names:
+            i = self.index.get(name)
+            if i is None:
+                i = self.index[name] = len(self.names)
+                self.names.append(name)
+            ids.append(i)
+        if len(self.names) > len(self.count):
+            self._grow(len(self.names))
+        return np.array(ids, dtype=np.int64)
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(needed, 2 * len(self.count))
+        extra = capacity - len(self.count)
+
+        def pad(array, fill):
+            return np.concatenate([array, np.full((extra,) + array.shape[1:], fill, dtype=array.dtype)])
+
+        self.count = pad(self.count, 0)
+        self.mean = pad(self.mean, 0.0)
+        self.std = pad(self.std, np.nan)
+        self.min = pad(self.min, np.nan)
+        self.max = pad(self.max, np.nan)
+        if self.mode == 'window':
+            self.buffer = pad(self.buffer, np.nan)
+        else:
+            self.shift = pad(self.shift, np.nan)
+            self.weights = pad(self.weights, 0.0)
+
+    @staticmethod
+    def _feature_tags(trace) -> dict:
+        tags = trace.tags() if isinstance(trace, CompactSpan) else trace.get('tags') or {}
+        features = {}
+        for key, value in tags.items():
+            if key.startswith('feature_') and value is not None:
+                try:
+                    features[key[8:]] = float(value)
+                except (TypeError, ValueError):
+                    continue
+        return features
+
+    def _tags(self, traces) -> tuple:
+        """Feature names and values of every feature tag, in trace order"""
+        names, values = [], []
+        for trace in traces:
+            for name, value in self._feature_tags(trace).items():
+                names.append(name)
+                values.append(value)
+        return names, np.array(values, dtype=np.float64)
+
     def update_stats(self, trace: dict):
         """从追踪数据更新特征统计"""
-        for key in trace['tags']:
-            if key.startswith('feature_'):
-                feature = key[8:]
-                value = float(trace['tags'][key])
-                self._update_feature(feature, value)
-                
-    def _update_feature(self, feature: str, value: float):
-        """使用Welford算法在线更新统计量"""
-        stats = self.feature_stats[feature]
-        stats['count'] += 1
-        
-        if stats['count'] > self.window_size:
-            # 维持滑动窗口
-            stats['count'] = self.window_size
-            delta = (value - stats['mean']) / self.window_size
+        self.update_batch([trace])
+
+    def observe(self, spans: list) -> None:
+        """Collector hook: update from a batch of CompactSpans"""
+        self.update_batch(spans)
+
+    def update_batch(self, traces) -> None:
+        """Update statistics from many traces (dicts with 'tags', or CompactSpans) at once"""
+        names, values = self._tags(traces)  # Parsed outside the lock
+        with self._lock:
+            self._update(self._ids(names), values)
+
+    def _update(self, ids: np.ndarray, values: np.ndarray) -> None:
+        finite = np.isfinite(values)
+        ids, values = ids[finite], values[finite]
+        if not len(ids):
+            return
+        # Position of each value among the batch's values of the same feature
+        order = np.argsort(ids, kind='stable')
+        ids, values = ids[order], values[order]
+        touched, starts, per_feature = np.unique(ids, return_index=True, return_counts=True)
+        rank = np.arange(len(ids)) - np.repeat(starts, per_feature)
+        if self.mode == 'window':
+            self._update_window(ids, values, rank, touched, per_feature)
         else:
-            delta = (value - stats['mean']) / stats['count']
-            
-        new_mean = stats['mean'] + delta
-        new_std = stats['std'] + (value - stats['mean']) * (value - new_mean)
-        
-        stats['mean'] = new_mean
-        stats['std'] = new_std / max(stats['count'], 1)
-        stats['min'] = min(value, stats['min'])
-        stats['max'] = max(value, stats['max'])
+            self._update_ewm(ids, values, rank, touched, per_feature)
+        self.count[touched] += per_feature
+
+    def _update_window(self, ids, values, rank, touched, per_feature) -> None:
+        size = self.window_size
+        # Only the newest window_size values of a feature can survive
+        keep = rank >= np.repeat(per_feature, per_feature) - size
+        ids, values, rank = ids[keep], values[keep], rank[keep]
+        self.buffer[ids, (self.count[ids] + rank) % size] = values
+        rows = self.buffer[touched]
+        filled = np.minimum(self.count[touched] + per_feature, size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean[touched] = np.nanmean(rows, axis=1)
+            self.std[touched] = np.where(filled > 1, np.nanstd(rows, axis=1, ddof=1), np.nan)
+        self.min[touched] = np.nanmin(rows, axis=1)
+        self.max[touched] = np.nanmax(rows, axis=1)
+
+    def _update_ewm(self, ids, values, rank, touched, per_feature) -> None:
+        new = np.isnan(self.shift[touched])
+        self.shift[touched[new]] = values[np.searchsorted(ids, touched[new])]
+        decay = 1 - self.alpha
+        # Observation j of k in this batch ends up decayed by decay^(k-1-j)
+        weight = decay ** (np.repeat(per_feature, per_feature) - 1 - rank)
+        x = values - self.shift[ids]
+        state = self.weights[touched] * (decay ** per_feature)[:, None]
+        slot = np.searchsorted(touched, ids)
+        state[:, 0] += np.bincount(slot, weights=weight, minlength=len(touched))
+        state[:, 1] += np.bincount(slot, weights=weight * x, minlength=len(touched))
+        state[:, 2] += np.bincount(slot, weights=weight * x * x, minlength=len(touched))
+        self.weights[touched] = state
+        centered = state[:, 1] / state[:, 0]
+        self.mean[touched] = self.shift[touched] + centered
+        variance = np.maximum(state[:, 2] / state[:, 0] - centered ** 2, 0.0)
+        seen = self.count[touched] + per_feature
+        self.std[touched] = np.where(seen > 1, np.sqrt(variance * seen / np.maximum(seen - 1, 1)), np.nan)
+        self.min[touched] = np.fmin(self.min[touched], np.minimum.reduceat(values, np.searchsorted(ids, touched)))
+        self.max[touched] = np.fmax(self.max[touched], np.maximum.reduceat(values, np.searchsorted(ids, touched)))
+
+    def _z_scores(self, ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+        std = self.std[ids]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (values - self.mean[ids]) / std
+        ready = (self.count[ids] >= self.min_count) & (std > 0)
+        return np.where(ready, z, 0.0)
 
     def detect_anomalies(self, trace: dict) -> dict:
         """检测特征异常"""
-        anomalies = {}
-        for key in trace['tags']:
-            if key.startswith('feature_'):
-                feature = key[8:]
-                value = float(trace['tags'][key])
-                z_score = (value - self.feature_stats[feature]['mean']) / self.feature_stats[feature]['std']
-                if abs(z_score) > 3:
-                    anomalies[feature] = {
-                        'value': value,
-                        'mean': self.feature_stats[feature]['mean'],
-                        'z_score': z_score
+        return self.detect_batch([trace])[0]
+
+    def detect_batch(self, traces: list) -> list:
+        """Anomalous features of each trace, z-scored in one vectorized pass"""
+        per_trace = [self._feature_tags(trace) for trace in traces]
+        names = [name for features in per_trace for name in features]
+        values = np.array([v for features in per_trace for v in features.values()], dtype=np.float64)
+        with self._lock:  # _grow replaces the arrays
+            known = np.array([name in self.index for name in names], dtype=bool)
+            ids = np.array([self.index.get(name, 0) for name in names], dtype=np.int64)
+            z = np.where(known, self._z_scores(ids, values), 0.0) if len(ids) else values
+            means = self.mean[ids]
+        flagged = np.abs(z) > self.threshold
+        results, offset = [], 0
+        for features in per_trace:
+            anomalies = {}
+            for j in range(offset, offset + len(features)):
+                if flagged[j]:
+                    anomalies[names[j]] = {
+                        'value': float(values[j]),
+                        'mean': float(means[j]),
+                        'z_score': float(z[j])
                     }
-        return anomalies 
\ No newline at end of file
+            offset += len(features)
+            results.append(anomalies)
+        return results
+
+    @property
+    def feature_stats(self) -> dict:
+        """mean / std / min / max / count per feature (over the window in window mode)"""
+        with self._lock:
+            return self._stats()
+
+    def _stats(self) -> dict:
+        n = len(self.names)
+        if self.mode == 'window':
+            counts = np.minimum(self.count[:n], self.window_size).tolist()
+        else:
+            counts = self.count[:n].tolist()
+        return {
+            name: {
+                'mean': mean,
+                'std': None if std != std else std,
+                'min': low,
+                'max': high,
+                'count': count
+            }
+            for name, mean, std, low, high, count in zip(
+                self.names, self.mean[:n].tolist(), self.std[:n].tolist(),
+                self.min[:n].tolist(), self.max[:n].tolist(), counts)
+        }
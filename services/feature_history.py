@@ -3,31 +3,61 @@ Tracks feature importance evolution across model versions
 """
 import pandas as pd
 from datetime import datetime
+from services.compact_span import datetime_to_ns
 
 class FeatureHistory:
-    def __init__(self):
-        self.history = pd.DataFrame(columns=[
-            'timestamp', 'model_version', 'feature', 'importance'
-        ])
+    """Feature importance per model version over time
+
+    With a TimeSeriesStore each (feature, version) pair is a series
+    'feature_importance/<feature>/<version>', so history survives
+    restarts and trend reads only map the requested range. Without one,
+    records are kept in memory.
+    """
+
+    PREFIX = 'feature_importance/'
+
+    def __init__(self, store=None):
+        self.store = store
+        self.records = []
         
     def record_importance(self, version, feature_importances):
         """Store feature importance for model version"""
         timestamp = datetime.now()
-        records = [{
-            'timestamp': timestamp,
-            'model_version': version,
-            'feature': feature,
-            'importance': importance
-        } for feature, importance in feature_importances.items()]
-        
-        self.history = pd.concat([
-            self.history, 
-            pd.DataFrame(records)
-        ], ignore_index=True)
+        if self.store is None:
+            self.records.extend({
+                'timestamp': timestamp,
+                'model_version': version,
+                'feature': feature,
+                'importance': importance
+            } for feature, importance in feature_importances.items())
+            return
+        timestamp_ns = datetime_to_ns(timestamp)
+        for feature, importance in feature_importances.items():
+            self.store.series(f'{self.PREFIX}{feature}/{version}', ('importance',)).append(
+                timestamp_ns, [importance])
         
     def get_trend(self, feature, window=30):
         """Get importance trend for specific feature"""
-        return self.history[
-            (self.history.feature == feature) &
-            (self.history.timestamp > pd.Timestamp.now() - pd.DateOffset(days=window))
-        ].sort_values('timestamp') 
\ No newline at end of file
+        start = pd.Timestamp.now() - pd.DateOffset(days=window)
+        if self.store is None:
+            history = pd.DataFrame(self.records, columns=[
+                'timestamp', 'model_version', 'feature', 'importance'
+            ])
+            return history[
+                (history.feature == feature) & (history.timestamp > start)
+            ].sort_values('timestamp')
+
+        prefix = f'{self.PREFIX}{feature}/'
+        frames = []
+        for name in self.store.names(prefix):
+            timestamps, values = self.store.series(name, ('importance',)).range(
+                datetime_to_ns(start.to_pydatetime()) + 1)
+            frames.append(pd.DataFrame({
+                'timestamp': timestamps.view('datetime64[ns]'),
+                'model_version': name[len(prefix):],
+                'feature': feature,
+                'importance': values[:, 0]
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['timestamp', 'model_version', 'feature', 'importance'])
+        return pd.concat(frames, ignore_index=True).sort_values('timestamp', kind='stable')
@@ -2,76 +2,279 @@
 Tracks feature distributions and importance over time
 Identifies concept drift in input patterns
 """
+import threading
 import pandas as pd
-from datetime import datetime
 import numpy as np
+from services.compact_span import now_ns
+
+def merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b) -> tuple:
+    """Chan et al. merge of per-feature (count, mean, M2) arrays"""
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * np.where(n > 0, n_b / n, 0), 0.0)
+        m2 = m2_a + m2_b + np.where(n > 0, delta * delta * n_a * n_b / np.where(n > 0, n, 1), 0.0)
+    return n, mean, m2
+
+class FeatureWindow:
+    """Per-feature histogram counts and Welford moments for one time bucket"""
+
+    __slots__ = ('counts', 'n', 'mean', 'm2')
+
+    def __init__(self, features: int, bins: int):
+        self.counts = np.zeros((features, bins), dtype=np.int64)
+        self.n = np.zeros(features, dtype=np.int64)
+        self.mean = np.zeros(features)
+        self.m2 = np.zeros(features)
+
+    def add(self, values: np.ndarray, bin_index: np.ndarray) -> None:
+        """Fold in a (rows x features) batch and its bin indices; NaN is skipped"""
+        features, bins = self.counts.shape
+        present = ~np.isnan(values)
+        flat = (np.arange(features) * bins + bin_index)[present]
+        self.counts += np.bincount(flat, minlength=features * bins).reshape(features, bins)
+        n = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, np.nansum(values, axis=0) / np.maximum(n, 1), 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+        self.n, self.mean, self.m2 = merge_moments(self.n, self.mean, self.m2, n, mean, m2)
+
+    def merge(self, other: 'FeatureWindow') -> None:
+        self.counts += other.counts
+        self.n, self.mean, self.m2 = merge_moments(self.n, self.mean, self.m2,
+                                                   other.n, other.mean, other.m2)
+
+    @classmethod
+    def combine(cls, windows: list, features: int, bins: int) -> 'FeatureWindow':
+        """Merge many windows in one vectorized pass"""
+        combined = cls(features, bins)
+        if not windows:
+            return combined
+        n = np.stack([w.n for w in windows])
+        mean = np.stack([w.mean for w in windows])
+        combined.counts = windows[0].counts.copy()
+        for window in windows[1:]:
+            combined.counts += window.counts
+        combined.n = n.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            combined.mean = np.where(combined.n > 0, (n * mean).sum(axis=0) / np.maximum(combined.n, 1), 0.0)
+        combined.m2 = (np.stack([w.m2 for w in windows]).sum(axis=0)
+                       + (n * (mean - combined.mean) ** 2).sum(axis=0))
+        return combined
+
+    @property
+    def std(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.n > 1, np.sqrt(self.m2 / np.maximum(self.n - 1, 1)), np.nan)
+
+class ReferenceProfile:
+    """Reference statistics as arrays, computed once per reference set
+
+    Inner bin edges are the reference quantiles (`bins` bins per feature,
+    open-ended at both ends), so each reference bin holds about 1/bins
+    of the mass. Holds per-feature edges (features x bins-1), bin
+    probabilities and CDF (features x bins), mean and std.
+    """
+
+    def __init__(self, reference_data: pd.DataFrame, bins: int = 10):
+        self.features = list(reference_data.columns)
+        self.bins = bins
+        values = reference_data.to_numpy(dtype=np.float64)
+        self.edges = np.nanquantile(values, np.linspace(0, 1, bins + 1)[1:-1], axis=0).T
+        window = FeatureWindow(len(self.features), bins)
+        window.add(values, self.bin(values))
+        self.counts = window.counts
+        self.probabilities = self.counts / np.maximum(self.counts.sum(axis=1, keepdims=True), 1)
+        self.cdf = np.cumsum(self.probabilities, axis=1)
+        self.mean = window.mean
+        self.std = window.std
+        # z-score denominator: NaN for constant features, whose z is undefined
+        self.scale = np.where(self.std > 0, self.std, np.nan)
+
+    def bin(self, values: np.ndarray) -> np.ndarray:
+        """Bin index of every value: (rows x features) ints in [0, bins)"""
+        if values.size * self.bins <= 1 << 16:
+            return (values[:, :, None] > self.edges[None, :, :]).sum(axis=2)
+        return np.stack([np.searchsorted(self.edges[i], values[:, i], 'left')
+                         for i in range(len(self.features))], axis=1)
 
 class FeatureMonitor:
     """Monitors feature distributions and concept drift over time
-    
+
+    Bins come from a ReferenceProfile of the reference data (quantile
+    edges, probabilities, moments). Recorded batches only update a
+    FeatureWindow per model version and time bucket: binned counts plus
+    count/mean/M2 per feature, a (features x bins) array no matter how
+    much traffic arrives. Drift is computed from merged windows; raw
+    rows are never kept.
+
     Attributes:
-        reference (pd.DataFrame): Baseline feature statistics
-        feature_history (list): Record of feature distribution changes
-        importance_history (list): Track feature importance evolution
+        reference (pd.DataFrame): Baseline feature samples
+        windows (dict): version -> {bucket start ns: FeatureWindow}
+        importances (dict): Latest importance scores per version
     """
-    
-    def __init__(self, reference_data):
+
+    def __init__(self, reference_data: pd.DataFrame, drift_threshold: float = 0.15, bins: int = 10,
+                 bucket_seconds: int = 3600, retention_buckets: int = 24 * 90):
         self.reference = reference_data
-        self.feature_history = []
-        self.importance_history = []
-        
-    def record_features(self, features, importances):
-        """Store feature stats and importance scores"""
-        self.feature_history.append({
-            'timestamp': datetime.now(),
-            'means': features.mean().to_dict(),
-            'stds': features.std().to_dict()
-        })
-        self.importance_history.append({
-            'timestamp': datetime.now(),
-            'importances': importances
-        })
-        
-    def detect_concept_drift(self, window_size=30) -> dict:
+        self.drift_threshold = drift_threshold
+        self.features = list(reference_data.columns)
+        self.bins = bins
+        self.bucket_ns = bucket_seconds * 1_000_000_000
+        self.retention_ns = retention_buckets * self.bucket_ns
+        self.profile = ReferenceProfile(reference_data, bins)
+        self.windows = {}
+        self.importances = {}
+        self.lock = threading.Lock()
+        self._newest_ns = 0
+
+    def _matrix(self, features) -> np.ndarray:
+        """DataFrame / dict / array -> (rows x features) float matrix in feature order"""
+        if isinstance(features, dict):
+            return np.array([[np.nan if features.get(name) is None else features[name]
+                              for name in self.features]], dtype=np.float64)
+        if isinstance(features, pd.DataFrame):
+            return features.reindex(columns=self.features).to_numpy(dtype=np.float64)
+        return np.asarray(features, dtype=np.float64).reshape(-1, len(self.features))
+
+    def record_features(self, features, version: str = None, importances: dict = None):
+        """Fold a batch of feature rows into the current bucket of `version`
+        Args:
+            features: DataFrame (one row per prediction), dict or array
+            version: Model version that served the batch
+            importances: Optional latest feature importance scores
+        """
+        values = self._matrix(features)
+        bin_index = self.profile.bin(values)
+        timestamp = now_ns()
+        bucket_start = timestamp - timestamp % self.bucket_ns
+        with self.lock:
+            buckets = self.windows.setdefault(version, {})
+            window = buckets.get(bucket_start)
+            if window is None:
+                window = buckets[bucket_start] = FeatureWindow(len(self.features), self.bins)
+            window.add(values, bin_index)
+            if importances is not None:
+                self.importances[version] = importances
+            if bucket_start > self._newest_ns:
+                self._newest_ns = bucket_start
+                self._expire(bucket_start - self.retention_ns)
+
+    def _expire(self, cutoff_ns: int) -> None:
+        for version in list(self.windows):
+            buckets = self.windows[version]
+            for start in [s for s in buckets if s < cutoff_ns]:
+                del buckets[start]
+            if not buckets:
+                del self.windows[version]
+
+    def _windows(self, version: str = None, window_size: float = 30) -> list:
+        """Buckets of one version (all versions when None) from the last `window_size` days"""
+        cutoff = now_ns() - int(window_size * 86400 * 1e9)
+        with self.lock:
+            versions = [version] if version is not None else list(self.windows)
+            return [window for v in versions for start, window in self.windows.get(v, {}).items()
+                    if start + self.bucket_ns > cutoff]
+
+    def merged(self, version: str = None, window_size: float = 30) -> FeatureWindow:
+        return FeatureWindow.combine(self._windows(version, window_size), len(self.features), self.bins)
+
+    def detect_concept_drift(self, window_size=30, version: str = None) -> dict:
         """Detects significant feature distribution shifts
         Args:
             window_size: Days to consider for recent data
+            version: Restrict to one model version
         Returns:
-            dict: Features with z-score exceeding 3 sigma threshold
+            dict: Features whose mean in some time bucket is more than
+                3 reference standard deviations from the reference mean
         """
-        recent = [f for f in self.feature_history 
-                if f['timestamp'] > datetime.now() - pd.Timedelta(days=window_size)]
-        
-        drift_scores = {}
-        for feature in self.reference.columns:
-            ref_mean = self.reference[feature].mean()
-            current_means = [f['means'][feature] for f in recent]
-            z_scores = (np.array(current_means) - ref_mean) / self.reference[feature].std()
-            drift_scores[feature] = np.max(np.abs(z_scores))
-            
-        return {k: v for k, v in drift_scores.items() if v > 3}  # 3 sigma threshold 
-
-    def compare_version_drift(self, version1_hash: str, version2_hash: str) -> dict:
-        """Compare data drift between two model versions
+        windows = self._windows(version, window_size)
+        if not windows:
+            return {}
+        means = np.array([np.where(w.n > 0, w.mean, np.nan) for w in windows])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z_scores = np.abs(means - self.profile.mean) / self.profile.scale
+        drift = np.nanmax(np.where(np.isnan(z_scores), -np.inf, z_scores), axis=0)
+        return {self.features[i]: float(drift[i]) for i in np.flatnonzero(drift > 3)}  # 3 sigma threshold
+
+    def drift_report(self, window_size: float = 1, version: str = None, psi_threshold: float = None,
+                     ks_threshold: float = 0.1, z_threshold: float = 3.0) -> dict:
+        """PSI, KS and z-score drift of every feature against the reference
         Args:
-            version1_hash: Training data hash for first version
-            version2_hash: Training data hash for second version
+            window_size: Days of recorded traffic (merged bucket windows)
+            version: Restrict to one model version
+            psi_threshold: PSI limit (default: drift_threshold)
+            ks_threshold: Limit on the KS statistic over bin edges
+            z_threshold: Limit on |mean - reference mean| / reference std
         Returns:
-            dict: Drift scores for common features
+            dict: Features over any limit, plus parallel per-feature
+                lists of n, psi, ks, z and mean (None where a feature
+                had no observations; z is None for constant features)
         """
-        ref1 = self.get_version_stats(version1_hash)
-        ref2 = self.get_version_stats(version2_hash)
-        
-        common_features = set(ref1.columns) & set(ref2.columns)
-        drift_scores = {}
-        
-        for feature in common_features:
-            # Calculate population stability index
-            psi = self._calculate_psi(ref1[feature], ref2[feature])
-            drift_scores[feature] = {
-                'psi': psi,
-                'v1_mean': ref1[feature].mean(),
-                'v2_mean': ref2[feature].mean()
+        psi_threshold = self.drift_threshold if psi_threshold is None else psi_threshold
+        window = self.merged(version, window_size)
+        profile = self.profile
+        # One pass over the (features x bins) matrices
+        psi = self._calculate_psi(profile.counts, window.counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            observed = window.counts / window.counts.sum(axis=1, keepdims=True)
+            ks = np.max(np.abs(np.cumsum(observed, axis=1) - profile.cdf), axis=1)
+            z = (window.mean - profile.mean) / profile.scale
+        seen = window.n > 0
+        psi, ks, z = (np.where(seen, a, np.nan) for a in (psi, ks, z))
+        drifted = seen & ((psi > psi_threshold) | (ks > ks_threshold) | (np.abs(z) > z_threshold))
+        return {
+            'version': version,
+            'window_days': window_size,
+            'thresholds': {'psi': psi_threshold, 'ks': ks_threshold, 'z': z_threshold},
+            'drifted': [self.features[i] for i in np.flatnonzero(drifted)],
+            # Columnar: position i of every list is self.features[i]
+            'features': self.features,
+            'n': window.n.tolist(),
+            'psi': _nan_to_none(psi),
+            'ks': _nan_to_none(ks),
+            'z': _nan_to_none(z),
+            'mean': _nan_to_none(np.where(seen, window.mean, np.nan))
+        }
+
+    @staticmethod
+    def _calculate_psi(expected: np.ndarray, actual: np.ndarray, epsilon: float = 1e-4) -> np.ndarray:
+        """Population stability index between binned counts
+        Args:
+            expected, actual: Counts of shape (..., bins)
+        Returns:
+            PSI over the last axis; bins empty on either side are
+            smoothed with `epsilon` probability
+        """
+        expected = np.asarray(expected, dtype=np.float64)
+        actual = np.asarray(actual, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p = np.maximum(expected / expected.sum(axis=-1, keepdims=True), epsilon)
+            q = np.maximum(actual / actual.sum(axis=-1, keepdims=True), epsilon)
+        return np.sum((q - p) * np.log(q / p), axis=-1)
+
+    def compare_version_drift(self, version1: str, version2: str, window_size: float = 30) -> dict:
+        """Compare the input distributions served to two model versions
+        Args:
+            version1: First model version
+            version2: Second model version
+            window_size: Days of recorded traffic to compare
+        Returns:
+            dict: PSI and means per feature seen by both versions
+        """
+        first = self.merged(version1, window_size)
+        second = self.merged(version2, window_size)
+        psi = self._calculate_psi(first.counts, second.counts)
+        return {
+            feature: {
+                'psi': float(psi[i]),
+                'v1_mean': float(first.mean[i]),
+                'v2_mean': float(second.mean[i])
             }
-        
-        return drift_scores 
\ No newline at end of file
+            for i, feature in enumerate(self.features) if first.n[i] and second.n[i]
+        }
+
+def _nan_to_none(values: np.ndarray) -> list:
+    """JSON-safe list: NaN and +-inf become None"""
+    values = np.asarray(values, dtype=np.float64)
+    return [v if finite else None for v, finite in zip(values.tolist(), np.isfinite(values).tolist())]
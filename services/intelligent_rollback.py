@@ -1,3 +1,5 @@
+from services.red_metrics import red_metrics
+
 class IntelligentRollback:
     """智能回滚策略引擎"""
     
@@ -11,19 +13,18 @@ class IntelligentRollback:
         
     def evaluate_version_health(self, version: str) -> float:
         """评估模型版本健康度"""
-        traces = tracing_collector.query_traces({'model_version': version})
-        metrics = self._aggregate_metrics(traces)
+        metrics = self._aggregate_metrics(red_metrics.summary('model_version', version))
         return sum(
             metrics[k] * self.performance_weights[k] 
             for k in self.performance_weights
         )
 
-    def _aggregate_metrics(self, traces: list) -> dict:
-        """聚合追踪中的性能指标"""
+    def _aggregate_metrics(self, summary: dict) -> dict:
+        """聚合追踪中的性能指标 (precomputed at span ingest)"""
         return {
-            'accuracy': np.mean([t['tags'].get('accuracy', 0) for t in traces]),
-            'latency': np.percentile([t['duration'] for t in traces], 95),
-            'throughput': len(traces) / self._time_window(traces)
+            'accuracy': summary['tag_means'].get('accuracy', 0),
+            'latency': summary['latency']['p95'],
+            'throughput': summary['rate']
         }
 
     def auto_rollback_strategy(self):
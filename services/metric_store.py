@@ -0,0 +1,445 @@
+import os
+import json
+import threading
+import numpy as np
+
+class ColumnBuffer:
+    """Append-only set of preallocated NumPy columns
+
+    `spec` maps column name to (dtype, width); width None is a 1-D
+    column, otherwise each row holds `width` values. Capacity doubles
+    when full, up to `max_rows`; past that the oldest half is dropped.
+    Both grow and drop allocate fresh arrays, and rows below `size` are
+    never rewritten in place by the buffer itself, so views handed out
+    earlier stay valid snapshots. Owners that update rows in place (like
+    the open rollup bucket) must copy those rows before handing them out.
+    """
+
+    def __init__(self, spec: dict, capacity: int = 1024, max_rows: int = None):
+        self.spec = spec
+        self.max_rows = max_rows
+        self.size = 0
+        self.dropped = 0
+        self.columns = self._allocate(min(capacity, max_rows or capacity))
+
+    def _allocate(self, capacity: int) -> dict:
+        return {
+            name: np.empty((capacity,) if width is None else (capacity, width), dtype=dtype)
+            for name, (dtype, width) in self.spec.items()
+        }
+
+    @property
+    def capacity(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+    def append(self, **values) -> None:
+        """Append one row; every column must be given"""
+        if self.size == self.capacity:
+            self._make_room()
+        i = self.size
+        for name, value in values.items():
+            self.columns[name][i] = value
+        self.size = i + 1
+
+    def extend(self, **columns) -> None:
+        """Append many rows at once; every column must be given"""
+        n = len(next(iter(columns.values())))
+        if self.max_rows and n > self.max_rows:
+            self.dropped += n - self.max_rows
+            columns = {name: values[n - self.max_rows:] for name, values in columns.items()}
+            n = self.max_rows
+        if self.size + n > self.capacity:
+            keep = self.size
+            if self.max_rows and keep + n > self.max_rows:
+                # Like _make_room: drop at least the oldest half
+                keep = min(keep, self.max_rows // 2, self.max_rows - n)
+            capacity = max(self.capacity * 2, keep + n)
+            if self.max_rows:
+                capacity = min(capacity, self.max_rows)
+            start = self.size - keep
+            self.dropped += start
+            fresh = self._allocate(capacity)
+            for name, column in self.columns.items():
+                fresh[name][:keep] = column[start:self.size]
+            self.columns = fresh
+            self.size = keep
+        for name, values in columns.items():
+            self.columns[name][self.size:self.size + n] = values
+        self.size += n
+
+    def _make_room(self) -> None:
+        if self.max_rows and self.size >= self.max_rows:
+            keep = self.max_rows // 2
+            start = self.size - keep
+            self.dropped += start
+        else:
+            keep = self.size
+            start = 0
+        capacity = self.capacity * 2 if not self.max_rows else min(self.capacity * 2, self.max_rows)
+        columns = self._allocate(max(capacity, keep + 1))
+        for name, column in self.columns.items():
+            columns[name][:keep] = column[start:self.size]
+        self.columns = columns
+        self.size = keep
+
+    def view(self, lo: int = 0, hi: int = None) -> dict:
+        """Zero-copy slices of every column for rows [lo, hi)"""
+        hi = self.size if hi is None else min(hi, self.size)
+        return {name: column[lo:hi] for name, column in self.columns.items()}
+
+    def span(self, column: str, start=None, end=None) -> tuple:
+        """Row range [lo, hi) whose sorted `column` lies in [start, end]"""
+        keys = self.columns[column][:self.size]
+        lo = int(np.searchsorted(keys, start, 'left')) if start is not None else 0
+        hi = int(np.searchsorted(keys, end, 'right')) if end is not None else self.size
+        return lo, hi
+
+class ColumnarMetricStore:
+    """Per-version columnar history of numeric metrics with time rollups
+
+    Each version has a ColumnBuffer of int64 ns timestamps and a float64
+    (rows x metrics) matrix, NaN where a metric was not reported, plus a
+    rollup buffer holding per-bucket count/sum/min/max of every metric,
+    updated on append. Appends are O(1) amortized; range reads binary
+    search the timestamps and return views.
+
+    With a `backing` TimeSeriesStore every row is also appended to the
+    series `prefix + version`; reads reaching back past the rows held in
+    memory are served from its mmap'ed segments instead, and replay()
+    reloads recent rows after a restart.
+    """
+
+    def __init__(self, metrics: tuple, bucket_seconds: int = 60, max_rows: int = 2_000_000,
+                 max_buckets: int = 525_600, backing=None, prefix: str = ''):
+        self.metrics = tuple(metrics)
+        self.backing = backing
+        self.prefix = prefix
+        self.index = {name: i for i, name in enumerate(self.metrics)}
+        self.bucket_ns = bucket_seconds * 1_000_000_000
+        self.max_rows = max_rows
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        self._raw = {}
+        self._rollups = {}
+
+    def _buffers(self, version: str) -> tuple:
+        raw = self._raw.get(version)
+        if raw is None:
+            width = len(self.metrics)
+            raw = self._raw[version] = ColumnBuffer(
+                {'timestamp': (np.int64, None), 'values': (np.float64, width)},
+                max_rows=self.max_rows)
+            self._rollups[version] = ColumnBuffer(
+                {'bucket': (np.int64, None), 'count': (np.int64, width), 'sum': (np.float64, width),
+                 'min': (np.float64, width), 'max': (np.float64, width)},
+                capacity=64, max_rows=self.max_buckets)
+        return raw, self._rollups[version]
+
+    def row(self, metrics: dict) -> np.ndarray:
+        """Metric dict -> value row (NaN for missing or None)"""
+        values = np.full(len(self.metrics), np.nan)
+        for name, value in metrics.items():
+            i = self.index.get(name)
+            if i is not None and value is not None:
+                values[i] = value
+        return values
+
+    def append(self, version: str, timestamp_ns: int, values: np.ndarray) -> int:
+        """Record one row; returns the timestamp stored
+
+        Timestamps per version must be non-decreasing; one taken before a
+        concurrent writer's newer row is clamped up to that row's.
+        """
+        timestamp_ns = self._append(version, timestamp_ns, values)
+        if self.backing is not None:
+            self.backing.series(self.prefix + version, self.metrics).append(timestamp_ns, values)
+        return timestamp_ns
+
+    def replay(self, start_ns: int) -> dict:
+        """Load backing rows newer than start_ns into memory
+        Returns:
+            dict: version -> (timestamps, values) that were loaded
+        """
+        loaded = {}
+        for name in self.backing.names(self.prefix) if self.backing is not None else ():
+            timestamps, values = self.backing.series(name, self.metrics).range(start_ns)
+            version = name[len(self.prefix):]
+            if len(timestamps):
+                self._append_many(version, timestamps, values)
+            loaded[version] = (timestamps, values)
+        return loaded
+
+    def _append_many(self, version: str, timestamps: np.ndarray, values: np.ndarray) -> None:
+        """Bulk _append of sorted rows: raw columns and rollups in one pass"""
+        present = ~np.isnan(values)
+        with self.lock:
+            raw, rollup = self._buffers(version)
+            if raw.size:
+                timestamps = np.maximum(timestamps, raw.columns['timestamp'][raw.size - 1])
+            buckets = timestamps - timestamps % self.bucket_ns
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            with np.errstate(invalid='ignore'):
+                count = np.add.reduceat(present, starts).astype(np.int64)
+                total = np.add.reduceat(np.where(present, values, 0.0), starts)
+                low = np.fmin.reduceat(values, starts)
+                high = np.fmax.reduceat(values, starts)
+            raw.extend(timestamp=timestamps, values=values)
+            if rollup.size and rollup.columns['bucket'][rollup.size - 1] == buckets[0]:
+                i = rollup.size - 1
+                cols = rollup.columns
+                cols['count'][i] += count[0]
+                cols['sum'][i] += total[0]
+                np.fmin(cols['min'][i], low[0], out=cols['min'][i])
+                np.fmax(cols['max'][i], high[0], out=cols['max'][i])
+                starts, count, total, low, high = starts[1:], count[1:], total[1:], low[1:], high[1:]
+            if len(starts):
+                rollup.extend(bucket=buckets[starts], count=count, sum=total, min=low, max=high)
+
+    def _append(self, version: str, timestamp_ns: int, values: np.ndarray) -> int:
+        present = ~np.isnan(values)
+        with self.lock:
+            raw, rollup = self._buffers(version)
+            if raw.size:
+                timestamp_ns = max(timestamp_ns, int(raw.columns['timestamp'][raw.size - 1]))
+            bucket = timestamp_ns - timestamp_ns % self.bucket_ns
+            raw.append(timestamp=timestamp_ns, values=values)
+            if rollup.size and rollup.columns['bucket'][rollup.size - 1] == bucket:
+                i = rollup.size - 1
+                cols = rollup.columns
+                cols['count'][i] += present
+                cols['sum'][i] += np.where(present, values, 0.0)
+                np.fmin(cols['min'][i], values, out=cols['min'][i])
+                np.fmax(cols['max'][i], values, out=cols['max'][i])
+            else:
+                rollup.append(bucket=bucket, count=present, sum=np.where(present, values, 0.0),
+                              min=values, max=values)
+        return timestamp_ns
+
+    def versions(self) -> list:
+        versions = list(self._raw)
+        if self.backing is not None:
+            versions += [name[len(self.prefix):] for name in self.backing.names(self.prefix)
+                         if name[len(self.prefix):] not in self._raw]
+        return versions
+
+    def oldest(self, version: str):
+        """Timestamp of the oldest row held in memory, None if none"""
+        raw = self._raw.get(version)
+        return int(raw.columns['timestamp'][0]) if raw is not None and raw.size else None
+
+    def range(self, version: str, start_ns: int = None, end_ns: int = None) -> tuple:
+        """(timestamps, values) views of one version's rows in [start_ns, end_ns]"""
+        if self.backing is not None:
+            oldest = self.oldest(version)
+            if ((oldest is None or start_ns is None or start_ns < oldest)
+                    and self.backing.exists(self.prefix + version)):
+                series = self.backing.series(self.prefix + version, self.metrics)
+                return series.range(start_ns, end_ns)
+        with self.lock:
+            raw = self._raw.get(version)
+            if raw is None:
+                return np.empty(0, np.int64), np.empty((0, len(self.metrics)))
+            lo, hi = raw.span('timestamp', start_ns, end_ns)
+            view = raw.view(lo, hi)
+        return view['timestamp'], view['values']
+
+    def range_all(self, start_ns: int = None, end_ns: int = None) -> tuple:
+        """(timestamps, values, version labels) across versions, time-ordered (a copy)"""
+        parts = [(version, *self.range(version, start_ns, end_ns)) for version in self.versions()]
+        if not parts:
+            return np.empty(0, np.int64), np.empty((0, len(self.metrics))), np.empty(0, object)
+        timestamps = np.concatenate([ts for _, ts, _ in parts])
+        order = np.argsort(timestamps, kind='stable')
+        values = np.concatenate([vals for _, _, vals in parts])[order]
+        labels = np.concatenate([np.full(len(ts), version, dtype=object) for version, ts, _ in parts])[order]
+        return timestamps[order], values, labels
+
+    def column(self, name: str, version: str = None, start_ns: int = None, end_ns: int = None) -> np.ndarray:
+        """One metric over a range; a strided view when `version` is given"""
+        if version is not None:
+            return self.range(version, start_ns, end_ns)[1][:, self.index[name]]
+        return self.range_all(start_ns, end_ns)[1][:, self.index[name]]
+
+    def rollups(self, version: str, start_ns: int = None, end_ns: int = None) -> dict:
+        """Bucket start, count, sum, min and max for one version
+
+        Views of the closed buckets; a range that includes the open
+        (newest) bucket, which appends update in place, is copied.
+        """
+        with self.lock:
+            rollup = self._rollups.get(version)
+            if rollup is None:
+                return {}
+            lo, hi = rollup.span('bucket', start_ns, end_ns)
+            view = rollup.view(lo, hi)
+            if hi >= rollup.size > lo:
+                view = {name: column.copy() for name, column in view.items()}
+            return view
+
+class TieredRollupStore:
+    """Fixed-size multi-resolution rollups of a few numeric fields
+
+    `tiers` is a tuple of (resolution_seconds, buckets); every tier is a
+    ring of `buckets` + 1 slots (the extra one is the open bucket) holding count/sum/min/max of each field, so
+    the defaults keep 1-second points for an hour, 1-minute points for a
+    week and 1-hour points for a year in about 0.7MB per field. Each
+    sample updates the current slot of every tier; a slot is reset when
+    its ring position comes round to a newer bucket. Samples older than
+    a slot's current bucket are ignored for that tier.
+
+    With a `directory` the rings are .npy files opened with mmap, so the
+    rollups survive restarts and live in the page cache.
+    """
+
+    DEFAULT_TIERS = ((1, 3600), (60, 7 * 24 * 60), (3600, 365 * 24))
+
+    def __init__(self, fields: tuple, tiers: tuple = DEFAULT_TIERS, directory: str = None):
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.lock = threading.Lock()
+        self.newest_ns = None
+        width = len(self.fields)
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._check_fields(directory)
+        self.tiers = []
+        for seconds, buckets in sorted(tiers):
+            slots = buckets + 1
+            arrays = {
+                'bucket': ((slots,), np.int64, -1),
+                'count': ((slots, width), np.int64, 0),
+                'sum': ((slots, width), np.float64, 0.0),
+                'min': ((slots, width), np.float64, np.inf),
+                'max': ((slots, width), np.float64, -np.inf)
+            }
+            tier = {'resolution_ns': seconds * 1_000_000_000}
+            for name, (shape, dtype, fill) in arrays.items():
+                if directory is None:
+                    tier[name] = np.full(shape, fill, dtype=dtype)
+                else:
+                    tier[name] = self._open_ring(os.path.join(directory, f'{seconds}s-{name}.npy'),
+                                                 shape, dtype, fill)
+            self.tiers.append(tier)
+        newest = max(int(tier['bucket'].max()) for tier in self.tiers)
+        self.newest_ns = newest if newest >= 0 else None
+
+    def _check_fields(self, directory: str) -> None:
+        path = os.path.join(directory, 'fields.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = tuple(json.load(f))
+            if stored != self.fields:
+                raise ValueError(f"Rollups in {directory} have fields {stored}, not {self.fields}")
+            return
+        with open(path, 'w') as f:
+            json.dump(list(self.fields), f)
+
+    @staticmethod
+    def _open_ring(path: str, shape: tuple, dtype, fill) -> np.ndarray:
+        if os.path.exists(path):
+            ring = np.load(path, mmap_mode='r+')
+            if ring.shape == shape:
+                return ring
+        ring = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        ring[...] = fill
+        return ring
+
+    def flush(self) -> None:
+        for tier in self.tiers:
+            for name, ring in tier.items():
+                if isinstance(ring, np.memmap):
+                    ring.flush()
+
+    def row(self, values: dict) -> np.ndarray:
+        """Field dict -> value row (NaN for missing or None)"""
+        row = np.full(len(self.fields), np.nan)
+        for name, value in values.items():
+            i = self.index.get(name)
+            if i is not None and value is not None:
+                row[i] = value
+        return row
+
+    def add(self, timestamp_ns: int, values: np.ndarray) -> None:
+        present = ~np.isnan(values)
+        contribution = np.where(present, values, 0.0)
+        with self.lock:
+            for tier in self.tiers:
+                resolution = tier['resolution_ns']
+                bucket = timestamp_ns - timestamp_ns % resolution
+                slot = (bucket // resolution) % len(tier['bucket'])
+                current = tier['bucket'][slot]
+                if current > bucket:
+                    continue
+                if current != bucket:
+                    tier['bucket'][slot] = bucket
+                    tier['count'][slot] = 0
+                    tier['sum'][slot] = 0.0
+                    tier['min'][slot] = np.inf
+                    tier['max'][slot] = -np.inf
+                tier['count'][slot] += present
+                tier['sum'][slot] += contribution
+                np.fmin(tier['min'][slot], values, out=tier['min'][slot])
+                np.fmax(tier['max'][slot], values, out=tier['max'][slot])
+            if self.newest_ns is None or timestamp_ns > self.newest_ns:
+                self.newest_ns = timestamp_ns
+
+    def _choose(self, start_ns: int, end_ns: int, max_points: int) -> dict:
+        """Finest tier that holds start_ns, unless fitting `max_points`
+        would merge its buckets to the next tier's resolution or coarser"""
+        covering = [
+            tier for tier in self.tiers
+            if start_ns >= self.newest_ns - tier['resolution_ns'] * (len(tier['bucket']) - 1)
+        ] or self.tiers[-1:]
+        for tier, coarser in zip(covering, covering[1:]):
+            points = (end_ns - start_ns) // tier['resolution_ns'] + 1
+            if -(-points // max_points) * tier['resolution_ns'] < coarser['resolution_ns']:
+                return tier
+        return covering[-1]
+
+    def query(self, start_ns: int, end_ns: int = None, max_points: int = 1000) -> dict:
+        """Rollups covering [start_ns, end_ns] in at most `max_points` points
+        Returns:
+            dict: 'resolution_ns', 'timestamp' (bucket starts, int64 ns),
+                and 'count'/'mean'/'min'/'max' arrays of shape
+                (points, fields). When the chosen tier has more than
+                `max_points` buckets in range, runs of adjacent buckets
+                are merged to fit. Arrays are copies taken under the
+                lock, so later samples never change them.
+        """
+        with self.lock:
+            if self.newest_ns is None:
+                empty = np.empty((0, len(self.fields)))
+                return {'resolution_ns': self.tiers[0]['resolution_ns'],
+                        'timestamp': np.empty(0, np.int64), 'count': empty.astype(np.int64),
+                        'mean': empty, 'min': empty, 'max': empty}
+            end_ns = self.newest_ns if end_ns is None else end_ns
+            tier = self._choose(start_ns, end_ns, max_points)
+            resolution = tier['resolution_ns']
+            buckets = tier['bucket']
+            selected = np.flatnonzero((buckets >= start_ns - start_ns % resolution) & (buckets <= end_ns))
+            selected = selected[np.argsort(buckets[selected])]
+            timestamps = buckets[selected]
+            count, total = tier['count'][selected], tier['sum'][selected]
+            low, high = tier['min'][selected], tier['max'][selected]
+
+        factor = -(-len(selected) // max_points) if max_points > 0 else 1
+        if factor > 1:
+            # Merge runs of `factor` consecutive buckets
+            starts = np.arange(0, len(selected), factor)
+            timestamps = timestamps[starts]
+            count = np.add.reduceat(count, starts)
+            total = np.add.reduceat(total, starts)
+            low = np.minimum.reduceat(low, starts)
+            high = np.maximum.reduceat(high, starts)
+            resolution *= factor
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+        empty = count == 0
+        return {
+            'resolution_ns': resolution,
+            'timestamp': timestamps,
+            'count': count,
+            'mean': mean,
+            'min': np.where(empty, np.nan, low),
+            'max': np.where(empty, np.nan, high)
+        }
@@ -0,0 +1,152 @@
+import json
+import asyncio
+import logging
+import numpy as np
+import pandas as pd
+from services.compact_span import now_ns
+
+logger = logging.getLogger(__name__)
+
+class _Subscriber:
+    """One client: a single pending frame, replaced when it lags"""
+
+    __slots__ = ('key', 'pending', 'resync', 'ready', 'sent', 'dropped')
+
+    def __init__(self, key):
+        self.key = key
+        self.pending = None
+        self.resync = False
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, frame: str) -> None:
+        self.pending = frame
+        self.ready.set()
+
+class _Feed:
+    """Frame state of one subscription key (a version, or None for all)"""
+
+    __slots__ = ('seq', 'last_ns', 'snapshot', 'subscribers')
+
+    def __init__(self, last_ns: int):
+        self.seq = 0
+        self.last_ns = last_ns      # Newest row covered by frame `seq`
+        self.snapshot = None        # (seq, serialized snapshot)
+        self.subscribers = set()
+
+class MetricsBroadcaster:
+    """Fans performance metric frames out to WebSocket subscribers
+
+    One producer task polls the tracker every `interval` seconds for the
+    rows added since the previous frame of each subscribed version (or of
+    all versions), serializes that delta once and hands the same string to
+    every subscriber of the key. A client first gets a snapshot of the
+    last `window`, then deltas; frames carry a per-key `seq`.
+
+    Each subscriber holds at most one unsent frame. When a new frame
+    arrives before the previous one was sent, both are dropped and the
+    client is resynchronized with a snapshot instead (built once per key
+    and frame), so slow consumers cost O(1) memory. A snapshot covers
+    only the last `window`: a client that falls further behind than that
+    misses the rows in between, and can tell from the 'snapshot' frame
+    type. The producer runs only while there are subscribers.
+    """
+
+    def __init__(self, tracker, interval: float = 5.0, window: pd.Timedelta = pd.Timedelta(minutes=1)):
+        self.tracker = tracker
+        self.interval = interval
+        self.window = window
+        self._feeds = {}
+        self._producer = None
+        self.stats = {'frames': 0, 'sent': 0, 'dropped': 0, 'snapshots': 0}
+
+    def _columns(self, key, start_ns: int, end_ns: int) -> dict:
+        return self.tracker.get_columns(key, window=None, start=pd.Timestamp(start_ns),
+                                        end=pd.Timestamp(end_ns))
+
+    def _serialize(self, frame_type: str, key, seq: int, columns: dict) -> str:
+        metrics = [name for name in self.tracker.METRICS
+                   if len(columns[name]) and not np.isnan(columns[name]).all()]
+        timestamps = np.datetime_as_string(columns['timestamp'].view('datetime64[ns]'), unit='ms')
+        values = [[None if v != v else v for v in columns[name].tolist()] for name in metrics]
+        rows = [
+            {'timestamp': ts, **{name: column[i] for name, column in zip(metrics, values)
+                                 if column[i] is not None}}
+            for i, ts in enumerate(timestamps.tolist())
+        ]
+        return json.dumps({'type': frame_type, 'version': key, 'seq': seq, 'rows': rows})
+
+    def _snapshot(self, key, feed: _Feed) -> str:
+        if feed.snapshot is None or feed.snapshot[0] != feed.seq:
+            columns = self._columns(key, feed.last_ns - self.window.value, feed.last_ns)
+            feed.snapshot = (feed.seq, self._serialize('snapshot', key, feed.seq, columns))
+            self.stats['snapshots'] += 1
+        return feed.snapshot[1]
+
+    def subscribe(self, version: str = None) -> _Subscriber:
+        feed = self._feeds.get(version)
+        if feed is None:
+            feed = self._feeds[version] = _Feed(now_ns())
+        subscriber = _Subscriber(version)
+        feed.subscribers.add(subscriber)
+        subscriber.offer(self._snapshot(version, feed))
+        if self._producer is None or self._producer.done():
+            self._producer = asyncio.get_running_loop().create_task(self._produce())
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber) -> None:
+        feed = self._feeds.get(subscriber.key)
+        if feed is None:
+            return
+        feed.subscribers.discard(subscriber)
+        if not feed.subscribers:
+            del self._feeds[subscriber.key]
+
+    def publish(self) -> None:
+        """Build one delta per key and hand it to its subscribers"""
+        end_ns = now_ns()
+        for key, feed in list(self._feeds.items()):
+            columns = self._columns(key, feed.last_ns + 1, end_ns)
+            if not len(columns['timestamp']):
+                continue
+            feed.seq += 1
+            feed.last_ns = int(columns['timestamp'][-1])
+            frame = self._serialize('delta', key, feed.seq, columns)
+            self.stats['frames'] += 1
+            for subscriber in feed.subscribers:
+                if subscriber.pending is not None or subscriber.resync:
+                    # Lagging: replace whatever is queued with a snapshot
+                    subscriber.dropped += 1
+                    self.stats['dropped'] += 1
+                    subscriber.resync = True
+                    subscriber.offer(self._snapshot(key, feed))
+                else:
+                    subscriber.offer(frame)
+
+    async def _produce(self) -> None:
+        while self._feeds:
+            await asyncio.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception:
+                # e.g. a tracker or disk read error: retry on the next tick
+                logger.exception("Publishing metrics frames failed")
+
+    async def serve(self, websocket, version: str = None) -> None:
+        """Stream frames to an accepted WebSocket until it disconnects"""
+        subscriber = self.subscribe(version)
+        try:
+            while True:
+                await subscriber.ready.wait()
+                frame, subscriber.pending = subscriber.pending, None
+                subscriber.ready.clear()
+                subscriber.resync = False
+                await websocket.send_text(frame)
+                subscriber.sent += 1
+                self.stats['sent'] += 1
+        finally:
+            self.unsubscribe(subscriber)
+
+    def subscriber_count(self) -> int:
+        return sum(len(feed.subscribers) for feed in self._feeds.values())
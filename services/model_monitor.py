@@ -5,12 +5,48 @@ Tracks prediction accuracy and data drift over time
 from datetime import datetime, timedelta
 import numpy as np
 from sklearn.metrics import mean_absolute_error
+from services.compact_span import datetime_to_ns
+from services.control_chart import ControlChart
 
 class ModelMonitor:
-    def __init__(self, reference_data, window_size=7):
+    """Logs MAE and feature drift per batch and flags degradation
+
+    MAE feeds an online ControlChart and a running mean of the first
+    BASELINE_SIZE batches, so check_for_degradation is O(1) instead of
+    rescanning the log.
+    """
+
+    FIELDS = ('mae', 'feature_drift', 'sample_size')
+    BASELINE_SIZE = 30
+
+    def __init__(self, reference_data=None, window_size=7, store=None, series: str = 'model_monitor',
+                 chart_params: dict = None):
+        """Args:
+            reference_data: Reference feature frame for drift (optional)
+            window_size: Degradation window in days
+            store: TimeSeriesStore persisting the performance log
+                (in memory when None)
+            series: Series name in `store`
+            chart_params: ControlChart arguments for the MAE chart
+        """
         self.reference = reference_data
         self.performance_log = []
         self.window_size = window_size  # Days
+        self.series = store.series(series, self.FIELDS) if store is not None else None
+        self.mae_chart = ControlChart(**(chart_params or {'alpha': 0.3, 'warmup': 5}))
+        self.baseline_count = 0
+        self.baseline_mae = 0.0
+        if self.series is not None:
+            mae = self.FIELDS.index('mae')
+            for timestamps, values in self.series.scan():
+                for timestamp, value in zip(timestamps.tolist(), values[:, mae].tolist()):
+                    self._observe(value, timestamp)
+
+    def _observe(self, mae: float, timestamp_ns: int) -> None:
+        if self.baseline_count < self.BASELINE_SIZE:
+            self.baseline_count += 1
+            self.baseline_mae += (mae - self.baseline_mae) / self.baseline_count
+        self.mae_chart.update(mae, timestamp_ns)
         
     def log_performance(self, y_true, y_pred, features):
         """Record model predictions and actual outcomes"""
@@ -20,24 +56,32 @@ class ModelMonitor:
             'feature_drift': self._calculate_feature_drift(features),
             'sample_size': len(y_true)
         }
-        self.performance_log.append(entry)
+        timestamp_ns = datetime_to_ns(entry['timestamp'])
+        if self.series is not None:
+            self.series.append(timestamp_ns, self.series.row(entry))
+        else:
+            self.performance_log.append(entry)
+        self._observe(entry['mae'], timestamp_ns)
         
     def check_for_degradation(self):
-        """Detect performance degradation in recent window"""
-        recent = [log for log in self.performance_log 
-                 if log['timestamp'] > datetime.now() - timedelta(days=self.window_size)]
-        
-        if len(recent) < 5:  # Minimum data points
+        """Detect performance degradation in recent window
+
+        True when MAE has been logged within the window, at least five
+        times overall, and either its EWMA is 15% above the baseline MAE
+        or the chart's upper CUSUM signals a sustained increase.
+        """
+        chart = self.mae_chart
+        cutoff = datetime_to_ns(datetime.now() - timedelta(days=self.window_size))
+        if chart.n < 5 or chart.last_ts is None or chart.last_ts <= cutoff:  # Minimum data points
             return False
-            
-        current_mae = np.mean([log['mae'] for log in recent[-3:]])
-        baseline_mae = np.mean([log['mae'] for log in self.performance_log[:30]])
-        
-        return current_mae > baseline_mae * 1.15  # 15% performance drop
+        return (chart.ewma > self.baseline_mae * 1.15  # 15% performance drop
+                or chart.cusum_upper > chart.cusum_h)
 
     def _calculate_feature_drift(self, current_features):
         """Compute KL divergence between current and reference features"""
+        if self.reference is None:
+            return np.nan
         # Simplified implementation
         ref_means = self.reference.mean()
         curr_means = current_features.mean()
-        return np.sum((curr_means - ref_means)**2) 
\ No newline at end of file
+        return np.sum((curr_means - ref_means)**2)
@@ -1,15 +1,50 @@
+import threading
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from services.compact_span import now_ns
+from services.metric_store import ColumnarMetricStore
+from services.quantile_sketch import SketchSeries
+from services.control_chart import ControlCharts
+from services.timeseries_store import timeseries_store
 
 class PerformanceTracker:
-    """Tracks and analyzes model performance metrics over time"""
+    """Tracks and analyzes model performance metrics over time
+
+    History lives in a ColumnarMetricStore: per-version NumPy columns
+    with minute rollups, so logging is O(1) and windowed reads slice
+    views instead of filtering a growing DataFrame. SKETCHED_METRICS also
+    feed per-version DDSketches (minute and hour buckets), so percentiles
+    over any window merge bucket sketches instead of sorting raw rows;
+    they are within `sketch_alpha` relative error of the exact value.
+    CHARTED_METRICS update per-version EWMA/CUSUM control charts
+    (`anomaly_params` are ControlChart arguments) that detect_anomalies
+    reads without touching history.
+
+    Given a TimeSeriesStore, rows are also persisted per version
+    ('performance/<version>'); older ranges are read from disk and the
+    last `replay_seconds` are reloaded into memory on startup.
+    """
+
+    METRICS = (
+        'accuracy', 'precision', 'recall', 'f1', 'roc_auc',
+        'inference_latency', 'throughput', 'request_size', 'latency'
+    )
+    SKETCHED_METRICS = ('latency', 'inference_latency')
+    CHARTED_METRICS = ('accuracy', 'precision', 'recall', 'f1', 'roc_auc', 'inference_latency', 'latency')
+    CHART_REPLAY_LIFETIMES = 50
     
-    def __init__(self):
-        self.history = pd.DataFrame(columns=[
-            'timestamp', 'version', 'accuracy', 
-            'precision', 'recall', 'f1', 'roc_auc',
-            'inference_latency', 'throughput'
-        ])
+    def __init__(self, max_rows_per_version: int = 2_000_000, rollup_seconds: int = 60,
+                 sketch_alpha: float = 0.01, store=None, replay_seconds: int = 86400,
+                 anomaly_params: dict = None):
+        self.store = ColumnarMetricStore(self.METRICS, bucket_seconds=rollup_seconds,
+                                         max_rows=max_rows_per_version,
+                                         backing=store, prefix='performance/')
+        self.sketches = {metric: SketchSeries(alpha=sketch_alpha) for metric in self.SKETCHED_METRICS}
+        self.charts = ControlCharts(**(anomaly_params or {}))
+        self._online_lock = threading.Lock()
+        if store is not None:
+            self._replay(now_ns() - replay_seconds * 1_000_000_000)
         self.baselines = {
             'accuracy': 0.85,
             'precision': 0.8,
@@ -30,94 +65,174 @@ class PerformanceTracker:
                 - inference_latency: Average prediction time (ms)
                 - throughput: Predictions per second
         """
-        new_entry = {
-            'timestamp': datetime.now(),
-            'version': version,
-            **{k: metrics.get(k, None) for k in self.history.columns[2:]}
-        }
-        self.history = pd.concat([self.history, pd.DataFrame([new_entry])], ignore_index=True)
+        self._record(version, metrics)
+
+    def _replay(self, start_ns: int) -> None:
+        # Charts forget exponentially: the newest CHART_REPLAY_LIFETIMES / alpha
+        # values per chart rebuild their state to within e^-CHART_REPLAY_LIFETIMES
+        chart_rows = int(self.CHART_REPLAY_LIFETIMES / self.charts.params.get('alpha', 0.05))
+        for version, (timestamps, values) in self.store.replay(start_ns).items():
+            for metric, series in self.sketches.items():
+                series.add_many(version, timestamps, values[:, self.store.index[metric]])
+            for metric in self.CHARTED_METRICS:
+                column = values[:, self.store.index[metric]]
+                present = np.flatnonzero(~np.isnan(column))[-chart_rows:]
+                for timestamp, value in zip(timestamps[present].tolist(), column[present].tolist()):
+                    self.charts.update(version, metric, value, timestamp)
+
+    def _record(self, version: str, metrics: dict) -> None:
+        timestamp = self.store.append(version, now_ns(), self.store.row(metrics))
+        with self._online_lock:
+            for metric, series in self.sketches.items():
+                value = metrics.get(metric)
+                if value is not None:
+                    series.add(version, timestamp, value)
+            for metric in self.CHARTED_METRICS:
+                value = metrics.get(metric)
+                if value is not None:
+                    self.charts.update(version, metric, value, timestamp)
+
+    @staticmethod
+    def _bounds(window, start: datetime = None, end: datetime = None) -> tuple:
+        start_ns = pd.Timestamp(start).value if start is not None else (
+            now_ns() - pd.Timedelta(window).value if window is not None else None)
+        end_ns = pd.Timestamp(end).value if end is not None else None
+        return start_ns, end_ns
+
+    def get_columns(self, version: str = None, window: pd.Timedelta = pd.Timedelta(days=30),
+                    start: datetime = None, end: datetime = None) -> dict:
+        """Metric arrays for a time range
+        Returns:
+            dict: 'timestamp' (int64 ns) and one float array per metric
+                (NaN where not reported). Zero-copy views when `version`
+                is given; a time-ordered copy across versions otherwise.
+        """
+        start_ns, end_ns = self._bounds(window, start, end)
+        if version is not None:
+            timestamps, values = self.store.range(version, start_ns, end_ns)
+        else:
+            timestamps, values, _ = self.store.range_all(start_ns, end_ns)
+        return {'timestamp': timestamps,
+                **{name: values[:, i] for i, name in enumerate(self.METRICS)}}
         
-    def get_metrics(self, version: str = None, window: pd.Timedelta = pd.Timedelta(days=30)) -> pd.DataFrame:
+    def get_metrics(self, version: str = None, window: pd.Timedelta = pd.Timedelta(days=30),
+                    start: datetime = None, end: datetime = None) -> pd.DataFrame:
         """Retrieves metrics with filtering options
         Args:
             version: Specific model version to filter
             window: Time window for historical data
+            start: Explicit range start (overrides window)
+            end: Explicit range end
         Returns:
-            Filtered DataFrame of performance metrics
+            Time-ordered DataFrame of performance metrics; for a single
+            version the metric columns wrap the stored arrays without copying
         """
-        cutoff = pd.Timestamp.now() - window
-        query = self.history[self.history.timestamp >= cutoff]
-        
-        if version:
-            query = query[query.version == version]
-            
-        return query.sort_values('timestamp')
+        start_ns, end_ns = self._bounds(window, start, end)
+        if version is not None:
+            timestamps, values = self.store.range(version, start_ns, end_ns)
+            versions = pd.Categorical.from_codes(np.zeros(len(timestamps), np.int8), [version])
+        else:
+            timestamps, values, versions = self.store.range_all(start_ns, end_ns)
+        df = pd.DataFrame(values, columns=list(self.METRICS), copy=False)
+        df.insert(0, 'version', versions)
+        df.insert(0, 'timestamp', timestamps.view('datetime64[ns]'))
+        return df
+
+    def get_rollups(self, version: str, window: pd.Timedelta = pd.Timedelta(days=1)) -> pd.DataFrame:
+        """Per-bucket count/mean/min/max of every metric for one version"""
+        start_ns, _ = self._bounds(window)
+        rollups = self.store.rollups(version, start_ns)
+        if not rollups:
+            return pd.DataFrame()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = rollups['sum'] / rollups['count']
+        columns = {'bucket': rollups['bucket'].view('datetime64[ns]')}
+        for i, name in enumerate(self.METRICS):
+            columns[f'{name}_count'] = rollups['count'][:, i]
+            columns[f'{name}_mean'] = mean[:, i]
+            columns[f'{name}_min'] = rollups['min'][:, i]
+            columns[f'{name}_max'] = rollups['max'][:, i]
+        return pd.DataFrame(columns)
     
     def calculate_statistics(self, version: str) -> dict:
         """Computes summary statistics for model version"""
-        df = self.get_metrics(version)
+        cols = self.get_columns(version)
         return {
-            'mean_accuracy': df.accuracy.mean(),
-            'max_precision': df.precision.max(),
-            'min_recall': df.recall.min(),
-            'std_f1': df.f1.std()
+            'mean_accuracy': _nan_stat(np.nanmean, cols['accuracy']),
+            'max_precision': _nan_stat(np.nanmax, cols['precision']),
+            'min_recall': _nan_stat(np.nanmin, cols['recall']),
+            'std_f1': _nan_stat(lambda a: np.nanstd(a, ddof=1), cols['f1'], min_count=2)
         }
 
-    def detect_anomalies(self, version: str) -> dict:
-        """Detects performance anomalies using statistical process control"""
-        df = self.get_metrics(version)
+    def detect_anomalies(self, version: str, metrics=('accuracy', 'precision', 'recall')) -> dict:
+        """Detects performance anomalies using statistical process control
+
+        Reads the online control charts: a metric is reported when its
+        latest value is beyond the EWMA band or a CUSUM crossed its limit.
+        """
         anomalies = {}
-        
-        for metric in ['accuracy', 'precision', 'recall']:
-            if df.empty or metric not in df:
-                continue
-            
-            # Calculate control limits
-            mean = df[metric].mean()
-            std = df[metric].std()
-            upper_limit = mean + 3*std
-            lower_limit = mean - 3*std
-            
-            # Check latest value
-            latest = df[metric].iloc[-1]
-            if latest < lower_limit or latest > upper_limit:
-                anomalies[metric] = {
-                    'current': latest,
-                    'mean': mean,
-                    'std': std,
-                    'threshold': 3
-                }
-            
+        with self._online_lock:
+            for metric in metrics:
+                chart = self.charts.get(version, metric)
+                signal = chart.signal() if chart is not None else None
+                if signal is not None:
+                    anomalies[metric] = {**chart.state(), 'signal': signal}
         return anomalies 
 
     def auto_adjust_baselines(self, window=pd.Timedelta(days=7)):
         """Automatically adjust performance baselines based on recent data"""
-        recent = self.get_metrics(window=window)
+        recent = self.get_columns(window=window)
         self.baselines = {
-            'accuracy': recent.accuracy.quantile(0.9),
-            'precision': recent.precision.quantile(0.9),
-            'recall': recent.recall.quantile(0.9),
-            'roc_auc': recent.roc_auc.quantile(0.9)
-        } 
+            metric: _nan_stat(lambda a: np.nanquantile(a, 0.9), recent[metric])
+            for metric in ('accuracy', 'precision', 'recall', 'roc_auc')
+        }
 
     def track_latency(self, version: str, request_size: int, latency: float):
         """Track prediction latency with request size context"""
-        self.history = self.history.append({
-            'timestamp': datetime.now(),
-            'version': version,
+        self._record(version, {
             'request_size': request_size,
             'latency': latency,
             'throughput': request_size / latency if latency > 0 else 0
-        }, ignore_index=True)
+        })
+
+    def latency_quantiles(self, quantiles=(0.5, 0.95, 0.99), version: str = None,
+                          window: pd.Timedelta = pd.Timedelta(days=30), start: datetime = None,
+                          end: datetime = None, metric: str = 'latency') -> dict:
+        """Percentiles of a sketched metric from merged bucket sketches
+        Args:
+            quantiles: Quantiles in [0, 1]
+            version: Model version (all versions by default)
+            window, start, end: Time range as in get_metrics; edges are
+                rounded out to whole minute buckets
+            metric: One of SKETCHED_METRICS
+        Returns:
+            dict: {'p50': ..., ...}, NaN when nothing was recorded
+        """
+        start_ns, end_ns = self._bounds(window, start, end)
+        with self._online_lock:
+            sketch = self.sketches[metric].merged(version, start_ns,
+                                                  end_ns + 1 if end_ns is not None else None)
+        return {
+            f'p{q * 100:g}': float('nan') if value is None else value
+            for q, value in zip(quantiles, sketch.quantiles(quantiles))
+        }
         
-    def analyze_latency(self, version: str) -> dict:
-        """Perform latency breakdown analysis"""
-        df = self.get_metrics(version)
+    def analyze_latency(self, version: str = None,
+                        window: pd.Timedelta = pd.Timedelta(days=30)) -> dict:
+        """Perform latency breakdown analysis (all versions by default)"""
+        cols = self.get_columns(version, window)
+        latency, size = cols['latency'], cols['request_size']
+        both = ~(np.isnan(latency) | np.isnan(size))
         return {
-            'percentiles': {
-                'p50': df.latency.quantile(0.5),
-                'p95': df.latency.quantile(0.95),
-                'p99': df.latency.quantile(0.99)
-            },
-            'size_correlation': df[['request_size', 'latency']].corr().iloc[0,1]
-        } 
\ No newline at end of file
+            'percentiles': self.latency_quantiles(version=version, window=window),
+            'size_correlation': (float(np.corrcoef(size[both], latency[both])[0, 1])
+                                 if both.sum() > 1 else np.nan)
+        }
+
+def _nan_stat(fn, values: np.ndarray, min_count: int = 1) -> float:
+    """fn over the non-NaN values, NaN when there are too few"""
+    if np.count_nonzero(~np.isnan(values)) < min_count:
+        return np.nan
+    return float(fn(values))
+
+performance_tracker = PerformanceTracker(store=timeseries_store)
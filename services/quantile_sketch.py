@@ -0,0 +1,227 @@
+import math
+import numpy as np
+
+class DDSketch:
+    """Mergeable quantile sketch with a relative-error guarantee (DDSketch)
+
+    A value x > `min_value` lands in bin k = ceil(log_gamma(x)) with
+    gamma = (1 + alpha) / (1 - alpha), and a quantile is answered with
+    2 * gamma^k / (gamma + 1). Every value in bin k lies within a
+    relative error of `alpha` of that estimate, so any quantile is off by
+    at most `alpha` of its true value (1% by default). Values at or below
+    `min_value` (including zero and negatives) are counted in a zero bin.
+
+    Memory is at most `max_bins` bins whatever the number of values; the
+    default covers a dynamic range of about 1e17 at alpha=1% before the
+    lowest bins are collapsed into each other, which only degrades the
+    lowest quantiles. Two sketches with the same alpha merge exactly.
+    """
+
+    __slots__ = ('alpha', 'gamma', '_log_gamma', 'max_bins', 'min_value',
+                 'bins', 'zero_count', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, alpha: float = 0.01, max_bins: int = 2048, min_value: float = 1e-9):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: int = 1) -> None:
+        if value > self.min_value:
+            k = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[k] = self.bins.get(k, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        else:
+            self.zero_count += weight
+        self.count += weight
+        self.sum += value * weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values) -> None:
+        """Vectorized add of an array of values (NaN is skipped)"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        positive = values[values > self.min_value]
+        keys, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64),
+                                 return_counts=True)
+        for k, n in zip(keys.tolist(), counts.tolist()):
+            self.bins[k] = self.bins.get(k, 0) + n
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: 'DDSketch') -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different alpha")
+        for k, n in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + n
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _collapse(self) -> None:
+        # Fold the lowest bins into one so the high quantiles stay exact-bounded
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        target = keys[excess]
+        self.bins[target] += sum(self.bins.pop(k) for k in keys[:excess])
+
+    def quantile(self, q: float):
+        """Estimate of the q-th quantile (0 <= q <= 1), None when empty"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(min(0.0, self.max), self.min)
+        seen = self.zero_count
+        for k in sorted(self.bins):
+            seen += self.bins[k]
+            if seen > rank:
+                estimate = 2 * self.gamma ** k / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs) -> list:
+        """Several quantiles with one pass over the sorted bins"""
+        if not self.count:
+            return [None] * len(qs)
+        keys = sorted(self.bins)
+        results = []
+        for q in qs:
+            rank = q * (self.count - 1)
+            if rank < self.zero_count:
+                results.append(max(min(0.0, self.max), self.min))
+                continue
+            seen, value = self.zero_count, self.max
+            for k in keys:
+                seen += self.bins[k]
+                if seen > rank:
+                    value = min(max(2 * self.gamma ** k / (self.gamma + 1), self.min), self.max)
+                    break
+            results.append(value)
+        return results
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+class SketchSeries:
+    """DDSketches per key and time bucket, kept at two resolutions
+
+    Each value is added to its fine bucket (one minute by default, kept
+    for a day) and its coarse bucket (one hour, kept for 400 days), so no
+    rollup pass is needed. A range query merges coarse buckets that lie
+    fully inside it and fine buckets at the edges, i.e. O(hours + 120)
+    merges for any window; edges older than the fine retention fall back
+    to the overlapping coarse bucket. Memory per key is bounded by the
+    bucket counts times `max_bins`, independent of the request volume.
+    """
+
+    def __init__(self, alpha: float = 0.01, max_bins: int = 2048,
+                 fine_seconds: int = 60, fine_buckets: int = 1440,
+                 coarse_seconds: int = 3600, coarse_buckets: int = 9600):
+        self.alpha = alpha
+        self.max_bins = max_bins
+        self.fine_ns = fine_seconds * 1_000_000_000
+        self.coarse_ns = coarse_seconds * 1_000_000_000
+        self.fine_retention_ns = fine_buckets * self.fine_ns
+        self.coarse_retention_ns = coarse_buckets * self.coarse_ns
+        self._fine = {}     # key -> {bucket_start_ns: DDSketch}, in creation order
+        self._coarse = {}
+        self._newest_ns = 0
+
+    def _sketch(self, levels: dict, key, bucket_start: int) -> DDSketch:
+        buckets = levels.get(key)
+        if buckets is None:
+            buckets = levels[key] = {}
+        sketch = buckets.get(bucket_start)
+        if sketch is None:
+            sketch = buckets[bucket_start] = DDSketch(self.alpha, self.max_bins)
+        return sketch
+
+    def add(self, key, timestamp_ns: int, value: float) -> None:
+        fine_start = timestamp_ns - timestamp_ns % self.fine_ns
+        self._sketch(self._fine, key, fine_start).add(value)
+        self._sketch(self._coarse, key, timestamp_ns - timestamp_ns % self.coarse_ns).add(value)
+        if fine_start > self._newest_ns:
+            self._newest_ns = fine_start
+            self._expire()
+
+    def add_many(self, key, timestamps, values) -> None:
+        """Vectorized add of timestamp/value arrays (NaN values are skipped)"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        present = ~np.isnan(values)
+        timestamps, values = timestamps[present], values[present]
+        if not len(values):
+            return
+        for levels, width in ((self._fine, self.fine_ns), (self._coarse, self.coarse_ns)):
+            starts = timestamps - timestamps % width
+            order = np.argsort(starts, kind='stable')
+            buckets, first = np.unique(starts[order], return_index=True)
+            for bucket_start, group in zip(buckets.tolist(), np.split(values[order], first[1:])):
+                self._sketch(levels, key, bucket_start).add_many(group)
+        fine_start = int(timestamps.max() - timestamps.max() % self.fine_ns)
+        if fine_start > self._newest_ns:
+            self._newest_ns = fine_start
+            self._expire()
+
+    def _expire(self) -> None:
+        for levels, retention in ((self._fine, self.fine_retention_ns),
+                                  (self._coarse, self.coarse_retention_ns)):
+            cutoff = self._newest_ns - retention
+            for key in list(levels):
+                buckets = levels[key]
+                # Late timestamps insert old buckets after newer ones, so scan them all
+                for start in [start for start in buckets if start < cutoff]:
+                    del buckets[start]
+                if not buckets:
+                    del levels[key]
+
+    def keys(self) -> list:
+        return list(self._coarse)
+
+    def merged(self, key=None, start_ns: int = None, end_ns: int = None) -> DDSketch:
+        """One sketch of every value of `key` (all keys when None) in [start_ns, end_ns)"""
+        result = DDSketch(self.alpha, self.max_bins)
+        start_ns = 0 if start_ns is None else start_ns
+        end_ns = math.inf if end_ns is None else end_ns
+        fine_floor = self._newest_ns - self.fine_retention_ns + self.fine_ns
+        for k in ([key] if key is not None else self.keys()):
+            fine = self._fine.get(k, {})
+            for bucket_start, sketch in list(self._coarse.get(k, {}).items()):
+                bucket_end = bucket_start + self.coarse_ns
+                if bucket_end <= start_ns or bucket_start >= end_ns:
+                    continue
+                if (bucket_start >= start_ns and bucket_end <= end_ns) or bucket_start < fine_floor:
+                    result.merge(sketch)
+                    continue
+                # Partially covered hour: use the minute buckets inside the range
+                lo = max(bucket_start, start_ns - start_ns % self.fine_ns)
+                hi = min(bucket_end, end_ns)
+                for fine_start in range(lo, int(hi), self.fine_ns):
+                    fine_sketch = fine.get(fine_start)
+                    if fine_sketch is not None:
+                        result.merge(fine_sketch)
+        return result
@@ -0,0 +1,193 @@
+import math
+import time
+import threading
+from collections import defaultdict
+from services.compact_span import datetime_to_ns
+from services.quantile_sketch import DDSketch
+
+class Comoments:
+    """Streaming means and (co)variances of (x, y), mergeable (Chan et al.)"""
+
+    __slots__ = ('n', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy')
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.0
+        self.m2_x = self.m2_y = self.c_xy = 0.0
+
+    def add(self, x: float, y: float) -> None:
+        self.n += 1
+        dx = x - self.mean_x
+        self.mean_x += dx / self.n
+        dy = y - self.mean_y
+        self.mean_y += dy / self.n
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+
+    def merge(self, other: 'Comoments') -> None:
+        if not other.n:
+            return
+        n = self.n + other.n
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        weight = self.n * other.n / n
+        self.m2_x += other.m2_x + dx * dx * weight
+        self.m2_y += other.m2_y + dy * dy * weight
+        self.c_xy += other.c_xy + dx * dy * weight
+        self.mean_x += dx * other.n / n
+        self.mean_y += dy * other.n / n
+        self.n = n
+
+    def correlation(self):
+        """Pearson r, or None while either variance is zero"""
+        denominator = math.sqrt(self.m2_x * self.m2_y)
+        return self.c_xy / denominator if denominator else None
+
+class _Bucket:
+    """Aggregates of one series over one time bucket"""
+
+    __slots__ = ('count', 'errors', 'error_types', 'latency', 'tag_sums', 'features')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.error_types = defaultdict(int)
+        self.latency = DDSketch()
+        self.tag_sums = defaultdict(float)
+        self.features = {}
+
+    def merge(self, other: '_Bucket') -> None:
+        self.count += other.count
+        self.errors += other.errors
+        for k, n in other.error_types.items():
+            self.error_types[k] += n
+        self.latency.merge(other.latency)
+        for k, v in other.tag_sums.items():
+            self.tag_sums[k] += v
+        for feature, moments in other.features.items():
+            self.features.setdefault(feature, Comoments()).merge(moments)
+
+class RedMetrics:
+    """Rate / errors / duration aggregates derived from spans at ingest
+
+    Every span updates the current time bucket of its `endpoint` and
+    `model_version` series: request count, error count by type, a latency
+    DDSketch (1% relative error on any quantile), sums of TRACKED_TAGS and, for spans carrying a
+    `prediction_value`, co-moments of each `feature_*` tag with the
+    prediction. Spans are observed before tail sampling, so aggregates
+    cover all traffic. Reads merge the buckets in range: O(buckets).
+    """
+
+    DIMENSIONS = ('endpoint', 'model_version')
+    TRACKED_TAGS = ('accuracy',)
+
+    def __init__(self, bucket_seconds: int = 60, retention_seconds: int = 7 * 24 * 3600):
+        self.bucket_ns = bucket_seconds * 1_000_000_000
+        self.retention_ns = retention_seconds * 1_000_000_000
+        self.lock = threading.Lock()
+        self._series = defaultdict(dict)   # (dimension, value) -> {bucket_start_ns: _Bucket}
+        self._newest_ns = 0
+
+    def observe(self, spans: list) -> None:
+        """Fold a batch of CompactSpans into the aggregates"""
+        with self.lock:
+            for span in spans:
+                bucket_start = span.start_ns - span.start_ns % self.bucket_ns
+                for dimension in self.DIMENSIONS:
+                    value = span.get_tag(dimension)
+                    if value is None:
+                        continue
+                    buckets = self._series[(dimension, value)]
+                    bucket = buckets.get(bucket_start)
+                    if bucket is None:
+                        bucket = buckets[bucket_start] = _Bucket()
+                    self._add(bucket, span)
+                if bucket_start > self._newest_ns:
+                    self._newest_ns = bucket_start
+                    self._expire(bucket_start - self.retention_ns)
+
+    def _add(self, bucket: _Bucket, span) -> None:
+        bucket.count += 1
+        error = span.get_tag('error')
+        if error is not None:
+            bucket.errors += 1
+            bucket.error_types[span.get_tag('error_type') or str(error)[:64]] += 1
+        bucket.latency.add(span.duration or 0.0)
+        for tag in self.TRACKED_TAGS:
+            value = span.get_tag(tag)
+            if isinstance(value, (int, float)):
+                bucket.tag_sums[tag] += value
+        prediction = span.get_tag('prediction_value')
+        if prediction is None:
+            return
+        prediction = float(prediction)
+        for key, value in span.tags().items():
+            if key.startswith('feature_') and isinstance(value, (int, float)):
+                moments = bucket.features.get(key[8:])
+                if moments is None:
+                    moments = bucket.features[key[8:]] = Comoments()
+                moments.add(float(value), prediction)
+
+    def _expire(self, cutoff_ns: int) -> None:
+        for key in list(self._series):
+            buckets = self._series[key]
+            for start in [s for s in buckets if s < cutoff_ns]:
+                del buckets[start]
+            if not buckets:
+                del self._series[key]
+
+    def _merged(self, dimension: str, value, start_ns: int, end_ns: int) -> tuple:
+        merged, first, last = _Bucket(), None, None
+        with self.lock:
+            for bucket_start, bucket in self._series.get((dimension, value), {}).items():
+                if bucket_start + self.bucket_ns <= start_ns or bucket_start > end_ns:
+                    continue
+                merged.merge(bucket)
+                first = bucket_start if first is None else min(first, bucket_start)
+                last = bucket_start if last is None else max(last, bucket_start)
+        return merged, first, last
+
+    def summary(self, dimension: str, value, start=None, end=None) -> dict:
+        """Aggregates of one series between two datetimes (default: everything retained)
+        Returns:
+            dict: count, rate per second, errors, error_rate, error_types,
+                latency quantiles, tracked tag means, feature correlations
+        """
+        start_ns = datetime_to_ns(start) if start else 0
+        end_ns = datetime_to_ns(end) if end else float('inf')
+        bucket, first, last = self._merged(dimension, value, start_ns, end_ns)
+        seconds = (last - first + self.bucket_ns) / 1e9 if first is not None else 0
+        latency = bucket.latency
+        p50, p95, p99 = latency.quantiles((0.5, 0.95, 0.99)) if latency.count else (0.0, 0.0, 0.0)
+        return {
+            'count': bucket.count,
+            'rate': bucket.count / seconds if seconds else 0.0,
+            'errors': bucket.errors,
+            'error_rate': bucket.errors / bucket.count if bucket.count else 0.0,
+            'error_types': dict(sorted(bucket.error_types.items(), key=lambda kv: -kv[1])),
+            'latency': {
+                'mean': latency.mean if latency.count else 0.0,
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'max': latency.max if latency.count else 0.0
+            },
+            'tag_means': {tag: total / bucket.count for tag, total in bucket.tag_sums.items()},
+            'feature_correlations': {
+                feature: moments.correlation() for feature, moments in bucket.features.items()
+            }
+        }
+
+    def series(self, dimension: str, value) -> list:
+        """Per-bucket count, errors and p95 latency, oldest first"""
+        with self.lock:
+            buckets = sorted(self._series.get((dimension, value), {}).items())
+            return [{
+                'bucket_start_ns': start,
+                'count': b.count,
+                'errors': b.errors,
+                'p95': b.latency.quantile(0.95) if b.latency.count else 0.0
+            } for start, b in buckets]
+
+red_metrics = RedMetrics()
@@ -1,38 +1,118 @@
+import os
+import logging
+import threading
 import pandas as pd
 from datetime import datetime
-from performance_tracker import performance_tracker
+from services.compact_span import now_ns, datetime_to_ns
+from services.metric_store import TieredRollupStore
+from services.performance_tracker import performance_tracker
+from services.timeseries_store import timeseries_store
+from services.resource_sampler import resource_sampler
+
+logger = logging.getLogger(__name__)
 
 class ResourceMonitor:
-    """Monitors system resource utilization and prediction metrics"""
+    """Monitors system resource utilization and prediction metrics
+
+    A background collector records collect_metrics() every `interval`
+    seconds into a TieredRollupStore (1s points for an hour, 1m for a
+    week, 1h for a year, each with min/max/mean/count); history() picks
+    the resolution from the requested range and point budget. Given a
+    TimeSeriesStore the rings are mmap'ed files under its directory and
+    survive restarts.
+    """
+
+    FIELDS = ('cpu_usage', 'memory_usage', 'request_rate', 'latency_p50', 'latency_p95')
     
-    def __init__(self):
-        self.metrics_history = pd.DataFrame(columns=[
-            'timestamp', 'cpu_usage', 'memory_usage',
-            'request_rate', 'latency_p50', 'latency_p95'
-        ])
+    def __init__(self, interval: float = 1.0, tiers: tuple = TieredRollupStore.DEFAULT_TIERS,
+                 store=None):
+        self.interval = interval
+        directory = os.path.join(store.directory, 'system-rollups') if store is not None else None
+        self.store = TieredRollupStore(self.FIELDS, tiers, directory)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
         
     def collect_metrics(self) -> dict:
         """Collect current system metrics"""
+        # One merge of the last five minutes of latency sketches
+        latency = performance_tracker.latency_quantiles((0.5, 0.95), window=pd.Timedelta(minutes=5))
         return {
             'timestamp': datetime.now(),
             'cpu_usage': self._get_cpu_usage(),
             'memory_usage': self._get_memory_usage(),
             'request_rate': self._get_request_rate(),
-            'latency_p50': performance_tracker.analyze_latency()['percentiles']['p50'],
-            'latency_p95': performance_tracker.analyze_latency()['percentiles']['p95']
+            'latency_p50': latency['p50'],
+            'latency_p95': latency['p95']
+        }
+
+    def record(self, metrics: dict) -> None:
+        """Add one collect_metrics() result to the rollups"""
+        self.store.add(datetime_to_ns(metrics['timestamp']), self.store.row(metrics))
+
+    def start(self) -> None:
+        """Start the background collector"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='resource-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background collector"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        self.store.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.record(self.collect_metrics())
+            except Exception:
+                # One bad sample (psutil, tracker or store error) must not end the history
+                logger.exception("Resource metrics collection failed")
+
+    def history(self, start: datetime = None, end: datetime = None,
+                window: pd.Timedelta = pd.Timedelta(hours=1), max_points: int = 500) -> pd.DataFrame:
+        """Rolled-up metrics over a time range
+        Args:
+            start: Range start (default: `window` before now)
+            end: Range end (default: latest sample)
+            window: Range length when start is not given
+            max_points: Upper bound on returned rows
+        Returns:
+            DataFrame with timestamp, resolution_seconds, and
+            {field}_mean/_min/_max/_count columns, oldest first
+        """
+        start_ns = datetime_to_ns(start) if start is not None else now_ns() - window.value
+        rollups = self.store.query(start_ns, datetime_to_ns(end) if end is not None else None,
+                                   max_points)
+        columns = {
+            'timestamp': rollups['timestamp'].view('datetime64[ns]'),
+            'resolution_seconds': rollups['resolution_ns'] / 1e9
         }
+        for i, name in enumerate(self.FIELDS):
+            columns[f'{name}_mean'] = rollups['mean'][:, i]
+            columns[f'{name}_min'] = rollups['min'][:, i]
+            columns[f'{name}_max'] = rollups['max'][:, i]
+            columns[f'{name}_count'] = rollups['count'][:, i]
+        return pd.DataFrame(columns)
     
     def _get_cpu_usage(self) -> float:
         """Get current CPU utilization percentage"""
-        # Implementation using psutil
-        return 65.0  # Placeholder
+        return resource_sampler.latest()['cpu_usage']
     
     def _get_memory_usage(self) -> float:
         """Get current memory usage percentage"""
-        # Implementation using psutil
-        return 45.0  # Placeholder
+        return resource_sampler.latest()['memory_usage']
     
     def _get_request_rate(self) -> float:
         """Calculate requests per second"""
-        recent = performance_tracker.get_metrics(window=pd.Timedelta(minutes=1))
-        return len(recent) / 60  # Requests per second 
\ No newline at end of file
+        recent = performance_tracker.get_columns(window=pd.Timedelta(minutes=1))
+        return len(recent['timestamp']) / 60  # Requests per second
+
+resource_monitor = ResourceMonitor(store=timeseries_store)
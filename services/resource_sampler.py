@@ -0,0 +1,77 @@
+import threading
+import time
+import psutil
+
+class ResourceSampler:
+    """Refreshes a resource usage snapshot on a background thread
+
+    psutil calls such as `Process().open_files()` cost milliseconds under
+    load, so hot paths read the latest snapshot instead of sampling inline.
+    Each refresh builds a new dict and swaps it in, so readers can keep
+    the snapshot by reference; treat it as read-only.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        """Args:
+            interval: Seconds between refreshes
+        """
+        self.interval = interval
+        self.snapshot = None
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Take a first sample and start the refresh thread
+
+        cpu_percent() measures since its previous call, so the first
+        snapshot has cpu_usage None; the first real value comes one
+        interval later.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            try:
+                psutil.cpu_percent()  # Prime the cpu_percent baseline
+                self.snapshot = self._sample(cpu=False)
+            except psutil.Error:
+                self.snapshot = dict.fromkeys(('memory_usage', 'cpu_usage', 'thread_count', 'open_files'))
+                self.snapshot['sampled_at'] = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='resource-sampler', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the refresh thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def latest(self) -> dict:
+        """Most recent snapshot, starting the sampler on first use"""
+        if self._thread is None:
+            self.start()
+        return self.snapshot
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot = self._sample()
+            except psutil.Error:
+                continue  # Keep serving the previous snapshot
+
+    def _sample(self, cpu: bool = True) -> dict:
+        return {
+            'memory_usage': psutil.virtual_memory().percent,
+            'cpu_usage': psutil.cpu_percent() if cpu else None,
+            'thread_count': threading.active_count(),
+            'open_files': len(self._process.open_files()),
+            'sampled_at': time.time()
+        }
+
+resource_sampler = ResourceSampler()
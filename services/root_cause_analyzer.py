@@ -1,5 +1,8 @@
 import pandas as pd
 import numpy as np
+from services.compact_span import CompactSpan, decode_id
+from services.critical_path import critical_path, operation_key
+from services.tracing import flatten_trace
 
 class RootCauseAnalyzer:
     def __init__(self, data_source):
@@ -57,4 +60,16 @@ class TraceAwareAnalyzer(RootCauseAnalyzer):
             **analysis,
             'suggestions': suggestions,
             'related_logs': tracing_collector.enrich_with_logs(alert['trace_id'])['logs']
-        } 
\ No newline at end of file
+        }
+
+    def identify_bottlenecks(self, trace: dict, top: int = 5) -> list:
+        """Spans with the most time on the trace's critical path"""
+        path = critical_path([CompactSpan.from_dict(span) for span in flatten_trace(trace)])
+        total = sum(ns for _, ns in path) or 1
+        path.sort(key=lambda item: item[1], reverse=True)
+        return [{
+            'operation': operation_key(span),
+            'span_id': decode_id(span.span_id),
+            'critical_time': ns / 1e9,
+            'share': ns / total
+        } for span, ns in path[:top]] 
\ No newline at end of file
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from collections import deque
+import msgpack
+from services.compact_span import CompactSpan, to_unix_ns
+
+class ExportError(Exception):
+    """Sink failure; `retryable` says whether the batch may be sent again"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class FileSink:
+    """Appends spans to a local file, rotating it at `max_bytes`
+
+    format='ndjson' writes one span dict per line; 'msgpack' writes a
+    stream of CompactSpan tuples (read back with msgpack.Unpacker and
+    CompactSpan.from_tuple). Rotated files are path.1 ... path.N.
+    """
+
+    def __init__(self, path: str, format: str = 'ndjson', max_bytes: int = 64 * 1024 * 1024,
+                 backup_count: int = 5):
+        if format not in ('ndjson', 'msgpack'):
+            raise ValueError(f"Unknown span file format: {format}")
+        self.name = f'file:{path}'
+        self.path = path
+        self.format = format
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'ab')
+
+    def _encode(self, span: CompactSpan) -> bytes:
+        if self.format == 'msgpack':
+            return msgpack.packb(span.to_tuple(), use_bin_type=True)
+        return json.dumps(span.to_dict(), default=str).encode() + b'\n'
+
+    def export(self, spans: list) -> None:
+        try:
+            self._file.write(b''.join(self._encode(span) for span in spans))
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            raise ExportError(str(e))
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backup_count:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'ab')
+
+    def close(self) -> None:
+        self._file.close()
+
+def _hex_id(value, nbytes: int) -> str:
+    """OTLP hex ID: low bytes of an int ID, or a hash of other IDs"""
+    if value is None:
+        return ''
+    if not isinstance(value, int):
+        value = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=16).digest(), 'big')
+    return f'{value & ((1 << nbytes * 8) - 1):0{nbytes * 2}x}'
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+class OTLPHttpSink:
+    """Posts spans as OTLP/HTTP JSON (ExportTraceServiceRequest)
+
+    Span times are naive local time; they are converted to Unix epoch
+    nanoseconds (UTC) as OTLP requires.
+    """
+
+    def __init__(self, endpoint: str = 'http://localhost:4318/v1/traces',
+                 service_name: str = 'bellafund', timeout: float = 5.0, headers: dict = None):
+        self.name = f'otlp:{endpoint}'
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def _span(self, span: CompactSpan) -> dict:
+        tags = span.tags()
+        otlp = {
+            'traceId': _hex_id(span.trace_id, 16),
+            'spanId': _hex_id(span.span_id, 8),
+            'name': span.name,
+            'kind': 2 if span.parent_span_id is None else 1,  # SERVER for roots, else INTERNAL
+            'startTimeUnixNano': str(to_unix_ns(span.start_ns)),
+            'endTimeUnixNano': str(to_unix_ns(span.end_ns or span.start_ns)),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in tags.items()],
+            'status': {'code': 2, 'message': str(tags['error'])} if 'error' in tags else {'code': 0}
+        }
+        parent = span.parent_key()
+        if parent is not None:
+            otlp['parentSpanId'] = _hex_id(parent, 8)
+        return otlp
+
+    def payload(self, spans: list) -> dict:
+        return {'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': self.service_name}}
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'services.tracing'},
+                'spans': [self._span(span) for span in spans]
+            }]
+        }]}
+
+    def export(self, spans: list) -> None:
+        body = json.dumps(self.payload(spans)).encode()
+        request = urllib.request.Request(self.endpoint, data=body, headers=self.headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            # OTLP: 429/502/503/504 are retryable, other errors are final
+            raise ExportError(f"HTTP {e.code}", retryable=e.code in (429, 502, 503, 504))
+        except (urllib.error.URLError, OSError) as e:
+            raise ExportError(str(e))
+
+    def close(self) -> None:
+        pass
+
+class _SinkWorker:
+    """Bounded queue and background thread feeding one sink"""
+
+    def __init__(self, sink, exporter: 'SpanExporter'):
+        self.sink = sink
+        self.exporter = exporter
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.busy = False
+        self.stats = {'exported': 0, 'batches': 0, 'retries': 0,
+                      'dropped_queue_full': 0, 'dropped_failed': 0, 'last_error': None}
+        self.thread = threading.Thread(target=self._run, name=f'span-export-{sink.name}', daemon=True)
+        self.thread.start()
+
+    def offer(self, spans: list) -> None:
+        with self.cond:
+            room = self.exporter.max_queue - len(self.queue)
+            if room < len(spans):
+                self.stats['dropped_queue_full'] += len(spans) - max(room, 0)
+                spans = spans[:max(room, 0)]
+            self.queue.extend(spans)
+            if len(self.queue) >= self.exporter.batch_size:
+                self.cond.notify()
+
+    def _run(self) -> None:
+        exporter = self.exporter
+        while True:
+            with self.cond:
+                if len(self.queue) < exporter.batch_size and not exporter._stopping:
+                    self.cond.wait(exporter.flush_interval)
+                if not self.queue:
+                    if exporter._stopping:
+                        return
+                    continue
+                batch = [self.queue.popleft() for _ in range(min(exporter.batch_size, len(self.queue)))]
+                self.busy = True
+            try:
+                self._send(batch)
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+    def _send(self, batch: list) -> None:
+        exporter = self.exporter
+        delay = exporter.backoff
+        for attempt in range(exporter.max_retries + 1):
+            try:
+                self.sink.export(batch)
+                self.stats['exported'] += len(batch)
+                self.stats['batches'] += 1
+                return
+            except ExportError as e:
+                self.stats['last_error'] = str(e)
+                if not e.retryable or attempt == exporter.max_retries or exporter._stopping:
+                    break
+                self.stats['retries'] += 1
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, exporter.max_backoff)
+        self.stats['dropped_failed'] += len(batch)
+
+    def drain(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.cond.notify()
+            while self.queue or self.busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(min(remaining, 0.05))
+                self.cond.notify()
+        return True
+
+class SpanExporter:
+    """Ships stored spans to external sinks off the request path
+
+    export() only appends to each sink's bounded queue and never blocks:
+    when a queue is full the overflow is dropped and counted. One
+    background thread per sink sends batches of up to `batch_size`,
+    at least every `flush_interval` seconds, retrying retryable failures
+    with exponential backoff before dropping the batch. A slow or failing
+    sink therefore only costs its own queue.
+    """
+
+    def __init__(self, sinks: list, max_queue: int = 10000, batch_size: int = 512,
+                 flush_interval: float = 1.0, max_retries: int = 5, backoff: float = 0.2,
+                 max_backoff: float = 10.0):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._stopping = False
+        self._workers = [_SinkWorker(sink, self) for sink in sinks]
+
+    def export(self, spans: list) -> None:
+        """Queue finished CompactSpans for every sink"""
+        for worker in self._workers:
+            worker.offer(spans)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until every queue is empty; False on timeout"""
+        return all(worker.drain(timeout) for worker in self._workers)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """Send what is queued (without further retries), then close sinks"""
+        self.flush(timeout)
+        self._stopping = True
+        for worker in self._workers:
+            with worker.cond:
+                worker.cond.notify_all()
+            worker.thread.join(timeout)
+            worker.sink.close()
+
+    def stats(self) -> dict:
+        return {
+            worker.sink.name: {**worker.stats, 'queued': len(worker.queue)}
+            for worker in self._workers
+        }
@@ -0,0 +1,156 @@
+import heapq
+from services.compact_span import CompactSpan, encode_id
+
+class _SeqIndex:
+    """Ascending span sequence numbers for one index key
+
+    Eviction is FIFO, so the oldest entry is always at `head`. Readers
+    take (seqs, head) once and walk backwards; compaction swaps in a new
+    list instead of mutating the one a reader may be walking.
+    """
+
+    __slots__ = ('seqs', 'head')
+
+    def __init__(self):
+        self.seqs = []
+        self.head = 0
+
+    def append(self, seq: int) -> None:
+        self.seqs.append(seq)
+
+    def popleft(self) -> None:
+        self.head += 1
+        if self.head > 1024 and self.head * 2 > len(self.seqs):
+            self.seqs = self.seqs[self.head:]
+            self.head = 0
+
+    def __len__(self):
+        return len(self.seqs) - self.head
+
+    def newest_first(self):
+        seqs, head = self.seqs, self.head
+        for i in range(len(seqs) - 1, head - 1, -1):
+            yield seqs[i]
+
+def duration_bucket(duration: float) -> int:
+    """Power-of-two millisecond bucket: b covers [2^(b-1), 2^b) ms"""
+    return int((duration or 0) * 1000).bit_length()
+
+class SpanStore:
+    """Bounded ring of CompactSpans with secondary indexes
+
+    Spans get increasing sequence numbers; slot = seq % capacity. Indexes
+    map trace_id, indexed tags and duration bucket to the sequence numbers
+    carrying them, so queries touch only matching spans. Writers must be
+    serialized by the caller; readers may run concurrently.
+    """
+
+    INDEXED_TAGS = ('service', 'model_version', 'endpoint')
+
+    def __init__(self, capacity: int = 1000000):
+        self.capacity = capacity
+        self._ring = [None] * capacity
+        self._next_seq = 0
+        self.by_trace = {}
+        self.by_tag = {tag: {} for tag in self.INDEXED_TAGS}
+        self.by_duration = {}
+
+    def __len__(self):
+        return min(self._next_seq, self.capacity)
+
+    def append(self, span: CompactSpan):
+        """Store span, returning the span it evicted (if any)"""
+        seq = self._next_seq
+        slot = seq % self.capacity
+        evicted = self._ring[slot]
+        if evicted is not None:
+            self._unindex(evicted)
+        self._ring[slot] = span
+        self._index(span, seq)
+        self._next_seq = seq + 1
+        return evicted
+
+    def get(self, seq: int) -> CompactSpan:
+        """Span stored under seq, or None once it has been evicted"""
+        span = self._ring[seq % self.capacity]
+        # Checked after the read: a concurrent overwrite advances _next_seq first
+        if seq < self._next_seq - self.capacity:
+            return None
+        return span
+
+    def _index_keys(self, span: CompactSpan):
+        yield self.by_trace, span.trace_id
+        for tag in self.INDEXED_TAGS:
+            value = span.get_tag(tag)
+            if isinstance(value, (str, int)):
+                yield self.by_tag[tag], value
+        yield self.by_duration, duration_bucket(span.duration)
+
+    def _index(self, span: CompactSpan, seq: int) -> None:
+        for index, key in self._index_keys(span):
+            entry = index.get(key)
+            if entry is None:
+                entry = index[key] = _SeqIndex()
+            entry.append(seq)
+
+    def _unindex(self, span: CompactSpan) -> None:
+        for index, key in self._index_keys(span):
+            entry = index[key]
+            entry.popleft()
+            if not len(entry):
+                del index[key]
+
+    def query(self, filters: dict = None):
+        """Yield matching spans newest-first
+
+        Filters: trace_id, service, model_version, endpoint (exact match;
+        also accepted nested under 'tags') and min_duration in seconds.
+        """
+        filters = dict(filters or {})
+        filters.update(filters.pop('tags', None) or {})
+        trace_id = filters.get('trace_id')
+        if trace_id is not None:
+            trace_id = encode_id(trace_id)
+        tag_filters = {k: v for k, v in filters.items() if k not in ('trace_id', 'min_duration')}
+        min_duration = filters.get('min_duration')
+
+        for seq in self._candidates(trace_id, tag_filters, min_duration):
+            span = self.get(seq)
+            if span is None:
+                continue
+            if trace_id is not None and span.trace_id != trace_id:
+                continue
+            if min_duration is not None and (span.duration or 0) < min_duration:
+                continue
+            if any(span.get_tag(k) != v for k, v in tag_filters.items()):
+                continue
+            yield span
+
+    def _candidates(self, trace_id, tag_filters: dict, min_duration):
+        """Newest-first sequence numbers from the most selective index"""
+        options = []
+        if trace_id is not None:
+            options.append([self.by_trace.get(trace_id)])
+        for tag, value in tag_filters.items():
+            if tag in self.by_tag:
+                options.append([self.by_tag[tag].get(value)])
+        if min_duration is not None:
+            lowest = duration_bucket(min_duration)
+            options.append([e for b, e in list(self.by_duration.items()) if b >= lowest])
+
+        if not options:
+            newest = self._next_seq - 1
+            return range(newest, max(newest - self.capacity, -1), -1)
+        entries = min(options, key=lambda es: sum(len(e) for e in es if e is not None))
+        entries = [e for e in entries if e is not None]
+        if len(entries) == 1:
+            return entries[0].newest_first()
+        return heapq.merge(*(e.newest_first() for e in entries), reverse=True)
+
+    def trace_spans(self, trace_id) -> list:
+        """All retained spans of a trace, oldest first"""
+        entry = self.by_trace.get(encode_id(trace_id))
+        if entry is None:
+            return []
+        spans = [self.get(seq) for seq in entry.newest_first()]
+        return [s for s in reversed(spans) if s is not None]
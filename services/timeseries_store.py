@@ -0,0 +1,399 @@
+import os
+import json
+import threading
+import urllib.parse
+import numpy as np
+
+# Segment file: fixed header, then `capacity` fixed-width records
+SEGMENT_MAGIC = b'BFTSSEG1'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('width', '<i8'), ('rows', '<i8'),
+                         ('capacity', '<i8'), ('first_ns', '<i8'), ('last_ns', '<i8')])
+HEADER_SIZE = 64
+
+def record_dtype(width: int) -> np.dtype:
+    return np.dtype([('timestamp', '<i8'), ('values', '<f8', (width,))])
+
+class _Segment:
+    """One segment file: header plus records sorted by timestamp"""
+
+    __slots__ = ('path', 'width', 'rows', 'capacity', 'first_ns', 'last_ns', 'header', 'records')
+
+    def __init__(self, path: str, width: int, rows: int, capacity: int, first_ns: int, last_ns: int):
+        self.path = path
+        self.width = width
+        self.rows = rows
+        self.capacity = capacity
+        self.first_ns = first_ns
+        self.last_ns = last_ns
+        self.header = None    # Writable maps, only while the segment is active
+        self.records = None
+
+    @classmethod
+    def create(cls, path: str, width: int, capacity: int, first_ns: int) -> '_Segment':
+        with open(path, 'wb') as f:
+            # Sparse: blocks are only allocated as rows are written
+            f.truncate(HEADER_SIZE + capacity * record_dtype(width).itemsize)
+        segment = cls(path, width, 0, capacity, first_ns, first_ns)
+        segment.open_for_append()
+        segment.header['magic'] = SEGMENT_MAGIC
+        segment.header['width'] = width
+        segment.header['capacity'] = capacity
+        segment.header['first_ns'] = first_ns
+        segment.header['last_ns'] = first_ns
+        return segment
+
+    @classmethod
+    def load(cls, path: str) -> '_Segment':
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if not len(header) or header['magic'][0] != SEGMENT_MAGIC:
+            raise ValueError(f"Not a time-series segment: {path}")
+        h = header[0]
+        return cls(path, int(h['width']), int(h['rows']), int(h['capacity']),
+                   int(h['first_ns']), int(h['last_ns']))
+
+    def open_for_append(self) -> None:
+        self.header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))[0]
+        self.records = np.memmap(self.path, dtype=record_dtype(self.width), mode='r+',
+                                 offset=HEADER_SIZE, shape=(self.capacity,))
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray) -> None:
+        n = len(timestamps)
+        self.records['timestamp'][self.rows:self.rows + n] = timestamps
+        self.records['values'][self.rows:self.rows + n] = values
+        self.rows += n
+        self.last_ns = int(timestamps[-1])
+        # Rows before the count: a crash never exposes a half-written row
+        self.header['last_ns'] = self.last_ns
+        self.header['rows'] = self.rows
+
+    def read(self) -> np.ndarray:
+        """Records of the segment (a read-only map, or the active map)"""
+        if self.records is not None:
+            return self.records[:self.rows]
+        if not self.rows:
+            return np.empty(0, record_dtype(self.width))
+        return np.memmap(self.path, dtype=record_dtype(self.width), mode='r',
+                         offset=HEADER_SIZE, shape=(self.rows,))
+
+    def flush(self) -> None:
+        if self.records is not None:
+            self.records.flush()
+            self.header.base.flush()
+
+    def seal(self) -> None:
+        """Drop the writable maps and trim the file to its rows"""
+        if self.records is None:
+            return
+        self.flush()
+        self.header = self.records = None
+        self.capacity = self.rows
+        header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        header[0]['capacity'] = self.rows
+        header.flush()
+        del header
+        os.truncate(self.path, HEADER_SIZE + self.rows * record_dtype(self.width).itemsize)
+
+class Series:
+    """Append-only series of fixed-width float rows in mmap'ed segment files
+
+    Each segment covers at most `segment_rows` rows and one
+    `segment_seconds` period, so old data can be dropped file by file.
+    Appends write into a preallocated (sparse) memory-mapped file; range
+    scans binary search the segment list, then the timestamp column of
+    the few segments involved, and return views into read-only maps, so
+    only the pages a query touches are ever read. Timestamps earlier than
+    the last appended one are recorded at the last one to keep segments
+    sorted.
+
+    Sealing a segment triggers compaction: segments past the retention
+    are deleted and runs of small sealed segments (e.g. low-rate series
+    that roll over daily) are merged up to `segment_rows`.
+    """
+
+    def __init__(self, directory: str, fields: tuple, segment_rows: int = 65536,
+                 segment_seconds: int = 86400, retention_seconds: int = None):
+        self.directory = directory
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.segment_rows = segment_rows
+        self.segment_ns = segment_seconds * 1_000_000_000
+        self.retention_ns = retention_seconds * 1_000_000_000 if retention_seconds else None
+        self.lock = threading.Lock()
+        self.stats = {'appended': 0, 'sealed': 0, 'merged': 0, 'expired': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_meta()
+        self._finish_merge()
+        self.segments = [
+            _Segment.load(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if name.endswith('.seg')
+        ]
+        self.segments = [s for s in self.segments if s.rows or s is self.segments[-1]]
+        if self.segments and self.segments[-1].rows < self.segments[-1].capacity:
+            self.segments[-1].open_for_append()
+
+    def _load_meta(self) -> None:
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = tuple(json.load(f)['fields'])
+            if stored != self.fields:
+                raise ValueError(f"Series {self.directory} has fields {stored}, not {self.fields}")
+            return
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'fields': list(self.fields)}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _finish_merge(self) -> None:
+        """Complete or roll back a merge interrupted by a crash"""
+        intent_path = os.path.join(self.directory, 'merge.json')
+        if not os.path.exists(intent_path):
+            for name in os.listdir(self.directory):
+                if name.endswith('.seg.tmp'):
+                    os.remove(os.path.join(self.directory, name))  # Crashed before the intent
+            return
+        with open(intent_path) as f:
+            intent = json.load(f)
+        if os.path.exists(intent['tmp']):
+            os.remove(intent['tmp'])  # Not yet swapped in: the inputs are intact
+        else:
+            for path in intent['remove']:
+                if os.path.exists(path):
+                    os.remove(path)
+        os.remove(intent_path)
+
+    def _segment_path(self, first_ns: int) -> str:
+        return os.path.join(self.directory, f'{first_ns:020d}.seg')
+
+    def row(self, values: dict) -> np.ndarray:
+        """Field dict -> value row (NaN for missing or None)"""
+        row = np.full(len(self.fields), np.nan)
+        for name, value in values.items():
+            i = self.index.get(name)
+            if i is not None and value is not None:
+                row[i] = value
+        return row
+
+    def append(self, timestamp_ns: int, values) -> None:
+        with self.lock:
+            active = self.segments[-1] if self.segments else None
+            if (active is not None and active.records is not None and active.rows < active.capacity
+                    and active.last_ns <= timestamp_ns
+                    and timestamp_ns // self.segment_ns == active.first_ns // self.segment_ns):
+                # Fast path: one row into the open segment
+                active.records[active.rows] = (timestamp_ns, values)
+                active.rows += 1
+                active.last_ns = timestamp_ns
+                active.header['last_ns'] = timestamp_ns
+                active.header['rows'] = active.rows
+                self.stats['appended'] += 1
+                return
+        self.append_many(np.array([timestamp_ns], np.int64),
+                         np.asarray(values, np.float64).reshape(1, len(self.fields)))
+
+    def append_many(self, timestamps: np.ndarray, values: np.ndarray) -> None:
+        """Append rows; timestamps must be sorted"""
+        timestamps = np.asarray(timestamps, np.int64)
+        values = np.asarray(values, np.float64).reshape(len(timestamps), len(self.fields))
+        with self.lock:
+            if self.segments:
+                timestamps = np.maximum(timestamps, self.segments[-1].last_ns)
+            while len(timestamps):
+                active = self._active(int(timestamps[0]))
+                period_end = active.first_ns - active.first_ns % self.segment_ns + self.segment_ns
+                n = min(active.capacity - active.rows,
+                        int(np.searchsorted(timestamps, period_end, 'left')))
+                active.append(timestamps[:n], values[:n])
+                timestamps, values = timestamps[n:], values[n:]
+                self.stats['appended'] += n
+
+    def _active(self, timestamp_ns: int) -> _Segment:
+        active = self.segments[-1] if self.segments else None
+        if active is not None and active.records is not None:
+            same_period = timestamp_ns // self.segment_ns == active.first_ns // self.segment_ns
+            if active.rows < active.capacity and same_period:
+                return active
+            active.seal()
+            self.stats['sealed'] += 1
+            self._compact(timestamp_ns)
+        segment = _Segment.create(self._segment_path(timestamp_ns), len(self.fields),
+                                  self.segment_rows, timestamp_ns)
+        self.segments.append(segment)
+        return segment
+
+    def _compact(self, now_ns: int) -> None:
+        if self.retention_ns:
+            while len(self.segments) > 1 and self.segments[0].last_ns < now_ns - self.retention_ns:
+                os.remove(self.segments.pop(0).path)
+                self.stats['expired'] += 1
+        # Merge runs of sealed segments that fit in one
+        sealed = [s for s in self.segments if s.records is None]
+        i = 0
+        while i < len(sealed):
+            run, rows = [sealed[i]], sealed[i].rows
+            while i + len(run) < len(sealed) and rows + sealed[i + len(run)].rows <= self.segment_rows:
+                run.append(sealed[i + len(run)])
+                rows += run[-1].rows
+            if len(run) > 1:
+                self._merge(run)
+            i += len(run)
+
+    def _merge(self, run: list) -> None:
+        records = np.concatenate([s.read() for s in run])
+        tmp = run[0].path + '.tmp'
+        header = np.zeros(1, HEADER_DTYPE)
+        header[0] = (SEGMENT_MAGIC, run[0].width, len(records), len(records),
+                     run[0].first_ns, run[-1].last_ns)
+        with open(tmp, 'wb') as f:
+            f.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        intent_path = os.path.join(self.directory, 'merge.json')
+        with open(intent_path, 'w') as f:
+            json.dump({'tmp': tmp, 'remove': [segment.path for segment in run[1:]]}, f)
+        os.replace(tmp, run[0].path)
+        for segment in run[1:]:
+            os.remove(segment.path)  # Open maps of it stay valid until released
+        os.remove(intent_path)
+        merged = _Segment(run[0].path, run[0].width, len(records), len(records),
+                          run[0].first_ns, run[-1].last_ns)
+        position = self.segments.index(run[0])
+        self.segments[position:position + len(run)] = [merged]
+        self.stats['merged'] += len(run) - 1
+
+    def scan(self, start_ns: int = None, end_ns: int = None):
+        """Yield (timestamps, values) views per segment for rows in [start_ns, end_ns]"""
+        # Map under the lock: compaction may delete a file right after, but
+        # open maps keep its data readable
+        with self.lock:
+            segments = self.segments
+            starts = [s.first_ns for s in segments]
+            # First segment that may hold start_ns: the last one starting at or before it
+            first = max(int(np.searchsorted(starts, start_ns, 'right')) - 1, 0) if start_ns is not None else 0
+            mapped = []
+            for segment in segments[first:]:
+                if end_ns is not None and segment.first_ns > end_ns:
+                    break
+                if start_ns is not None and segment.last_ns < start_ns:
+                    continue
+                mapped.append(segment.read())
+        for records in mapped:
+            timestamps = records['timestamp']
+            lo = int(np.searchsorted(timestamps, start_ns, 'left')) if start_ns is not None else 0
+            hi = int(np.searchsorted(timestamps, end_ns, 'right')) if end_ns is not None else len(records)
+            if hi > lo:
+                yield timestamps[lo:hi], records['values'][lo:hi]
+
+    def range(self, start_ns: int = None, end_ns: int = None) -> tuple:
+        """(timestamps, values) of rows in [start_ns, end_ns]; copies only that range"""
+        parts = list(self.scan(start_ns, end_ns))
+        if not parts:
+            return np.empty(0, np.int64), np.empty((0, len(self.fields)))
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([ts for ts, _ in parts]), np.concatenate([v for _, v in parts])
+
+    def first(self, n: int = 1) -> tuple:
+        """(timestamps, values) of the oldest n rows"""
+        parts = []
+        with self.lock:
+            for segment in self.segments:
+                records = segment.read()[:n]
+                parts.append(records)
+                n -= len(records)
+                if n <= 0:
+                    break
+        if not parts:
+            return np.empty(0, np.int64), np.empty((0, len(self.fields)))
+        records = np.concatenate(parts)
+        return records['timestamp'], records['values']
+
+    def last(self, n: int = 1) -> tuple:
+        """(timestamps, values) of the newest n rows"""
+        parts = []
+        with self.lock:
+            for segment in reversed(self.segments):
+                records = segment.read()[-n:]
+                parts.insert(0, records)
+                n -= len(records)
+                if n <= 0:
+                    break
+        if not parts:
+            return np.empty(0, np.int64), np.empty((0, len(self.fields)))
+        records = np.concatenate(parts)
+        return records['timestamp'], records['values']
+
+    def __len__(self) -> int:
+        return sum(s.rows for s in self.segments)
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.segments:
+                self.segments[-1].flush()
+
+    def compact(self, now_ns: int = None) -> None:
+        with self.lock:
+            self._compact(now_ns if now_ns is not None else
+                          (self.segments[-1].last_ns if self.segments else 0))
+
+class TimeSeriesStore:
+    """Directory of named Series (one subdirectory each)
+
+    Names may contain '/', e.g. 'performance/v2'; they are URL-quoted
+    into a single directory name.
+    """
+
+    def __init__(self, directory: str, segment_rows: int = 65536, segment_seconds: int = 86400,
+                 retention_days: int = 400):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_days * 86400 if retention_days else None
+        self.lock = threading.Lock()
+        self._series = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def series(self, name: str, fields: tuple) -> Series:
+        """Open or create a series; its fields are fixed at creation"""
+        series = self._series.get(name)
+        if series is None:
+            with self.lock:
+                series = self._series.get(name)
+                if series is None:
+                    series = self._series[name] = Series(
+                        os.path.join(self.directory, urllib.parse.quote(name, safe='')), fields,
+                        self.segment_rows, self.segment_seconds, self.retention_seconds)
+        if series.fields != tuple(fields):
+            raise ValueError(f"Series {name} has fields {series.fields}, not {tuple(fields)}")
+        return series
+
+    def names(self, prefix: str = '') -> list:
+        """Names of all series on disk starting with `prefix`"""
+        names = (urllib.parse.unquote(entry) for entry in os.listdir(self.directory)
+                 if os.path.exists(os.path.join(self.directory, entry, 'meta.json')))
+        return sorted(name for name in names if name.startswith(prefix))
+
+    def exists(self, name: str) -> bool:
+        return name in self._series or os.path.exists(
+            os.path.join(self.directory, urllib.parse.quote(name, safe=''), 'meta.json'))
+
+    def fields(self, name: str) -> tuple:
+        with open(os.path.join(self.directory, urllib.parse.quote(name, safe=''), 'meta.json')) as f:
+            return tuple(json.load(f)['fields'])
+
+    def open(self, name: str) -> Series:
+        """Open an existing series with its stored fields"""
+        return self.series(name, self.fields(name))
+
+    def flush(self) -> None:
+        for series in list(self._series.values()):
+            series.flush()
+
+    def compact(self) -> None:
+        for series in list(self._series.values()):
+            series.compact()
+
+    def close(self) -> None:
+        self.flush()
+
+timeseries_store = TimeSeriesStore(os.getenv('METRICS_STORE_DIR')) if os.getenv('METRICS_STORE_DIR') else None
@@ -0,0 +1,202 @@
+import os
+import zlib
+import threading
+from collections import deque
+
+try:
+    import zstandard
+except ImportError:  # zstd codecs are optional
+    zstandard = None
+
+class ZlibCodec:
+    """zlib at a fixed level"""
+
+    def __init__(self, level: int = 6):
+        self.level = level
+        self.name = f'zlib-{level}'
+
+    def compress(self, data: bytes) -> tuple:
+        """Returns (payload, dict_id); zlib never uses a dictionary"""
+        return zlib.compress(data, self.level), None
+
+    def decompress(self, payload: bytes, dict_id: int = None) -> bytes:
+        return zlib.decompress(payload)
+
+class ZstdCodec:
+    """zstd at a fixed level"""
+
+    def __init__(self, level: int = 3):
+        if zstandard is None:
+            raise RuntimeError("zstd codecs require the 'zstandard' package")
+        self.level = level
+        self.name = f'zstd-{level}'
+        # zstandard (de)compressor objects must not be shared across threads
+        self._local = threading.local()
+
+    def _compressor(self, dictionary=None):
+        cache = self._local.__dict__.setdefault('compressors', {})
+        key = dictionary.dict_id() if dictionary is not None else None
+        if key not in cache:
+            cache[key] = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+        return cache[key]
+
+    def _decompressor(self, dictionary=None):
+        cache = self._local.__dict__.setdefault('decompressors', {})
+        key = dictionary.dict_id() if dictionary is not None else None
+        if key not in cache:
+            cache[key] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return cache[key]
+
+    def compress(self, data: bytes) -> tuple:
+        return self._compressor().compress(data), None
+
+    def decompress(self, payload: bytes, dict_id: int = None) -> bytes:
+        return self._decompressor().decompress(payload)
+
+class MissingDictionaryError(LookupError):
+    """Raised when a segment needs a zstd dictionary nobody registered"""
+    pass
+
+class DictionaryRegistry:
+    """zstd dictionaries by dict_id, shared by every codec in the process
+
+    Trained dictionaries are saved as `dict-<id>.zdict` in `directory`
+    (TRACE_DICT_DIR by default). Lookups check memory first, then every
+    attached directory (the registry's own and e.g. segment log
+    directories, which use the same file names), so segments written by
+    another instance decode as long as its dictionaries are reachable.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self._dictionaries = {}
+        self._directories = [directory] if directory else []
+        self._lock = threading.Lock()
+
+    def attach(self, directory: str) -> None:
+        """Also look up dictionaries saved in `directory`"""
+        with self._lock:
+            if directory not in self._directories:
+                self._directories.append(directory)
+
+    def add(self, dictionary) -> int:
+        """Register (and persist) a dictionary; returns its dict_id"""
+        dict_id = dictionary.dict_id()
+        if self.directory:
+            path = os.path.join(self.directory, f'dict-{dict_id}.zdict')
+            if not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(dictionary.as_bytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + '.tmp', path)
+        with self._lock:
+            self._dictionaries[dict_id] = dictionary
+        return dict_id
+
+    def get(self, dict_id: int):
+        dictionary = self._dictionaries.get(dict_id)
+        if dictionary is not None:
+            return dictionary
+        with self._lock:
+            directories = list(self._directories)
+        for directory in directories:
+            path = os.path.join(directory, f'dict-{dict_id}.zdict')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    dictionary = zstandard.ZstdCompressionDict(f.read())
+                with self._lock:
+                    self._dictionaries[dict_id] = dictionary
+                return dictionary
+        raise MissingDictionaryError(
+            f"zstd dictionary {dict_id} is not registered; set TRACE_DICT_DIR or attach "
+            f"the directory of the instance that wrote the segment (searched: {directories})")
+
+dictionary_registry = DictionaryRegistry(os.getenv("TRACE_DICT_DIR"))
+
+class TrainedZstdCodec(ZstdCodec):
+    """zstd with a dictionary periodically retrained on recent batches
+
+    Small segments of similarly shaped spans compress much better with a
+    shared dictionary. Every `retrain_every` batches a new dictionary is
+    trained from the last `sample_batches` inputs on a background thread,
+    while compression carries on with the current one. Segments record
+    the dict_id they used; dictionaries live in a DictionaryRegistry
+    (the process-wide one by default) so any codec can decompress them.
+    """
+
+    def __init__(self, level: int = 3, dict_size: int = 64 * 1024,
+                 retrain_every: int = 1000, sample_batches: int = 200,
+                 registry: DictionaryRegistry = None):
+        super().__init__(level)
+        self.name = f'zstd-dict-{level}'
+        self.dict_size = dict_size
+        self.retrain_every = retrain_every
+        self.registry = registry if registry is not None else dictionary_registry
+        self.current = None
+        self._samples = deque(maxlen=sample_batches)
+        self._since_training = 0
+        self._trainer = None
+        self._train_lock = threading.Lock()
+
+    def compress(self, data: bytes) -> tuple:
+        self._observe(data)
+        dictionary = self.current
+        if dictionary is None:
+            return self._compressor().compress(data), None
+        return self._compressor(dictionary).compress(data), dictionary.dict_id()
+
+    def decompress(self, payload: bytes, dict_id: int = None) -> bytes:
+        if dict_id is None:
+            return self._decompressor().decompress(payload)
+        return self._decompressor(self.registry.get(dict_id)).decompress(payload)
+
+    def dictionary(self, dict_id: int):
+        return self.registry.get(dict_id)
+
+    def load_dictionary(self, data: bytes) -> int:
+        """Register a saved dictionary (e.g. on restart); returns its dict_id"""
+        return self.registry.add(zstandard.ZstdCompressionDict(data))
+
+    def _observe(self, data: bytes) -> None:
+        with self._train_lock:
+            self._samples.append(data)
+            self._since_training += 1
+            if self._since_training < self.retrain_every and self.current is not None:
+                return
+            if self._trainer is not None or len(self._samples) < min(self._samples.maxlen, 20):
+                return
+            samples = list(self._samples)
+            self._since_training = 0
+            self._trainer = threading.Thread(target=self._train, args=(samples,), daemon=True,
+                                             name='zstd-dict-train')
+            self._trainer.start()
+
+    def _train(self, samples: list) -> None:
+        try:
+            dictionary = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+            self.registry.add(dictionary)
+            self.current = dictionary
+        except zstandard.ZstdError:
+            pass  # Too little sample data; keep the previous dictionary
+        finally:
+            with self._train_lock:
+                self._trainer = None
+
+    def wait_for_training(self, timeout: float = None) -> None:
+        """Block until a running training pass has finished"""
+        trainer = self._trainer
+        if trainer is not None:
+            trainer.join(timeout)
+
+def make_codec(spec: str):
+    """Build a codec from 'zlib[-level]', 'zstd[-level]' or 'zstd-dict[-level]'"""
+    kind, _, level = spec.rpartition('-')
+    if not level.isdigit():
+        kind, level = spec, None
+    kwargs = {'level': int(level)} if level else {}
+    codecs = {'zlib': ZlibCodec, 'zstd': ZstdCodec, 'zstd-dict': TrainedZstdCodec}
+    if kind not in codecs:
+        raise ValueError(f"Unknown codec: {spec}")
+    return codecs[kind](**kwargs)
@@ -0,0 +1,168 @@
+import heapq
+from itertools import count
+from datetime import datetime
+from services.compact_span import CompactSpan, datetime_to_ns, encode_id
+
+class TraceQueryPlanner:
+    """Newest-first span queries across every trace storage tier
+
+    Tiers, from newest to oldest: the collector's span store, the
+    compressor's uncompressed spans, compressed segments and the archive.
+    Spans are merged through one heap ordered by (start desc, span_id).
+    In-memory tiers hold spans in arrival order, so each contributes only
+    its `limit` newest matches by start (one bounded pass, no full sort).
+    Segments and archive chunks enter the heap as placeholders keyed by
+    their newest start time and are only decoded once they reach the top,
+    so a query that fills `limit` from recent data never touches older
+    tiers. Header checks (time range, Bloom filter) prune placeholders
+    before anything is fetched.
+
+    Cursors are opaque strings naming the last span returned; passing one
+    resumes strictly after it.
+    """
+
+    def __init__(self, collector, compressor=None, archiver=None):
+        self.collector = collector
+        self.compressor = compressor
+        self.archiver = archiver
+
+    def query(self, start: datetime = None, end: datetime = None, filters: dict = None,
+              limit: int = None, cursor: str = None):
+        """Yield matching span dicts, newest first
+        Args:
+            start: Earliest span start_time (naive local time)
+            end: Latest span start_time (naive local time)
+            filters: trace_id, service, model_version, endpoint (also under
+                'tags') and min_duration, as for SpanStore.query
+            limit: Stop after this many spans
+            cursor: Resume after the span this cursor was taken from
+        Raises:
+            ValueError: For a timezone-aware start/end or a malformed cursor
+        """
+        return (span.to_dict() for span in self.spans(start, end, filters, limit, cursor))
+
+    def spans(self, start: datetime = None, end: datetime = None, filters: dict = None,
+              limit: int = None, cursor: str = None):
+        """Like query(), but yields the stored CompactSpans"""
+        start_ns, end_ns = self._bound(start, 'start'), self._bound(end, 'end')
+        after = self._parse_cursor(cursor) if cursor else None
+        return self._merge(start_ns, end_ns, filters, limit, after)
+
+    def page(self, start: datetime = None, end: datetime = None, filters: dict = None,
+             limit: int = 100, cursor: str = None) -> tuple:
+        """Returns:
+            tuple: (span dicts newest first, cursor for the next page or None)
+        """
+        spans = list(self.spans(start, end, filters, limit, cursor))
+        next_cursor = self.cursor_for(spans[-1]) if limit and len(spans) == limit else None
+        return [span.to_dict() for span in spans], next_cursor
+
+    @staticmethod
+    def cursor_for(span: CompactSpan) -> str:
+        return f"{span.start_ns}:{span.span_id}"
+
+    @staticmethod
+    def _parse_cursor(cursor: str) -> tuple:
+        start_ns, sep, span_id = cursor.partition(':')
+        if not sep or not span_id or not start_ns.lstrip('-').isdigit():
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+        return -int(start_ns), span_id
+
+    @staticmethod
+    def _bound(value: datetime, name: str):
+        if value is None:
+            return None
+        if value.tzinfo is not None:
+            # Span times are naive local time; refuse to guess the conversion
+            raise ValueError(f"{name} must be a naive local datetime, got {value.isoformat()}")
+        return datetime_to_ns(value)
+
+    def _merge(self, start_ns, end_ns, filters, limit, after):
+        filters = dict(filters or {})
+        filters.update(filters.pop('tags', None) or {})
+        filters = {k: v for k, v in filters.items() if v is not None}
+        if after is not None and (end_ns is None or -after[0] < end_ns):
+            end_ns = -after[0]  # Nothing newer than the cursor can follow it
+        trace_key = encode_id(filters['trace_id']) if filters.get('trace_id') is not None else None
+        matches = _matcher(filters, trace_key, start_ns, end_ns)
+
+        heap, tiebreak = [], count()
+
+        def entry(item):
+            if isinstance(item, _Pending):
+                return (-item.newest_ns, 0, '', next(tiebreak), item)
+            return (-item.start_ns, 1, str(item.span_id), next(tiebreak), item)
+
+        def newest(spans):
+            # In-memory tiers are in arrival (end time) order, not start order:
+            # keep only what may follow the cursor, then the `limit` newest by start
+            if after is not None:
+                spans = (span for span in spans if (-span.start_ns, str(span.span_id)) > after)
+            if limit is None:
+                return spans
+            return heapq.nsmallest(limit, spans, key=lambda span: (-span.start_ns, str(span.span_id)))
+
+        self.collector.flush()
+        heap.extend(map(entry, newest(filter(matches, self.collector.spans.query(filters)))))
+        if self.compressor is not None:
+            self.compressor.flush()
+            heap.extend(map(entry, newest(filter(matches, self.compressor.snapshot()))))
+            for segment in list(self.compressor.compressed_data):
+                if segment.overlaps(start_ns, end_ns) and (trace_key is None or segment.may_contain(trace_key)):
+                    heap.append(entry(_Pending(segment.max_start_ns, self._segment_expander(segment, matches))))
+        if self.archiver is not None:
+            for chunk in self.archiver.chunks_for(start_ns, end_ns):
+                heap.append(entry(_Pending(chunk['max_start_ns'],
+                                           self._chunk_expander(chunk, start_ns, end_ns, trace_key, matches))))
+        heapq.heapify(heap)
+
+        returned = 0
+        while heap and (limit is None or returned < limit):
+            neg_start, kind, span_key, _, item = heapq.heappop(heap)
+            if kind == 0:
+                for child in item.expand():
+                    heapq.heappush(heap, entry(child))
+                continue
+            if after is not None and (neg_start, span_key) <= after:
+                continue
+            returned += 1
+            yield item
+
+    def _segment_expander(self, segment, matches):
+        def expand():
+            return [span for span in self.compressor._decode_or_skip(segment) if matches(span)]
+        return expand
+
+    def _chunk_expander(self, chunk: dict, start_ns, end_ns, trace_key, matches):
+        def expand():
+            # Archived segments stay placeholders too: one range read each, on demand
+            return [_Pending(segment.max_start_ns, self._archived_expander(load, matches))
+                    for segment, load in self.archiver.chunk_segments(chunk, start_ns, end_ns, trace_key)]
+        return expand
+
+    def _archived_expander(self, load, matches):
+        def expand():
+            return [span for span in self.compressor._decode_or_skip(load()) if matches(span)]
+        return expand
+
+class _Pending:
+    """Heap placeholder for a segment or chunk not yet decoded"""
+
+    __slots__ = ('newest_ns', 'expand')
+
+    def __init__(self, newest_ns: int, expand):
+        self.newest_ns = newest_ns
+        self.expand = expand
+
+def _matcher(filters: dict, trace_key, start_ns, end_ns):
+    """Predicate over CompactSpans for the SpanStore.query filter set"""
+    min_duration = filters.get('min_duration')
+    tag_filters = {k: v for k, v in filters.items() if k not in ('trace_id', 'min_duration')}
+
+    def matches(span: CompactSpan) -> bool:
+        return ((start_ns is None or span.start_ns >= start_ns) and
+                (end_ns is None or span.start_ns <= end_ns) and
+                (trace_key is None or span.trace_id == trace_key) and
+                (min_duration is None or (span.duration or 0) >= min_duration) and
+                all(span.get_tag(k) == v for k, v in tag_filters.items()))
+    return matches
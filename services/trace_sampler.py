@@ -0,0 +1,148 @@
+import time
+import random
+import threading
+from collections import OrderedDict, deque
+
+class TailSampler:
+    """Tail-based trace sampling under a spans/s budget
+
+    Spans are held per trace until the local root span arrives (no
+    parent, or tagged 'local_root' when its parent is remote) or the
+    trace has waited `decision_wait` seconds; then the whole trace is kept
+    or dropped together:
+        - traces with an error tag are always kept
+        - traces at or above the `latency_percentile` of recent root
+          durations are always kept
+        - the rest are kept with probability `baseline_rate`, which is
+          re-tuned every `adjust_interval` so kept spans/s track the budget
+
+    Kept spans carry the probability they were kept in `sample_rate`, so
+    aggregates over stored spans can be re-weighted by 1 / sample_rate.
+    """
+
+    def __init__(self, spans_per_second: float = 1000.0, latency_percentile: float = 0.99,
+                 decision_wait: float = 5.0, max_pending_traces: int = 10000,
+                 min_rate: float = 0.001, adjust_interval: float = 1.0):
+        self.spans_per_second = spans_per_second
+        self.latency_percentile = latency_percentile
+        self.decision_wait = decision_wait
+        self.max_pending_traces = max_pending_traces
+        self.min_rate = min_rate
+        self.adjust_interval = adjust_interval
+
+        self.baseline_rate = 1.0
+        self.latency_threshold = None    # Until enough root durations were seen
+        self.lock = threading.Lock()
+        self._pending = OrderedDict()   # trace_id -> (first_seen, [spans]), oldest first
+        self._decided = OrderedDict()   # trace_id -> sample_rate (0 = dropped) for late spans
+        self._recent_durations = deque(maxlen=2000)
+        self._decisions_since_threshold = 0
+        self._window_start = time.monotonic()
+        self._window = {'forced': 0, 'baseline_offered': 0}
+        self.stats = {'kept': {'error': 0, 'slow': 0, 'baseline': 0}, 'dropped': 0}
+
+    def offer(self, spans: list) -> list:
+        """Buffer finished spans; return spans of traces decided as kept"""
+        kept = []
+        now = time.monotonic()
+        with self.lock:
+            for span in spans:
+                rate = self._decided.get(span.trace_id)
+                if rate is not None:
+                    # Straggler of an already decided trace
+                    if rate:
+                        span.sample_rate = rate
+                        kept.append(span)
+                    continue
+                entry = self._pending.get(span.trace_id)
+                if entry is None:
+                    entry = self._pending[span.trace_id] = (now, [])
+                entry[1].append(span)
+                if span.parent_span_id is None or (span.extra is not None and span.extra.get('local_root')):
+                    del self._pending[span.trace_id]
+                    kept.extend(self._decide(span.trace_id, entry[1], span))
+            kept.extend(self._expire(now))
+            if now - self._window_start >= self.adjust_interval:
+                self._adjust_rate(now)
+        return kept
+
+    def expire(self) -> list:
+        """Decide traces that waited too long for their root span"""
+        with self.lock:
+            return self._expire(time.monotonic())
+
+    def effective_rates(self) -> dict:
+        """Current keep probability per sampling reason"""
+        return {
+            'error': 1.0,
+            'slow': 1.0,
+            'baseline': self.baseline_rate,
+            'latency_threshold': self.latency_threshold,
+            'pending_traces': len(self._pending),
+            'kept_spans': dict(self.stats['kept']),
+            'dropped_spans': self.stats['dropped']
+        }
+
+    def _expire(self, now: float) -> list:
+        kept = []
+        while self._pending:
+            trace_id, (first_seen, spans) = next(iter(self._pending.items()))
+            if (now - first_seen < self.decision_wait and
+                    len(self._pending) <= self.max_pending_traces):
+                break
+            del self._pending[trace_id]
+            kept.extend(self._decide(trace_id, spans, None))
+        return kept
+
+    def _decide(self, trace_id, spans: list, root) -> list:
+        duration = (root.duration if root is not None else max(s.duration or 0 for s in spans)) or 0
+        self._record_duration(duration)
+
+        if any('error' in s.tag_layout.keys for s in spans):
+            reason, rate = 'error', 1.0
+        elif self.latency_threshold is not None and duration >= self.latency_threshold:
+            reason, rate = 'slow', 1.0
+        else:
+            reason, rate = 'baseline', self.baseline_rate
+            self._window['baseline_offered'] += len(spans)
+            if rate < 1.0 and random.random() >= rate:
+                rate = 0.0
+
+        self._decided[trace_id] = rate
+        if len(self._decided) > self.max_pending_traces * 10:
+            self._decided.popitem(last=False)
+
+        if not rate:
+            self.stats['dropped'] += len(spans)
+            return []
+        if reason != 'baseline':
+            self._window['forced'] += len(spans)
+        self.stats['kept'][reason] += len(spans)
+        for span in spans:
+            span.sample_rate = rate
+        return spans
+
+    def _record_duration(self, duration: float) -> None:
+        self._recent_durations.append(duration)
+        self._decisions_since_threshold += 1
+        if self._decisions_since_threshold >= 100:
+            self._decisions_since_threshold = 0
+            ordered = sorted(self._recent_durations)
+            self.latency_threshold = ordered[min(int(self.latency_percentile * len(ordered)),
+                                                 len(ordered) - 1)]
+
+    def _adjust_rate(self, now: float) -> None:
+        """Steer the baseline rate so kept spans/s meet the budget"""
+        elapsed = now - self._window_start
+        forced_rate = self._window['forced'] / elapsed
+        offered_rate = self._window['baseline_offered'] / elapsed
+        if offered_rate > 0:
+            target = max(self.spans_per_second - forced_rate, 0) / offered_rate
+            target = min(max(target, self.min_rate), 1.0)
+            # Cut immediately when over budget, recover gradually
+            if target < self.baseline_rate:
+                self.baseline_rate = target
+            else:
+                self.baseline_rate = 0.5 * self.baseline_rate + 0.5 * target
+        self._window_start = now
+        self._window = {'forced': 0, 'baseline_offered': 0}
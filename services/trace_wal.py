@@ -0,0 +1,312 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+import threading
+import msgpack
+
+# Record: magic, header length, payload length, crc32(header + payload)
+RECORD_MAGIC = b'BFSG'
+RECORD_PREFIX = struct.Struct('>4sIII')
+
+class SegmentLog:
+    """Append-only on-disk log of compressed trace segments
+
+    Segments are appended to numbered files `seg-NNNNNNNN.log`. Each
+    file has a sibling `.idx` holding a msgpack stream of
+    (offset, header_len, payload_len, header) entries, written after the
+    records they describe were fsynced. Recovery reads the index files and
+    validates only the records written after the last indexed one, so it
+    never touches segment payloads. A torn tail is truncated.
+
+    Writes are fsynced in groups: every `sync_every` segments or after
+    `sync_interval` seconds, whichever comes first. Durable segments have
+    their in-memory payloads swapped for views into an mmap of the file,
+    so the page cache holds the bytes instead of the heap. The swap waits
+    until `remap_bytes` of synced data lie past the current map (or the
+    file rotates or closes), so one mapping serves many syncs.
+    """
+
+    def __init__(self, directory: str, max_file_size: int = 256 * 1024 * 1024,
+                 sync_every: int = 64, sync_interval: float = 0.2, remap_bytes: int = 8 * 1024 * 1024):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.remap_bytes = remap_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self._maps = {}          # file_no -> mmap
+        self._unsynced = []      # (segment, file_no, offset, header_len, payload_len, header)
+        self._durable = []       # (segment, file_no, payload offset, payload_len), still heap-backed
+        self._file_max = {}      # file_no -> newest segment start in it
+        self.purged_before_ns = self._read_purge_marker()
+        self._file_no = None
+        self._log = None
+        self._idx = None
+        self._stop = threading.Event()
+        self._syncer = None
+        self.stats = {'appended': 0, 'syncs': 0, 'recovered': 0, 'truncated_bytes': 0}
+
+    def _path(self, file_no: int, ext: str) -> str:
+        return os.path.join(self.directory, f'seg-{file_no:08d}.{ext}')
+
+    def file_numbers(self) -> list:
+        return sorted(int(name[4:12]) for name in os.listdir(self.directory)
+                      if name.startswith('seg-') and name.endswith('.log'))
+
+    # --- recovery -----------------------------------------------------------
+
+    def recover(self, segment_factory) -> list:
+        """Rebuild segments from disk, oldest first
+
+        Args:
+            segment_factory: Callable (header, payload) -> segment
+        Returns:
+            list: Recovered segments with mmap-backed payloads
+        """
+        start = time.perf_counter()
+        segments = []
+        for file_no in self.file_numbers():
+            for offset, header_len, payload_len, header in self._recover_file(file_no):
+                self._file_max[file_no] = max(self._file_max.get(file_no, 0), header[1])
+                if header[1] < self.purged_before_ns:
+                    continue
+                payload_offset = offset + RECORD_PREFIX.size + header_len
+                segments.append(segment_factory(header, self.view(file_no, payload_offset, payload_len)))
+        self.stats['recovered'] = len(segments)
+        self.stats['recovery_seconds'] = time.perf_counter() - start
+        self._open_active()
+        return segments
+
+    def _recover_file(self, file_no: int) -> list:
+        log_path = self._path(file_no, 'log')
+        log_size = os.path.getsize(log_path)
+        entries, idx_end = self._read_index(file_no)
+        # Index entries are only written for fsynced records, but the log
+        # may have been truncated underneath them (e.g. restored backup)
+        while entries and entries[-1][0] + RECORD_PREFIX.size + entries[-1][1] + entries[-1][2] > log_size:
+            entries.pop()
+            idx_end = None
+
+        offset = 0
+        if entries:
+            last = entries[-1]
+            offset = last[0] + RECORD_PREFIX.size + last[1] + last[2]
+        tail = list(self._scan(log_path, offset, log_size))
+        if tail or idx_end is None:
+            self._rewrite_index(file_no, entries + tail)
+        if tail:
+            offset = tail[-1][0] + RECORD_PREFIX.size + tail[-1][1] + tail[-1][2]
+        if offset < log_size:
+            self.stats['truncated_bytes'] += log_size - offset
+            with open(log_path, 'r+b') as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+        return entries + tail
+
+    def _read_index(self, file_no: int):
+        """Index entries plus the byte length of the intact prefix (None if rewritten)"""
+        idx_path = self._path(file_no, 'idx')
+        if not os.path.exists(idx_path):
+            return [], None
+        entries = []
+        with open(idx_path, 'rb') as f:
+            unpacker = msgpack.Unpacker(f, raw=False, use_list=False)
+            good = 0
+            try:
+                for entry in unpacker:
+                    entries.append(entry)
+                    good = unpacker.tell()
+            except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError):
+                pass
+            intact = good == os.fstat(f.fileno()).st_size
+        return entries, good if intact else None
+
+    def _scan(self, log_path: str, offset: int, size: int):
+        """Validate records in [offset, size); stop at the first torn or corrupt one"""
+        with open(log_path, 'rb') as f:
+            f.seek(offset)
+            while offset + RECORD_PREFIX.size <= size:
+                magic, header_len, payload_len, crc = RECORD_PREFIX.unpack(f.read(RECORD_PREFIX.size))
+                end = offset + RECORD_PREFIX.size + header_len + payload_len
+                if magic != RECORD_MAGIC or end > size:
+                    return
+                body = f.read(header_len + payload_len)
+                if zlib.crc32(body) != crc:
+                    return
+                yield offset, header_len, payload_len, msgpack.unpackb(body[:header_len], raw=False, use_list=False)
+                offset = end
+
+    def _rewrite_index(self, file_no: int, entries: list) -> None:
+        tmp = self._path(file_no, 'idx.tmp')
+        with open(tmp, 'wb') as f:
+            for entry in entries:
+                f.write(msgpack.packb(entry, use_bin_type=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(file_no, 'idx'))
+
+    # --- writing ------------------------------------------------------------
+
+    def _open_active(self) -> None:
+        numbers = self.file_numbers()
+        self._file_no = numbers[-1] if numbers else 0
+        self._log = open(self._path(self._file_no, 'log'), 'ab')
+        self._idx = open(self._path(self._file_no, 'idx'), 'ab')
+        self._syncer = threading.Thread(target=self._sync_loop, daemon=True)
+        self._syncer.start()
+
+    def append(self, segment, header: tuple) -> None:
+        """Append a segment; it becomes durable at the next group sync"""
+        payload = segment.payload
+        packed_header = msgpack.packb(header, use_bin_type=True)
+        with self.lock:
+            if self._stop.is_set():
+                raise ValueError(f"SegmentLog {self.directory} is closed")
+            if self._log is None:
+                self._open_active()
+            if self._log.tell() >= self.max_file_size:
+                self._rotate()
+            offset = self._log.tell()
+            crc = zlib.crc32(payload, zlib.crc32(packed_header))
+            self._log.write(RECORD_PREFIX.pack(RECORD_MAGIC, len(packed_header), len(payload), crc))
+            self._log.write(packed_header)
+            self._log.write(payload)
+            self._file_max[self._file_no] = max(self._file_max.get(self._file_no, 0), header[1])
+            self._unsynced.append((segment, self._file_no, offset, len(packed_header), len(payload), header))
+            self.stats['appended'] += 1
+            if len(self._unsynced) >= self.sync_every:
+                self._sync()
+
+    def sync(self) -> None:
+        """Force pending segments to disk"""
+        with self.lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        if not self._unsynced:
+            return
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        for segment, file_no, offset, header_len, payload_len, header in self._unsynced:
+            self._idx.write(msgpack.packb((offset, header_len, payload_len, header), use_bin_type=True))
+        # The index can always be rebuilt from the log, so it is not fsynced
+        self._idx.flush()
+        self._durable.extend((segment, file_no, offset + RECORD_PREFIX.size + header_len, payload_len)
+                             for segment, file_no, offset, header_len, payload_len, header in self._unsynced)
+        self._unsynced = []
+        self.stats['syncs'] += 1
+        self._swap_payloads()
+
+    def _swap_payloads(self, force: bool = False) -> None:
+        """Point durable payloads into the file's map, remapping at most once"""
+        if not self._durable:
+            return
+        mapped = self._maps.get(self._file_no)
+        if not force and self._log.tell() - (len(mapped) if mapped is not None else 0) < self.remap_bytes:
+            return
+        for segment, file_no, offset, length in self._durable:
+            segment.payload = self.view(file_no, offset, length)
+        self._durable = []
+
+    def _sync_loop(self) -> None:
+        while not self._stop.wait(self.sync_interval):
+            with self.lock:
+                if self._log is not None:
+                    self._sync()
+
+    def _rotate(self) -> None:
+        self._sync()
+        self._swap_payloads(force=True)
+        self._log.close()
+        self._idx.close()
+        self._file_no += 1
+        self._log = open(self._path(self._file_no, 'log'), 'ab')
+        self._idx = open(self._path(self._file_no, 'idx'), 'ab')
+
+    def close(self) -> None:
+        """Sync and close; later appends raise ValueError"""
+        self._stop.set()
+        with self.lock:
+            if self._log is not None:
+                self._sync()
+                self._swap_payloads(force=True)
+                self._log.close()
+                self._idx.close()
+                self._log = self._idx = None
+
+    def drop_before(self, cutoff_ns: int) -> int:
+        """Forget segments whose newest span starts before cutoff_ns
+
+        Whole files older than the cutoff are deleted; segments in files
+        that also hold newer data are skipped by later recoveries.
+        Returns the number of files deleted.
+        """
+        marker = os.path.join(self.directory, 'purged_before')
+        with open(marker + '.tmp', 'w') as f:
+            f.write(str(cutoff_ns))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(marker + '.tmp', marker)
+        deleted = 0
+        with self.lock:
+            self.purged_before_ns = max(self.purged_before_ns, cutoff_ns)
+            for file_no, newest in list(self._file_max.items()):
+                if file_no == self._file_no or newest >= cutoff_ns:
+                    continue
+                for ext in ('log', 'idx'):
+                    path = self._path(file_no, ext)
+                    if os.path.exists(path):
+                        os.remove(path)
+                # Live views keep the old mapping valid until they are dropped
+                self._maps.pop(file_no, None)
+                del self._file_max[file_no]
+                deleted += 1
+        return deleted
+
+    def _read_purge_marker(self) -> int:
+        try:
+            with open(os.path.join(self.directory, 'purged_before')) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # --- reading ------------------------------------------------------------
+
+    def view(self, file_no: int, offset: int, length: int) -> memoryview:
+        """Zero-copy view of bytes in a log file
+
+        The active file grows, so its map is replaced when a read passes
+        its end. Older maps stay alive as long as views into them do.
+        """
+        mapped = self._maps.get(file_no)
+        if mapped is None or len(mapped) < offset + length:
+            with open(self._path(file_no, 'log'), 'rb') as f:
+                mapped = self._maps[file_no] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)[offset:offset + length]
+
+    # --- zstd dictionaries --------------------------------------------------
+
+    def save_dictionary(self, dict_id: int, data: bytes) -> None:
+        """Persist a compression dictionary once, before segments using it"""
+        path = os.path.join(self.directory, f'dict-{dict_id}.zdict')
+        if os.path.exists(path):
+            return
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def dictionaries(self) -> list:
+        """Raw bytes of every saved dictionary"""
+        result = []
+        for name in os.listdir(self.directory):
+            if name.startswith('dict-') and name.endswith('.zdict'):
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    result.append(f.read())
+        return result
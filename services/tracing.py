@@ -1,68 +1,178 @@
 import uuid
-from datetime import datetime
+import random
+import asyncio
+import contextvars
 from collections import Counter
-import psutil
-import threading
+from services.resource_sampler import resource_sampler
+from services.compact_span import CompactSpan, now_ns, ns_to_datetime, decode_id
+from services.critical_path import critical_path
+from services.tracing_collector import tracing_collector
+
+# Active spans of the current request, innermost last. Held as an immutable
+# tuple so asyncio tasks and copied contexts never share mutations.
+_span_stack = contextvars.ContextVar('span_stack', default=())
+
+class Span(dict):
+    """Span record that closes itself when used as a context manager"""
+
+    sampled = True
+    end_ns = None
+
+    def __init__(self, tracer, start_ns=None, **fields):
+        super().__init__(**fields)
+        self.tracer = tracer
+        self.start_ns = start_ns
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and self.sampled:
+            self['tags'].setdefault('error', str(exc))
+            self['tags'].setdefault('error_type', exc_type.__name__)
+        self.tracer.end_span(self)
+        return False
+
+class _UnsampledSpan(Span):
+    """Placeholder pushed for spans dropped by head sampling"""
+
+    sampled = False
+
+    def __init__(self, tracer):
+        super().__init__(tracer, trace_id=None, span_id=None, parent_id=None,
+                         name=None, start_time=None, tags={})
 
 class TraceContext:
-    """Manages distributed tracing context across services"""
+    """Manages distributed tracing context across services
+
+    The span stack lives in a context variable, so concurrent requests on
+    the event loop each see their own spans and nested spans pick up the
+    enclosing span as parent across `await`. Use `wrap`/`run_in_executor`
+    to carry the context into threads and executor calls. Finished sampled
+    spans are handed to `collector` (a TracingCollector), if given.
+    """
     
-    def __init__(self):
-        self.current_span = None
+    def __init__(self, sample_rate: float = 1.0, collector=None):
+        self.sample_rate = sample_rate
+        self.collector = collector
+        self._unsampled = _UnsampledSpan(self)
+
+    @property
+    def current_span(self) -> dict:
+        """Innermost active span of the current context"""
+        stack = _span_stack.get()
+        return stack[-1] if stack else None
         
-    def start_span(self, name: str, parent_id: str = None) -> dict:
+    def start_span(self, name: str, parent_id: str = None, remote_parent: bool = False) -> dict:
         """Initialize new tracing span
         Args:
             name: Operation name
-            parent_id: Parent span identifier
+            parent_id: Parent span identifier ("trace_id:span_id"); defaults
+                to the current span of this context
+            remote_parent: parent_id came from an upstream service, so this
+                span is the local root of the trace (tagged 'local_root')
         Returns:
             dict: Span context with trace/span IDs
         """
-        span_id = str(uuid.uuid4())
-        self.current_span = {
-            'trace_id': parent_id.split(':')[0] if parent_id else str(uuid.uuid4()),
-            'span_id': span_id,
-            'parent_id': parent_id,
-            'name': name,
-            'start_time': datetime.now(),
-            'tags': {}
-        }
-        return self.current_span
+        stack = _span_stack.get()
+        if parent_id is None and stack:
+            parent = stack[-1]
+            if not parent.sampled:
+                # Whole trace was dropped: skip ID generation and timing
+                _span_stack.set(stack + (parent,))
+                return parent
+            parent_id = f"{parent['trace_id']}:{parent['span_id']}"
+        elif parent_id is None and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            _span_stack.set(stack + (self._unsampled,))
+            return self._unsampled
+
+        start_ns = now_ns()
+        span = Span(
+            self,
+            start_ns=start_ns,
+            trace_id=parent_id.split(':')[0] if parent_id else str(uuid.uuid4()),
+            span_id=str(uuid.uuid4()),
+            parent_id=parent_id,
+            name=name,
+            start_time=ns_to_datetime(start_ns),
+            tags={}
+        )
+        if remote_parent:
+            span['local_root'] = True
+        _span_stack.set(stack + (span,))
+        return span
     
     def add_tag(self, key: str, value: str) -> None:
         """Attach metadata to current span"""
-        if self.current_span:
-            self.current_span['tags'][key] = value
+        stack = _span_stack.get()
+        if stack and stack[-1].sampled:
+            stack[-1]['tags'][key] = value
             
-    def end_span(self) -> dict:
-        """Finalize current span"""
-        if self.current_span:
-            self.current_span['end_time'] = datetime.now()
-            self.current_span['duration'] = (
-                self.current_span['end_time'] - self.current_span['start_time']
-            ).total_seconds()
-            return self.current_span
-        return None 
+    def end_span(self, span: dict = None) -> dict:
+        """Finalize current span (or `span`) and pop it off the stack"""
+        stack = _span_stack.get()
+        if not stack:
+            return None
+        if span is None:
+            span = stack[-1]
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth] is span:
+                _span_stack.set(stack[:depth])
+                break
+        if not span.sampled:
+            return None
+        span.end_ns = now_ns()
+        span['end_time'] = ns_to_datetime(span.end_ns)
+        span['duration'] = (span.end_ns - span.start_ns) / 1e9
+        if self.collector is not None:
+            self.collector.log_span(span)
+        return span
+
+    def wrap(self, fn):
+        """Bind `fn` to the caller's tracing context for use in another thread"""
+        context = contextvars.copy_context()
+
+        def run(*args, **kwargs):
+            return context.copy().run(fn, *args, **kwargs)
+        return run
+
+    def run_in_executor(self, executor, fn, *args):
+        """loop.run_in_executor that keeps the current span as parent"""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(executor, self.wrap(fn), *args)
 
     def add_performance_metrics(self):
-        """记录资源使用指标"""
-        if self.current_span:
-            self.current_span['metrics'] = {
-                'memory_usage': psutil.virtual_memory().percent,
-                'cpu_usage': psutil.cpu_percent(),
-                'thread_count': threading.active_count(),
-                'open_files': len(psutil.Process().open_files())
-            }
+        """记录资源使用指标 (latest background snapshot, shared by reference)"""
+        span = self.current_span
+        if span is not None and span.sampled:
+            span['metrics'] = resource_sampler.latest()
+
+tracer = TraceContext(collector=tracing_collector)
+
+def flatten_trace(trace: dict) -> list:
+    """All span dicts of a get_trace_tree() result, parents before children"""
+    spans, stack = [], [trace] if trace else []
+    while stack:
+        span = stack.pop()
+        spans.append(span)
+        stack.extend(reversed(span.get('children', ())))
+    return spans
 
 def analyze_trace_performance(trace: dict) -> dict:
-    """Identify performance bottlenecks in trace"""
-    slowest_span = max(trace['children'], key=lambda x: x['duration'])
+    """Identify performance bottlenecks in trace via its critical path"""
+    spans = flatten_trace(trace)
+    path = critical_path([CompactSpan.from_dict(span) for span in spans])
+    bottleneck, bottleneck_ns = max(path, key=lambda item: item[1]) if path else (None, 0)
     return {
         "total_duration": trace['duration'],
-        "slowest_operation": slowest_span['name'],
-        "slowest_duration": slowest_span['duration'],
+        "slowest_operation": bottleneck.name if bottleneck else None,
+        "slowest_duration": bottleneck_ns / 1e9,
+        "critical_path": [
+            {"name": span.name, "span_id": decode_id(span.span_id), "self_time": ns / 1e9}
+            for span, ns in path
+        ],
         "service_breakdown": Counter(
             span['tags'].get('service', 'unknown') 
-            for span in flatten_trace(trace)
+            for span in spans
         )
-    } 
\ No newline at end of file
+    }
\ No newline at end of file
@@ -1,30 +1,302 @@
-import boto3
-import zlib
+import os
+import json
+import struct
+import logging
+import threading
 import msgpack
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+try:
+    import boto3
+except ImportError:  # Only needed for S3ArchiveStore
+    boto3 = None
+
+from services.compact_span import datetime_to_ns, ns_to_datetime, encode_id
+from services.tracing_storage import Segment
+
+logger = logging.getLogger(__name__)
+
+class LocalArchiveStore:
+    """Archive objects as files under a root directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key: str, start: int = None, end: int = None) -> bytes:
+        try:
+            with open(self._path(key), 'rb') as f:
+                f.seek(start or 0)
+                return f.read() if end is None else f.read(end - (start or 0))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class S3ArchiveStore:
+    """Archive objects in an S3 bucket, encrypted with KMS
+
+    `client` may be any object with boto3's put_object/get_object/
+    delete_object signatures.
+    """
+
+    def __init__(self, bucket: str = 'tracing-archive', kms_key_id: str = None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("S3ArchiveStore requires the 'boto3' package")
+            client = boto3.client('s3')
+        self.s3 = client
+        self.bucket = bucket
+        self.kms_key_id = kms_key_id
+
+    def put(self, key: str, data: bytes) -> None:
+        kwargs = {'ServerSideEncryption': 'aws:kms'}
+        if self.kms_key_id:
+            kwargs['SSEKMSKeyId'] = self.kms_key_id
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=data, **kwargs)
+
+    def get(self, key: str, start: int = None, end: int = None) -> bytes:
+        kwargs = {}
+        if start is not None or end is not None:
+            kwargs['Range'] = f"bytes={start or 0}-{'' if end is None else end - 1}"
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key, **kwargs)
+        except self.s3.exceptions.NoSuchKey:
+            raise KeyError(key)
+        return response['Body'].read()
+
+    def delete(self, key: str) -> None:
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+# Chunk layout: u32 index length, msgpack [(offset, length, header), ...],
+# then the segment payloads. Offsets are relative to the first payload.
+CHUNK_PREFIX = struct.Struct('>I')
+
 class TraceArchiver:
-    """追踪数据归档系统"""
-    
-    def __init__(self, s3_bucket='tracing-archive'):
-        self.s3 = boto3.client('s3')
-        self.bucket = s3_bucket
-        
-    def archive_old_traces(self, days: int = 30):
-        """添加加密归档"""
+    """追踪数据归档系统
+
+    Moves compressed segments older than the cutoff from TraceCompressor
+    into object storage. Segments are archived as stored (already
+    compressed, and encrypted for SecureTraceCompressor), grouped into
+    chunks of at most `chunk_size` bytes per hourly partition:
+
+        traces/2024-05-01/13/<first start_ns>-<n>.chunk
+
+    At most `max_pending_uploads` chunks are buffered while
+    `upload_workers` threads upload them. A JSON manifest records each
+    chunk's key, time range and span count, so retrieval fetches only the
+    chunks overlapping the requested range, and from those only the
+    segments whose headers match. The manifest is loaded on first use.
+
+    A store is any object with put(key, data), delete(key) and
+    get(key, start=None, end=None) returning bytes [start, end) and
+    raising KeyError for a missing key. Keys are '/'-separated paths.
+    """
+
+    MANIFEST_KEY = 'traces/manifest.json'
+
+    def __init__(self, store=None, compressor=None,
+                 chunk_size: int = 8 * 1024 * 1024, upload_workers: int = 4,
+                 max_pending_uploads: int = 8, archive_frequency: int = 1):
+        """Args:
+            store: Destination (LocalArchiveStore, S3ArchiveStore, ...);
+                defaults to S3ArchiveStore()
+            compressor: TraceCompressor whose segments are archived and decoded
+            chunk_size: Upload object size target in bytes
+            upload_workers: Concurrent uploads
+            max_pending_uploads: Chunks buffered in memory at once
+            archive_frequency: Days between archive runs (tuned by AdaptivePolicyEngine)
+        """
+        self.store = store if store is not None else S3ArchiveStore()
+        self.compressor = compressor
+        self.chunk_size = chunk_size
+        self.upload_workers = upload_workers
+        self.max_pending_uploads = max_pending_uploads
+        self.archive_frequency = archive_frequency
+        self.lock = threading.Lock()
+        self._manifest = None
+        self._manifest_lock = threading.Lock()
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            with self._manifest_lock:
+                if self._manifest is None:
+                    self._manifest = self._load_manifest()
+        return self._manifest
+
+    def _load_manifest(self) -> dict:
+        try:
+            return json.loads(self.store.get(self.MANIFEST_KEY))
+        except KeyError:
+            return {'version': 1, 'chunks': []}
+
+    def _save_manifest(self) -> None:
+        self.manifest['chunks'].sort(key=lambda c: c['min_start_ns'])
+        self.store.put(self.MANIFEST_KEY, json.dumps(self.manifest).encode())
+
+    def get_archived_size(self) -> int:
+        """Total archived bytes"""
+        return sum(chunk['size'] for chunk in self.manifest['chunks'])
+
+    def archive_old_traces(self, days: int = 30) -> dict:
+        """Archive segments older than `days` and purge them locally
+
+        A chunk whose upload fails is logged and counted; its segments
+        stay in the compressor for the next run, while the chunks that
+        did upload are still recorded in the manifest and purged.
+
+        Returns:
+            dict: Chunks, segments and bytes uploaded, and failed chunks
+        """
         cutoff = datetime.now() - timedelta(days=days)
-        traces = trace_compressor.retrieve_traces(hours=24*days)
-        to_archive = [t for t in traces if t['start_time'] < cutoff]
-        
-        if to_archive:
-            key = f"encrypted-traces-{datetime.now().date()}.bin"
-            data = encrypt_data(zlib.compress(msgpack.packb(to_archive)))  # 使用KMS加密
-            self.s3.put_object(
-                Bucket=self.bucket,
-                Body=data,
-                SSE='aws:kms',
-                Metadata={'encryption-key': key_id}
-            )
-            
-            # 从本地存储移除已归档数据
-            trace_compressor.purge_before(cutoff) 
\ No newline at end of file
+        cutoff_ns = datetime_to_ns(cutoff)
+        self.compressor.flush()
+        segments = [s for s in list(self.compressor.compressed_data) if s.max_start_ns < cutoff_ns]
+        segments.sort(key=lambda s: s.min_start_ns)
+
+        uploaded = []
+        slots = threading.BoundedSemaphore(self.max_pending_uploads)
+        with ThreadPoolExecutor(self.upload_workers, thread_name_prefix='trace-archive') as pool:
+            futures = []
+            for partition, chunk in self._chunks(segments):
+                slots.acquire()  # Bound buffered chunk bytes
+                future = pool.submit(self._upload_chunk, partition, chunk)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append((future, chunk))
+            archived, failed = [], 0
+            for future, chunk in futures:
+                try:
+                    uploaded.append(future.result())
+                except Exception:
+                    logger.exception("Uploading an archive chunk of %d segments failed", len(chunk))
+                    failed += 1
+                    continue
+                archived.extend(chunk)
+
+        if uploaded:
+            with self.lock:
+                self.manifest['chunks'].extend(uploaded)
+                self._save_manifest()
+            # 从本地存储移除已归档数据: exactly the uploaded segments, not
+            # ones that failed or reached the compressor after the list was built
+            self.compressor.purge_segments(archived)
+        return {
+            'chunks': len(uploaded),
+            'segments': sum(c['segments'] for c in uploaded),
+            'bytes': sum(c['size'] for c in uploaded),
+            'failed_chunks': failed
+        }
+
+    def _chunks(self, segments: list):
+        """Yield (partition, [segments]) capped at chunk_size per hour"""
+        partition, chunk, size = None, [], 0
+        for segment in segments:
+            hour = ns_to_datetime(segment.min_start_ns).strftime('%Y-%m-%d/%H')
+            if chunk and (hour != partition or size + len(segment) > self.chunk_size):
+                yield partition, chunk
+                chunk, size = [], 0
+            partition = hour
+            chunk.append(segment)
+            size += len(segment)
+        if chunk:
+            yield partition, chunk
+
+    def _upload_chunk(self, partition: str, segments: list) -> dict:
+        entries, offset = [], 0
+        for segment in segments:
+            entries.append((offset, len(segment), segment.header()))
+            offset += len(segment)
+        index = msgpack.packb(entries, use_bin_type=True)
+        data = b''.join([CHUNK_PREFIX.pack(len(index)), index] + [bytes(s.payload) for s in segments])
+        key = f"traces/{partition}/{segments[0].min_start_ns}-{len(segments)}.chunk"
+        self.store.put(key, data)
+        return {
+            'key': key,
+            'partition': partition,
+            'min_start_ns': min(s.min_start_ns for s in segments),
+            'max_start_ns': max(s.max_start_ns for s in segments),
+            'span_count': sum(s.span_count for s in segments),
+            'segments': len(segments),
+            'index_size': len(index),
+            'size': len(data)
+        }
+
+    def chunks_for(self, start_ns: int = None, end_ns: int = None) -> list:
+        """Manifest entries overlapping [start_ns, end_ns]"""
+        return [c for c in self.manifest['chunks']
+                if (start_ns is None or c['max_start_ns'] >= start_ns) and
+                   (end_ns is None or c['min_start_ns'] <= end_ns)]
+
+    def chunk_segments(self, chunk: dict, start_ns: int = None, end_ns: int = None,
+                       trace_key=None) -> list:
+        """Matching segments of one chunk, newest first, without payloads
+
+        Only the chunk's index is downloaded. Returns (segment, load)
+        pairs; load() range-reads the payload and returns the segment.
+        """
+        base = CHUNK_PREFIX.size + chunk['index_size']
+        head = self.store.get(chunk['key'], 0, base)
+        entries = msgpack.unpackb(head[CHUNK_PREFIX.size:], raw=False, use_list=False)
+        result = []
+        for offset, length, header in reversed(entries):
+            segment = Segment.from_header(header, None)
+            if (not segment.overlaps(start_ns, end_ns) or
+                    (trace_key is not None and not segment.may_contain(trace_key))):
+                continue
+            result.append((segment, self._loader(chunk['key'], segment, base + offset, length)))
+        return result
+
+    def _loader(self, key: str, segment: Segment, offset: int, length: int):
+        def load():
+            segment.payload = self.store.get(key, offset, offset + length)
+            return segment
+        return load
+
+    def iter_segments(self, start_ns: int = None, end_ns: int = None, trace_key=None):
+        """Yield archived Segments matching the range, newest chunk first"""
+        for chunk in reversed(self.chunks_for(start_ns, end_ns)):
+            for segment, load in self.chunk_segments(chunk, start_ns, end_ns, trace_key):
+                yield load()
+
+    def retrieve(self, start: datetime = None, end: datetime = None, trace_id: str = None) -> list:
+        """Archived span dicts in [start, end], newest first"""
+        start_ns = datetime_to_ns(start) if start else None
+        end_ns = datetime_to_ns(end) if end else None
+        trace_key = encode_id(trace_id) if trace_id is not None else None
+        results = []
+        for segment in self.iter_segments(start_ns, end_ns, trace_key):
+            for span in self.compressor._decode_or_skip(segment):
+                if ((start_ns is None or span.start_ns >= start_ns) and
+                        (end_ns is None or span.start_ns <= end_ns) and
+                        (trace_key is None or span.trace_id == trace_key)):
+                    results.append(span)
+        results.sort(key=lambda s: s.start_ns, reverse=True)
+        return [span.to_dict() for span in results]
+
+    def purge_before(self, cutoff: datetime) -> int:
+        """Delete archived chunks whose spans all started before cutoff"""
+        cutoff_ns = datetime_to_ns(cutoff)
+        with self.lock:
+            expired = [c for c in self.manifest['chunks'] if c['max_start_ns'] < cutoff_ns]
+            if not expired:
+                return 0
+            self.manifest['chunks'] = [c for c in self.manifest['chunks'] if c['max_start_ns'] >= cutoff_ns]
+            self._save_manifest()
+        for chunk in expired:
+            self.store.delete(chunk['key'])
+        return len(expired)
@@ -1,59 +1,180 @@
+import time
+import logging
 import threading
-import random
 from collections import defaultdict
+from itertools import islice
+from services.compact_span import CompactSpan
+from services.span_store import SpanStore
+from services.trace_sampler import TailSampler
+from services.red_metrics import RedMetrics, red_metrics
+
+logger = logging.getLogger(__name__)
 
 class TracingCollector:
-    """Collects and stores tracing spans for analysis"""
+    """Collects and stores tracing spans for analysis
+
+    Writers append to a buffer, and the store lock is taken once per
+    batch. The buffer flushes in order when it reaches `batch_size`, when
+    a write finds it older than `flush_interval`, and from a background
+    thread every `flush_interval`, so spans of an idle service still reach
+    metrics, observers and the store. Reads flush first.
+    """
     
-    def __init__(self):
-        self.spans = []
+    def __init__(self, capacity: int = 1000000, on_evict=None,
+                 batch_size: int = 256, flush_interval: float = 0.5, sampler: TailSampler = None,
+                 metrics: RedMetrics = None, exporter=None, observers: list = None):
+        """Args:
+            capacity: Spans retained in memory before the oldest are evicted
+            on_evict: Called with each evicted CompactSpan (e.g. the
+                compressed storage tier)
+            batch_size: Buffered spans that trigger a flush
+            flush_interval: Max seconds a span waits in the buffer
+            sampler: Tail sampler deciding which traces are stored
+                (default: store every span)
+            metrics: RED aggregator fed every span before sampling
+            exporter: SpanExporter receiving every stored span
+            observers: Callables fed each flushed batch before sampling,
+                like `metrics` (e.g. FeatureGuard.observe)
+        """
+        self.spans = SpanStore(capacity)
+        self.on_evict = on_evict
         self.lock = threading.Lock()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sampler = sampler
+        self.metrics = metrics
+        self.exporter = exporter
+        self.observers = list(observers or ())
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the background flush thread (log_span does on first use)"""
+        with self._flusher_lock:
+            if self._flusher is not None:
+                return
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._run, name='span-flusher', daemon=True)
+            self._flusher.start()
+
+    def stop(self) -> None:
+        """Stop the flush thread and flush what is buffered"""
+        with self._flusher_lock:
+            thread, self._flusher = self._flusher, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush(max_age=self.flush_interval)
+            except Exception:
+                logger.exception("Flushing buffered spans failed")
         
     def log_span(self, span: dict) -> None:
-        """Store span data with thread safety"""
+        """Buffer span data"""
+        if self._flusher is None:
+            self.start()
+        compact = CompactSpan.from_dict(span)
+        batch = None
+        with self._buffer_lock:
+            self._buffer.append(compact)
+            if (len(self._buffer) >= self.batch_size or
+                    time.monotonic() - self._flushed_at >= self.flush_interval):
+                batch = self._flush_buffer()
+        if batch:
+            self._notify(batch)
+
+    def flush(self, max_age: float = None) -> None:
+        """Move buffered spans into the store
+        Args:
+            max_age: Only flush if buffered spans may be older than this
+                many seconds
+        """
+        if max_age is None or (self._buffer and time.monotonic() - self._flushed_at >= max_age):
+            with self._buffer_lock:
+                batch = self._flush_buffer()
+            if batch:
+                self._notify(batch)
+        if self.sampler:
+            self._store(self.sampler.expire())
+
+    def _flush_buffer(self) -> list:
+        """Caller holds _buffer_lock, so batches land in order
+
+        Returns the flushed batch (before sampling) for _notify, which
+        the caller runs after releasing the lock.
+        """
+        batch, self._buffer = self._buffer, []
+        self._flushed_at = time.monotonic()
+        if batch and self.metrics:
+            self.metrics.observe(batch)
+        stored = self.sampler.offer(batch) if batch and self.sampler else batch
+        self._store(stored)
+        return batch
+
+    def _notify(self, batch: list) -> None:
+        """Feed observers outside the buffer lock, so their own locks never block writers"""
+        for observe in self.observers:
+            observe(batch)
+
+    def _store(self, batch: list) -> None:
+        if not batch:
+            return
+        append = self.spans.append
         with self.lock:
-            self.spans.append(span)
+            evicted = [old for old in map(append, batch) if old is not None]
+        if self.exporter:
+            self.exporter.export(batch)  # Only enqueues; never waits on a sink
+        if evicted and self.on_evict:
+            for old in evicted:
+                self.on_evict(old)
             
-    def query_traces(self, filters: dict = None) -> list:
-        """Query stored traces with filters"""
-        filtered = self.spans
-        if filters:
-            if 'service' in filters:
-                filtered = [s for s in filtered if s['tags'].get('service') == filters['service']]
-            if 'min_duration' in filters:
-                filtered = [s for s in filtered if s['duration'] >= filters['min_duration']]
-        return filtered
+    def query_traces(self, filters: dict = None, limit: int = None) -> list:
+        """Query stored traces with filters
+        Args:
+            filters: trace_id, service, model_version, endpoint, min_duration
+            limit: Return only the newest `limit` matches
+        Returns:
+            list: Matching span dicts, oldest first
+        """
+        self.flush()
+        matches = islice(self.spans.query(filters), limit)
+        return [s.to_dict() for s in matches][::-1]
     
     def get_trace_tree(self, trace_id: str) -> dict:
         """Reconstruct full trace hierarchy"""
-        spans = [s for s in self.spans if s['trace_id'] == trace_id]
-        return self._build_tree(spans)
+        self.flush()
+        return self._build_tree(self.spans.trace_spans(trace_id))
     
     def _build_tree(self, spans: list) -> dict:
-        """Build hierarchical trace structure"""
-        root = next((s for s in spans if not s['parent_id']), None)
-        if not root:
+        """Build hierarchical trace structure in O(spans) via a parent->children map"""
+        children = defaultdict(list)
+        span_ids = {s.span_id for s in spans}
+        root = None
+        for span in spans:
+            parent = span.parent_key()
+            if parent in span_ids:
+                children[parent].append(span)
+            elif root is None or parent is None:
+                root = span
+        if root is None:
             return {}
             
-        def build_children(parent_id):
-            return [{
-                **span,
-                'children': build_children(f"{span['trace_id']}:{span['span_id']}")
-            } for span in spans if span.get('parent_id') == parent_id]
+        def build(span):
+            return {
+                **span.to_dict(),
+                'children': [build(child) for child in children.get(span.span_id, ())]
+            }
             
-        return {**root, 'children': build_children(f"{root['trace_id']}:{root['span_id']}")}
+        return build(root)
     
-    def should_sample(self, span: dict) -> bool:
-        """Determine if span should be stored based on sampling rules"""
-        # Sample all errors
-        if 'error' in span['tags']:
-            return True
-        # Sample 10% of slow requests
-        if span['duration'] > 1.0 and random.random() < 0.1:
-            return True
-        # Default sample rate
-        return random.random() < 0.01 
-
     def enrich_with_logs(self, trace_id: str):
         """关联追踪数据与系统日志"""
         trace = self.get_trace_tree(trace_id)
@@ -74,4 +195,6 @@ class TracingCollector:
         span_logs = defaultdict(list)
         for log in logs:
             span_logs[log['span_id']].append(log)
-        return span_logs 
\ No newline at end of file
+        return span_logs
+
+tracing_collector = TracingCollector(sampler=TailSampler(), metrics=red_metrics)
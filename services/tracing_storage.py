@@ -1,106 +1,424 @@
+import time
 import zlib
+import logging
+import threading
 import msgpack
+from concurrent.futures import ThreadPoolExecutor
 from collections import deque
 from datetime import datetime, timedelta
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 import hmac
 import hashlib
+from services.compact_span import CompactSpan, datetime_to_ns, encode_id
+from services.bloom_filter import BloomFilter
+from services.trace_codecs import make_codec, dictionary_registry, zstandard, MissingDictionaryError
+from services.trace_wal import SegmentLog
+
+logger = logging.getLogger(__name__)
+
+class Segment:
+    """Compressed batch of spans plus a small plaintext header
+
+    The header (start_time range, span count, Bloom filter of trace IDs)
+    lets lookups skip segments without decompressing them; `codec` and
+    `dict_id` record how the payload was compressed.
+    """
+
+    __slots__ = ('min_start_ns', 'max_start_ns', 'span_count', 'bloom', 'payload',
+                 'codec', 'dict_id')
+
+    def __init__(self, min_start_ns: int, max_start_ns: int, span_count: int,
+                 bloom: BloomFilter, payload: bytes, codec: str = 'zlib-6', dict_id: int = None):
+        self.min_start_ns = min_start_ns
+        self.max_start_ns = max_start_ns
+        self.span_count = span_count
+        self.bloom = bloom
+        self.payload = payload
+        self.codec = codec
+        self.dict_id = dict_id
+
+    @classmethod
+    def for_batch(cls, batch: list, payload: bytes, codec: str = 'zlib-6',
+                  dict_id: int = None) -> 'Segment':
+        bloom = BloomFilter.for_capacity(len(batch))
+        for span in batch:
+            bloom.add(span.trace_id)
+        starts = [span.start_ns for span in batch]
+        return cls(min(starts), max(starts), len(batch), bloom, payload, codec, dict_id)
+
+    def header(self) -> tuple:
+        """Plaintext header fields, as persisted by the segment log"""
+        return (self.min_start_ns, self.max_start_ns, self.span_count,
+                self.bloom.to_tuple(), self.codec, self.dict_id)
+
+    @classmethod
+    def from_header(cls, header: tuple, payload) -> 'Segment':
+        min_start_ns, max_start_ns, span_count, bloom, codec, dict_id = header
+        return cls(min_start_ns, max_start_ns, span_count, BloomFilter.from_tuple(bloom),
+                   payload, codec, dict_id)
+
+    def overlaps(self, start_ns: int = None, end_ns: int = None) -> bool:
+        return ((start_ns is None or self.max_start_ns >= start_ns) and
+                (end_ns is None or self.min_start_ns <= end_ns))
+
+    def may_contain(self, trace_id) -> bool:
+        return trace_id in self.bloom
+
+    @property
+    def header_size(self) -> int:
+        return len(self.bloom) + 32
+
+    def __len__(self):
+        """Stored payload size in bytes"""
+        return len(self.payload)
+
+class IntegrityError(Exception):
+    """Raised when a segment fails HMAC verification"""
+    pass
+
+# Segments that fail to decode for these reasons are skipped, not fatal:
+# an unknown dictionary, a rotated key, a corrupt payload
+DECODE_ERRORS = (MissingDictionaryError, InvalidToken, zlib.error, msgpack.UnpackException,
+                 ValueError) + ((zstandard.ZstdError,) if zstandard is not None else ())
 
 class TraceCompressor:
-    """追踪数据压缩存储引擎"""
+    """追踪数据压缩存储引擎
+
+    Batches go through ENCODE_STAGES (pack -> compress, extended by the
+    secure subclasses) and back through DECODE_STAGES. With `workers` > 0
+    encoding runs on a thread pool with at most `max_in_flight` segments
+    queued, and retrieval decodes candidate segments in parallel.
+    """
+
+    ENCODE_STAGES = ('pack', 'compress')
+    DECODE_STAGES = ('decompress', 'unpack')
     
-    def __init__(self, max_memory=1000):
+    def __init__(self, max_memory=1000, keep_recent=100, codec='zlib-6',
+                 workers: int = 0, max_in_flight: int = 8, wal_dir: str = None):
+        """Args:
+            max_memory: Max uncompressed spans held in memory
+            keep_recent: Spans left uncompressed after each batch
+            codec: Codec spec ('zlib-6', 'zstd-3', 'zstd-dict-3') or instance
+            workers: Encode/decode threads; 0 runs stages inline
+            max_in_flight: Segments queued for encoding before add_trace blocks
+            wal_dir: Persist segments to a SegmentLog here and recover them on start
+        """
         self.in_memory = deque(maxlen=max_memory)
+        self.keep_recent = keep_recent
+        self.codec = make_codec(codec) if isinstance(codec, str) else codec
+        self._codecs = {self.codec.name: self.codec}
         self.compressed_data = []
+        # Segments examined vs skipped via their headers
+        self.segment_stats = {'scanned': 0, 'skipped': 0, 'integrity_failures': 0, 'decode_failures': 0,
+                              'encode_failures': 0}
+        self.stage_stats = {
+            stage: {'calls': 0, 'bytes': 0, 'seconds': 0.0}
+            for stage in self.ENCODE_STAGES + self.DECODE_STAGES
+        }
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='trace-codec') if workers else None
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._pending = deque()         # (future, batch) in submission order
+        self._retry = []                # Spans of batches whose encoding failed
+        self._pending_lock = threading.Lock()
+        # Evictions and readers run on different threads: _memory_lock guards in_memory,
+        # _compress_lock keeps batches (and so segments) in eviction order
+        self._memory_lock = threading.Lock()
+        self._compress_lock = threading.Lock()
+        self.wal = SegmentLog(wal_dir) if wal_dir else None
+        if self.wal is not None:
+            # Dictionaries this log saved before a restart
+            dictionary_registry.attach(self.wal.directory)
+            self.compressed_data = self.wal.recover(Segment.from_header)
         
-    def add_trace(self, trace: dict) -> None:
+    def add_trace(self, trace) -> None:
         """添加追踪数据并自动压缩"""
-        # 内存中保留最新数据
-        self.in_memory.append(trace)
-        
+        span = CompactSpan.from_dict(trace)
+        # 内存中保留最新数据 (compact form)
+        with self._memory_lock:
+            self.in_memory.append(span)
+            due = len(self.in_memory) % 100 == 0
+
         # 定期压缩旧数据
-        if len(self.in_memory) % 100 == 0:
+        if due:
             self._compress_batch()
+
+    def snapshot(self) -> list:
+        """Uncompressed spans (including batches awaiting an encode retry), oldest first"""
+        with self._pending_lock:
+            retry = list(self._retry)
+        with self._memory_lock:
+            return retry + list(self.in_memory)
             
-    def _compress_batch(self) -> None:
+    def _compress_batch(self, force: bool = False) -> None:
         """批量压缩数据"""
-        batch = list(self.in_memory)[:-100]  # 保留最后100条
-        if not batch:
-            return
-            
-        packed = msgpack.packb(batch, use_bin_type=True)
-        compressed = zlib.compress(packed)
-        self.compressed_data.append(compressed)
-        
-        # 从内存中移除已压缩数据
-        self.in_memory = deque(list(self.in_memory)[-100:], maxlen=1000)
+        keep = 0 if force else self.keep_recent  # 保留最后100条
+        with self._compress_lock:
+            with self._memory_lock:
+                if len(self.in_memory) <= keep:
+                    return
+                # 从内存中移除待压缩数据
+                batch = [self.in_memory.popleft() for _ in range(len(self.in_memory) - keep)]
+
+            with self._pending_lock:
+                if self._retry:
+                    batch, self._retry = self._retry + batch, []
+
+            if self._executor is None:
+                try:
+                    segment = self._encode(batch)
+                except Exception as e:
+                    self._encode_failed(batch, e)
+                    return
+                self._append_segment(segment)
+                return
+            self._in_flight.acquire()  # Backpressure once max_in_flight segments are queued
+            future = self._executor.submit(self._encode, batch)
+            future.add_done_callback(lambda _: self._in_flight.release())
+            with self._pending_lock:
+                self._pending.append((future, batch))
+        self._drain()
+
+    def _encode_failed(self, batch: list, error: Exception) -> None:
+        """Keep a batch whose encoding failed for the next compression"""
+        logger.error("Encoding %d spans failed, retrying with the next batch: %s", len(batch), error)
+        with self._pending_lock:
+            self._retry = self._retry + batch
+        with self._stats_lock:
+            self.segment_stats['encode_failures'] += 1
+
+    def _append_segment(self, segment: Segment) -> None:
+        if self.wal is not None:
+            if segment.dict_id is not None:
+                dictionary = self.codec.dictionary(segment.dict_id)
+                self.wal.save_dictionary(segment.dict_id, dictionary.as_bytes())
+            self.wal.append(segment, segment.header())
+        self.compressed_data.append(segment)
+
+    def _drain(self, wait: bool = False) -> None:
+        """Move finished segments to storage in submission order"""
+        failed = []
+        with self._pending_lock:
+            while self._pending and (wait or self._pending[0][0].done()):
+                future, batch = self._pending.popleft()
+                # A failed encode belongs to its batch, not to whoever drains
+                if future.exception() is not None:
+                    failed.append((batch, future.exception()))
+                    continue
+                self._append_segment(future.result())
+        for batch, error in failed:
+            self._encode_failed(batch, error)
+
+    def flush(self) -> None:
+        """Wait for queued segments to finish encoding"""
+        self._drain(wait=True)
+
+    def close(self) -> None:
+        """Compress everything still in memory and make it durable"""
+        self._compress_batch(force=True)
+        self.flush()
+        if self.wal is not None:
+            self.wal.close()
+
+    def _encode(self, batch: list) -> Segment:
+        segment = Segment.for_batch(batch, None, self.codec.name)
+        data = batch
+        for stage in self.ENCODE_STAGES:
+            data = self._run_stage(stage, data, segment)
+        segment.payload = data
+        return segment
+
+    def _decode(self, segment: Segment) -> list:
+        data = segment.payload
+        for stage in self.DECODE_STAGES:
+            data = self._run_stage(stage, data, segment)
+        return data
+
+    def _run_stage(self, stage: str, data, segment: Segment):
+        start = time.perf_counter()
+        result = getattr(self, f'_{stage}')(data, segment)
+        elapsed = time.perf_counter() - start
+        size = len(data) if isinstance(data, (bytes, bytearray, memoryview)) else len(result)
+        with self._stats_lock:
+            stats = self.stage_stats[stage]
+            stats['calls'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += elapsed
+        return result
+
+    def _pack(self, batch: list, segment: Segment) -> bytes:
+        return msgpack.packb([span.to_tuple() for span in batch], use_bin_type=True)
+
+    def _compress(self, packed: bytes, segment: Segment) -> bytes:
+        compressed, segment.dict_id = self.codec.compress(packed)
+        return compressed
+
+    def _decompress(self, payload: bytes, segment: Segment) -> bytes:
+        return self._codec_for(segment).decompress(payload, segment.dict_id)
+
+    def _unpack(self, packed: bytes, segment: Segment) -> list:
+        return [CompactSpan.from_tuple(t) for t in msgpack.unpackb(packed, raw=False)]
         
-    def retrieve_traces(self, hours: int = 24) -> list:
-        """检索指定时间范围内的追踪数据"""
-        cutoff = datetime.now() - timedelta(hours=hours)
-        results = []
+    def _codec_for(self, segment: Segment):
+        codec = self._codecs.get(segment.codec)
+        if codec is None:
+            codec = self._codecs[segment.codec] = make_codec(segment.codec)
+        return codec
+
+    def _decode_or_skip(self, segment: Segment) -> list:
+        try:
+            return self._decode(segment)
+        except IntegrityError:
+            with self._stats_lock:
+                self.segment_stats['integrity_failures'] += 1
+            return []
+        except DECODE_ERRORS as error:
+            logger.warning("Skipping undecodable trace segment (%d spans): %r", segment.span_count, error)
+            with self._stats_lock:
+                self.segment_stats['decode_failures'] += 1
+            return []
         
+    def retrieve_traces(self, hours: int = 24, start: datetime = None,
+                        end: datetime = None, trace_id: str = None) -> list:
+        """检索指定时间范围内的追踪数据
+        Args:
+            hours: Look back this far when `start` is not given
+            start: Earliest span start_time to return
+            end: Latest span start_time to return
+            trace_id: Return only spans of this trace
+        Returns:
+            list: Matching span dicts, newest first
+        """
+        start_ns = datetime_to_ns(start or datetime.now() - timedelta(hours=hours))
+        end_ns = datetime_to_ns(end) if end else None
+        trace_key = encode_id(trace_id) if trace_id is not None else None
+
+        def matches(trace):
+            return (trace.start_ns >= start_ns and
+                    (end_ns is None or trace.start_ns <= end_ns) and
+                    (trace_key is None or trace.trace_id == trace_key))
+
+        self.flush()
         # 检查内存中的最新数据
-        for trace in reversed(self.in_memory):
-            if trace['start_time'] >= cutoff:
-                results.append(trace)
-            else:
-                break
+        results = [trace for trace in self.snapshot() if matches(trace)]
                 
-        # 解压历史数据
-        for compressed in reversed(self.compressed_data):
-            batch = msgpack.unpackb(zlib.decompress(compressed), 
-                                   raw=False)
-            for trace in reversed(batch):
-                if trace['start_time'] >= cutoff:
-                    results.append(trace)
-                else:
-                    break
-            if batch[0]['start_time'] < cutoff:
-                break
+        # 解压历史数据, skipping segments whose header rules them out
+        # Segments are in eviction order, not start order: check every header
+        segments = list(self.compressed_data)
+        candidates = [
+            segment for segment in segments
+            if segment.overlaps(start_ns, end_ns) and (trace_key is None or segment.may_contain(trace_key))
+        ][::-1]
+        with self._stats_lock:
+            self.segment_stats['scanned'] += len(segments)
+            self.segment_stats['skipped'] += len(segments) - len(candidates)
+
+        decode = self._executor.map if self._executor else map
+        for batch in decode(self._decode_or_skip, candidates):
+            results.extend(trace for trace in batch if matches(trace))
                 
-        return sorted(results, key=lambda x: x['start_time'], reverse=True) 
+        results.sort(key=lambda x: x.start_ns, reverse=True)
+        return [trace.to_dict() for trace in results]
+
+    def purge_before(self, cutoff: datetime) -> int:
+        """Drop compressed segments whose spans all started before cutoff
+
+        Returns:
+            int: Number of segments removed
+        """
+        cutoff_ns = datetime_to_ns(cutoff)
+        self.flush()
+        with self._pending_lock:
+            kept = [s for s in self.compressed_data if s.max_start_ns >= cutoff_ns]
+            removed = len(self.compressed_data) - len(kept)
+            self.compressed_data = kept
+        if self.wal is not None:
+            self.wal.drop_before(cutoff_ns)
+        return removed
+
+    def purge_segments(self, segments: list) -> int:
+        """Drop exactly these compressed segments (e.g. once archived)
+
+        Returns:
+            int: Number of segments removed
+        """
+        self.flush()
+        drop = {id(segment) for segment in segments}
+        with self._pending_lock:
+            kept = [s for s in self.compressed_data if id(s) not in drop]
+            removed = len(self.compressed_data) - len(kept)
+            self.compressed_data = kept
+        if self.wal is not None and segments:
+            # The log forgets by time: stop below the oldest segment still kept
+            cutoff_ns = max(s.max_start_ns for s in segments) + 1
+            cutoff_ns = min([cutoff_ns] + [s.max_start_ns for s in kept])
+            self.wal.drop_before(cutoff_ns)
+        return removed
+
+    def index_stats(self) -> dict:
+        """Segment header footprint and how often headers avoided decompression"""
+        with self._stats_lock:
+            stats = dict(self.segment_stats)
+        scanned = stats['scanned']
+        return {
+            'segments': len(self.compressed_data),
+            'index_size': sum(segment.header_size for segment in self.compressed_data),
+            'skip_ratio': stats['skipped'] / scanned if scanned else 0.0,
+            'integrity_failures': stats['integrity_failures'],
+            'decode_failures': stats['decode_failures']
+        }
+
+    def pipeline_stats(self) -> dict:
+        """Per-stage call count, bytes and MB/s of busy time"""
+        with self._stats_lock:
+            return {
+                stage: {
+                    **stats,
+                    'mb_per_s': stats['bytes'] / stats['seconds'] / 1024**2 if stats['seconds'] else 0.0
+                }
+                for stage, stats in self.stage_stats.items()
+            }
 
 class SecureTraceCompressor(TraceCompressor):
     """支持加密的追踪存储"""
+
+    ENCODE_STAGES = TraceCompressor.ENCODE_STAGES + ('encrypt',)
+    DECODE_STAGES = ('decrypt',) + TraceCompressor.DECODE_STAGES
     
-    def __init__(self, encryption_key: str):
-        super().__init__()
+    def __init__(self, encryption_key: str, workers: int = 4, **kwargs):
+        super().__init__(workers=workers, **kwargs)
         self.cipher = Fernet(encryption_key)
         
-    def _compress_batch(self) -> None:
-        packed = msgpack.packb(batch, use_bin_type=True)
-        compressed = zlib.compress(packed)
-        encrypted = self.cipher.encrypt(compressed)  # 新增加密步骤
-        self.compressed_data.append(encrypted)
-        
-    def retrieve_traces(self, hours: int = 24) -> list:
-        for encrypted in reversed(self.compressed_data):
-            compressed = self.cipher.decrypt(encrypted)  # 解密数据
-            batch = msgpack.unpackb(zlib.decompress(compressed))
-            for trace in reversed(batch):
-                if trace['start_time'] >= cutoff:
-                    results.append(trace)
-                else:
-                    break
-            if batch[0]['start_time'] < cutoff:
-                break
-                
-        return sorted(results, key=lambda x: x['start_time'], reverse=True) 
+    def _encrypt(self, compressed: bytes, segment: Segment) -> bytes:
+        return self.cipher.encrypt(compressed)  # 新增加密步骤
+
+    def _decrypt(self, encrypted: bytes, segment: Segment) -> bytes:
+        return self.cipher.decrypt(bytes(encrypted))  # mmap-backed payloads are memoryviews
 
 class IntegrityCheckedCompressor(SecureTraceCompressor):
-    """添加HMAC完整性校验"""
+    """添加HMAC完整性校验
+
+    The signature covers the whole segment header (time range, count,
+    Bloom filter, codec, dict_id) as well as the encrypted payload, so a
+    tampered header cannot hide a segment from range or trace lookups.
+    """
+
+    ENCODE_STAGES = SecureTraceCompressor.ENCODE_STAGES + ('sign',)
+    DECODE_STAGES = ('verify',) + SecureTraceCompressor.DECODE_STAGES
     
-    def __init__(self, encryption_key: str, hmac_key: str):
-        super().__init__(encryption_key)
+    def __init__(self, encryption_key: str, hmac_key: str, **kwargs):
+        super().__init__(encryption_key, **kwargs)
         self.hmac_key = hmac_key.encode()
         
-    def _compress_batch(self):
-        encrypted = super()._compress_batch()
-        signature = hmac.new(self.hmac_key, encrypted, hashlib.sha256).digest()
-        self.compressed_data.append(signature + encrypted)
+    def _signature(self, encrypted: bytes, segment: Segment) -> bytes:
+        header = msgpack.packb(segment.header(), use_bin_type=True)
+        return hmac.new(self.hmac_key, header + encrypted, hashlib.sha256).digest()
+
+    def _sign(self, encrypted: bytes, segment: Segment) -> bytes:
+        return self._signature(encrypted, segment) + encrypted
         
-    def _verify_batch(self, data: bytes) -> bool:
+    def _verify(self, data: bytes, segment: Segment) -> bytes:
         signature, encrypted = data[:32], data[32:]
-        expected = hmac.new(self.hmac_key, encrypted, hashlib.sha256).digest()
-        return hmac.compare_digest(signature, expected) 
\ No newline at end of file
+        if not hmac.compare_digest(signature, self._signature(encrypted, segment)):
+            raise IntegrityError("Trace segment failed HMAC verification")
+        return encrypted
@@ -6,13 +6,19 @@ from kafka import KafkaConsumer
 import json
 
 class StreamProcessor:
-    def __init__(self, bootstrap_servers):
-        self.consumer = KafkaConsumer(
+    def __init__(self, bootstrap_servers=None, consumer=None):
+        """Args:
+            bootstrap_servers: Kafka brokers for the live `market-data` topic
+            consumer: Pre-built message source (e.g. a replay log), used
+                instead of connecting to Kafka
+        """
+        self.consumer = consumer if consumer is not None else KafkaConsumer(
             'market-data',
             bootstrap_servers=bootstrap_servers,
             value_deserializer=lambda v: json.loads(v.decode('utf-8'))
         )
         self.window_size = 100  # Data points per analysis window
+        self.latest_predictions = []
         
     def start_processing(self, model):
         """Process real-time data stream"""
@@ -26,6 +32,10 @@ class StreamProcessor:
                 self._update_dashboard(predictions)
                 window = []
 
+    def _update_dashboard(self, predictions):
+        """Publish the latest window predictions"""
+        self.latest_predictions = predictions
+
     def _extract_features(self, raw_data):
         """Convert raw market data to model features"""
         return {
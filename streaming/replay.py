@@ -0,0 +1,214 @@
+"""
+Deterministic replay of recorded market data
+Records `market-data` messages to a length-prefixed binary log and
+replays them into StreamProcessor for offline throughput benchmarks
+
+Usage:
+    python -m streaming.replay record market.log --servers kafka:9092 --limit 100000
+    python -m streaming.replay replay market.log --speed 0   # 0 = max speed
+"""
+import argparse
+import json
+import struct
+import time
+from collections import namedtuple
+
+import psutil
+
+from streaming.data_processor import StreamProcessor
+
+LOG_MAGIC = b'BFRL\x01'
+# Record header: kafka timestamp (ms), payload length
+RECORD_HEADER = struct.Struct('>qI')
+
+ReplayMessage = namedtuple('ReplayMessage', ['value', 'timestamp'])
+
+
+class StreamRecorder:
+    """Writes market data messages to a compact binary log"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def record(self, messages, limit: int = None) -> int:
+        """Append messages to the log
+        Args:
+            messages: Iterable of Kafka-style records (value, timestamp)
+            limit: Stop after this many messages
+        Returns:
+            int: Number of messages written
+        """
+        count = 0
+        with open(self.path, 'wb') as f:
+            f.write(LOG_MAGIC)
+            for message in messages:
+                payload = message.value
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+                timestamp = getattr(message, 'timestamp', None) or int(time.time() * 1000)
+                f.write(RECORD_HEADER.pack(timestamp, len(payload)))
+                f.write(payload)
+                count += 1
+                if limit and count >= limit:
+                    break
+        return count
+
+
+class ReplayConsumer:
+    """Iterates a recorded log as a drop-in for KafkaConsumer
+
+    speed=1.0 replays with the recorded inter-arrival gaps, speed=N
+    compresses them N times and speed=0 replays as fast as possible.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+
+    def __iter__(self):
+        start_wall = time.perf_counter()
+        first_ts = None
+        for timestamp, payload in self._read_records():
+            if self.speed:
+                if first_ts is None:
+                    first_ts = timestamp
+                due = (timestamp - first_ts) / 1000 / self.speed
+                delay = due - (time.perf_counter() - start_wall)
+                if delay > 0:
+                    time.sleep(delay)
+            yield ReplayMessage(json.loads(payload), timestamp)
+
+    def _read_records(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+                raise ValueError(f"Not a replay log: {self.path}")
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                timestamp, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return  # Truncated tail from an interrupted recording
+                yield timestamp, payload
+
+
+class _TimedModel:
+    """Wraps a model to time each window prediction"""
+
+    def __init__(self, model):
+        self.model = model
+        self.latencies = []
+        self.rss_samples = []
+        self._process = psutil.Process()
+
+    def predict(self, window):
+        start = time.perf_counter()
+        predictions = self.model.predict(window)
+        self.latencies.append(time.perf_counter() - start)
+        self.rss_samples.append(self._process.memory_info().rss)
+        return predictions
+
+
+class _NullModel:
+    """Constant model for measuring pipeline overhead alone"""
+
+    def predict(self, window):
+        return [0.0] * len(window)
+
+
+class _CountingIterator:
+    """Counts messages pulled from the underlying consumer"""
+
+    def __init__(self, source):
+        self.source = source
+        self.count = 0
+
+    def __iter__(self):
+        for message in self.source:
+            self.count += 1
+            yield message
+
+
+def run_replay(path: str, model=None, speed: float = 0, window_size: int = 100) -> dict:
+    """Replay a log through StreamProcessor and report throughput
+    Args:
+        path: Replay log written by StreamRecorder
+        model: Object with predict(window); defaults to a constant model
+        speed: Replay speed multiplier, 0 for max speed
+        window_size: Messages per analysis window
+    Returns:
+        dict: Sustained messages/s, window latency percentiles and RSS growth
+    """
+    timed = _TimedModel(model or _NullModel())
+    consumer = ReplayConsumer(path, speed=speed)
+    processor = StreamProcessor(consumer=_CountingIterator(consumer))
+    processor.window_size = window_size
+
+    rss_start = timed._process.memory_info().rss
+    start = time.perf_counter()
+    processor.start_processing(timed)
+    elapsed = time.perf_counter() - start
+    rss_end = timed._process.memory_info().rss
+
+    messages = processor.consumer.count
+    latencies = sorted(timed.latencies)
+    return {
+        'messages': messages,
+        'windows': len(latencies),
+        'elapsed_s': elapsed,
+        'messages_per_s': messages / elapsed if elapsed > 0 else 0.0,
+        'window_latency_ms': {
+            'p50': _percentile(latencies, 0.5) * 1000,
+            'p95': _percentile(latencies, 0.95) * 1000,
+            'p99': _percentile(latencies, 0.99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000
+        },
+        'memory': {
+            'rss_start_mb': rss_start / 1024**2,
+            'rss_end_mb': rss_end / 1024**2,
+            'rss_peak_mb': max(timed.rss_samples + [rss_end]) / 1024**2,
+            'growth_mb': (rss_end - rss_start) / 1024**2
+        }
+    }
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    record = sub.add_parser('record', help='Record market-data from Kafka')
+    record.add_argument('path')
+    record.add_argument('--servers', default='kafka:9092')
+    record.add_argument('--limit', type=int, default=100000)
+
+    replay = sub.add_parser('replay', help='Replay a log into StreamProcessor')
+    replay.add_argument('path')
+    replay.add_argument('--speed', type=float, default=0,
+                        help='1 = recorded pace, N = N times faster, 0 = max speed')
+    replay.add_argument('--window-size', type=int, default=100)
+    replay.add_argument('--model', help='joblib model path (default: constant model)')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        from kafka import KafkaConsumer
+        consumer = KafkaConsumer('market-data', bootstrap_servers=args.servers)
+        written = StreamRecorder(args.path).record(consumer, limit=args.limit)
+        print(f"Recorded {written} messages to {args.path}")
+    else:
+        model = None
+        if args.model:
+            import joblib
+            model = joblib.load(args.model)
+        report = run_replay(args.path, model, speed=args.speed, window_size=args.window_size)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()